@@ -3,8 +3,6 @@ import os
 import platform
 import sys
 
-from logging import getLogger
-
 if sys.version_info.major >= 3:
     # from urllib import request
     # urlretrieve = request.urlretrieve
@@ -15,8 +13,9 @@ else:
     from urllib2 import urlopen
 
 from voxboxor import mydirs
+from voxboxor.log import get_log
 
-logger = getLogger(__name__)
+logger = get_log("mainmenu")
 
 
 class ServerListMgr:
@@ -34,9 +33,8 @@ class ServerListMgr:
             self._load_list(path)
         else:
             if not quiet:
-                logger.warning(
-                    "There is no cached {} for url {}"
-                    .format(path, url))
+                logger.warning("There is no cached {} for url {}",
+                               path, url)
 
     def get_url(self, quiet=False):
         url = self._domain
@@ -86,7 +84,7 @@ class ServerListMgr:
         if not os.path.isdir(self._server_lists_dir()):
             os.makedirs(self._server_lists_dir())
         url = self.get_url()
-        logger.warning("Checking {}".format(url))
+        logger.warning("Checking {}", url)
         path = self._list_path(self._domain)
         used_cache = True
         if not os.path.isfile(path):
@@ -97,7 +95,7 @@ class ServerListMgr:
             with open(path, "wb") as outs:
                 outs.write(data_bytes)
         else:
-            logger.warning("Using cached {}".format(path))
+            logger.warning("Using cached {}", path)
         self._load_list(path, used_cache=used_cache)
         return True
 
@@ -13,8 +13,6 @@ else:
     import ttk  # type: ignore
     import tkMessageBox as messagebox
 
-from logging import getLogger
-
 if __name__ == '__main__':
     MAINMENU_DIR = os.path.dirname(os.path.realpath(__file__))
     BAKEDIN_DIR = os.path.dirname(MAINMENU_DIR)
@@ -23,10 +21,13 @@ if __name__ == '__main__':
 
 from bakedin.mainmenu.serverlistmgr import serverlistmgr
 
+from voxboxor import parse_command_line
+from voxboxor.log import get_log
+
 # Based on "Chain of Responsibility" example
 #   by martineau on https://stackoverflow.com/a/26373337/4541104
 
-logger = getLogger(__name__)
+logger = get_log("mainmenu")
 
 
 class Message(object):
@@ -128,7 +129,7 @@ class TabOnline(tk.Frame):
                 self.server_widgets.append(label)
             self.row += 1
             count += 1
-        logger.warning("Loaded {} servers.".format(count))
+        logger.warning("Loaded {} servers.", count)
 
     def message_downstream(self, message):
         for widget in self.widgets:
@@ -155,6 +156,8 @@ class Widget(tk.Button):
 
 
 def main():
+    if parse_command_line() is None:
+        return 1
     root = tk.Tk()
     root.title("VoxBoxor")
     app = TabOnline(root)
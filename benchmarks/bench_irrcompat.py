@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+'''
+Measure converting a million positions from engine units to Minetest
+meters one tuple at a time (before) and as one array (after), with an
+(N, 3) NumPy array if NumPy is installed.
+
+Usage: bench_irrcompat.py [count]
+'''
+from __future__ import print_function
+from __future__ import division
+import os
+import random
+import sys
+import time
+
+from array import array
+
+BENCHMARKS_DIR = os.path.dirname(os.path.realpath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+
+if __name__ == "__main__":
+    sys.path.insert(0, REPO_DIR)
+
+from voxboxor import irrcompat  # noqa: E402
+from voxboxor.irrcompat import (  # noqa: E402
+    irr_to_mt,
+)
+
+
+def _per_s(func, count):
+    start = time.perf_counter()
+    func()
+    return count / (time.perf_counter() - start)
+
+
+def bench_irrcompat(count=1000000, seed=0):
+    '''
+    Measure positions converted per second.
+    '''
+    rng = random.Random(seed)
+    positions = [(rng.uniform(-300000, 300000), rng.uniform(-300000, 300000),
+                  rng.uniform(-300000, 300000)) for _ in range(count)]
+    flat = array('f', [v for pos in positions for v in pos])
+
+    def tuples():
+        for pos in positions:
+            irr_to_mt(pos)
+
+    result = {
+        'count': count,
+        'before': _per_s(tuples, count),
+        'array': _per_s(lambda: irr_to_mt(flat), count),
+        'array_in_place': _per_s(lambda: irr_to_mt(flat, out=flat), count),
+    }
+    numpy = irrcompat.numpy
+    if numpy is not None:
+        ndarray = numpy.array(positions, dtype=numpy.float32)
+        result['numpy'] = _per_s(lambda: irr_to_mt(ndarray), count)
+        result['numpy_in_place'] = _per_s(
+            lambda: irr_to_mt(ndarray, out=ndarray), count)
+    return result
+
+
+def main():
+    count = 1000000
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    result = bench_irrcompat(count)
+    print("{count:,} positions: tuples {before:,.0f} -> array('f')"
+          " {array:,.0f} (in place {array_in_place:,.0f})"
+          " positions/s".format(**result))
+    if 'numpy' in result:
+        print("NumPy (N, 3) float32: {numpy:,.0f} (in place"
+              " {numpy_in_place:,.0f}) positions/s".format(**result))
+    else:
+        print("NumPy is not installed (array('f') was converted without"
+              " it).")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
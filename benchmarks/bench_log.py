@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+'''
+Measure the cost of a disabled debug message on the packet path, built
+with str.format before calling echo2 (before) and passed as lazy
+arguments to a voxboxor.log Log (after).
+
+Usage: bench_log.py
+'''
+from __future__ import print_function
+from __future__ import division
+import os
+import sys
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.realpath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+
+if __name__ == "__main__":
+    sys.path.insert(0, REPO_DIR)
+
+from voxboxor import (  # noqa: E402
+    echo2,
+)
+from voxboxor.log import (  # noqa: E402
+    get_log,
+)
+
+
+def _per_s(func, count):
+    start = time.perf_counter()
+    func()
+    return count / (time.perf_counter() - start)
+
+
+def bench_log(number=1000000):
+    '''
+    Measure disabled debug messages per second (the verbosity is 0).
+    '''
+    log = get_log("network")
+    payload = b"x" * 100
+    peer_id = 2
+    channel = 0
+    calls = range(number)
+
+    def formatted():
+        for _ in calls:
+            echo2("Ignored {} byte(s) from peer {} on channel {}"
+                  "".format(len(payload), peer_id, channel))
+
+    def lazy():
+        for _ in calls:
+            log.debug("Ignored {} byte(s) from peer {} on channel {}",
+                      len(payload), peer_id, channel)
+
+    return {
+        'number': number,
+        'before': _per_s(formatted, number),
+        'after': _per_s(lazy, number),
+    }
+
+
+def main():
+    result = bench_log()
+    print("{number:,} disabled debug messages: {before:,.0f} ->"
+          " {after:,.0f} messages/s".format(**result))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
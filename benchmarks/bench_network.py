@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+'''
+Measure how many packets per second voxboxor.network can encode and
+decode.
+
+The "before" numbers resolve the packet format for every packet (as
+get_packet_bytes and bytes_to_packet did before packet codecs were
+compiled once), and the "after" numbers use the public functions.
+'''
+from __future__ import print_function
+from __future__ import division
+import os
+import sys
+import struct
+import timeit
+import tracemalloc
+
+BENCHMARKS_DIR = os.path.dirname(os.path.realpath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+
+if __name__ == "__main__":
+    sys.path.insert(0, REPO_DIR)
+
+from voxboxor.network.connection import (  # noqa: E402
+    get_packet_format,
+    get_packet_bytes,
+    bytes_to_packet,
+    to_c_like,
+    get_packet_codec,
+    get_packets_bytes,
+    bytes_to_columns,
+    MinetestPacket,
+)
+
+CASES = (
+    ("client", "connect", {}),
+    ("server", "connected", {'peer_id_new': 2}),
+    ("client", "disconnect", {'sender_peer_id': 2}),
+)
+
+
+def _uncompiled_get_packet_bytes(origin, purpose, values):
+    pack, pack_names, pack_values, fieldsdef = get_packet_format(
+        origin,
+        purpose,
+    )
+    pack_values = list(pack_values)
+    for i in range(len(pack_values)):
+        if pack_values[i] is None:
+            pack_values[i] = to_c_like(pack_names[i],
+                                       values[pack_names[i]])
+    return struct.Struct(">"+pack).pack(*pack_values)
+
+
+def _uncompiled_bytes_to_packet(origin, purpose, packet_bytes):
+    pack, pack_names, pack_values, fieldsdef = get_packet_format(
+        origin,
+        purpose,
+    )
+    values = struct.unpack(">"+pack, packet_bytes)
+    return MinetestPacket(pack_names, values, fieldsdef)
+
+
+class _DictPacket:
+    '''
+    A packet that stores its layout in its own __dict__ (as every
+    MinetestPacket did before packet classes were generated per layout).
+    '''
+    def __init__(self, names, values, fieldsdef, payload=None):
+        self.names = names
+        self.values = values
+        self.fieldsdef = fieldsdef
+        self.payload = payload
+
+
+def _pps_samples(func, number, repeat=3):
+    '''
+    Measure calls per second repeat times (one value per run of number
+    calls).
+    '''
+    return [number / seconds
+            for seconds in timeit.repeat(func, number=number,
+                                         repeat=repeat)]
+
+
+def _pps(func, number):
+    return max(_pps_samples(func, number))
+
+
+def bench_codec(number=20000):
+    '''
+    Measure packets per second for encoding and decoding each case.
+
+    Returns:
+    a list of dicts, one for each case.
+    '''
+    results = []
+    for origin, purpose, values in CASES:
+        packet_bytes = get_packet_bytes(origin, purpose, values)
+        results.append({
+            'packet': "{} {}".format(origin, purpose),
+            'encode_before': _pps(
+                lambda: _uncompiled_get_packet_bytes(origin, purpose,
+                                                     values),
+                number,
+            ),
+            'encode_after': _pps(
+                lambda: get_packet_bytes(origin, purpose, values),
+                number,
+            ),
+            'decode_before': _pps(
+                lambda: _uncompiled_bytes_to_packet(origin, purpose,
+                                                    packet_bytes),
+                number,
+            ),
+            'decode_after': _pps(
+                lambda: bytes_to_packet(origin, purpose, packet_bytes),
+                number,
+            ),
+        })
+    return results
+
+
+def _bytes_per_packet(make, count):
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    packets = [make() for _ in range(count)]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff
+               for stat in after.compare_to(before, 'filename'))
+    size -= sys.getsizeof(packets)
+    return size / count
+
+
+def bench_memory(count=10000):
+    '''
+    Measure the memory used by each decoded packet (including its
+    values tuple).
+
+    Returns:
+    a list of dicts, one for each case.
+    '''
+    results = []
+    for origin, purpose, values in CASES:
+        packet_bytes = get_packet_bytes(origin, purpose, values)
+        codec = get_packet_codec(origin, purpose)
+        results.append({
+            'packet': "{} {}".format(origin, purpose),
+            'bytes_before': _bytes_per_packet(
+                lambda: _DictPacket(codec.names,
+                                    codec.struct.unpack(packet_bytes),
+                                    codec.fieldsdef),
+                count,
+            ),
+            'bytes_after': _bytes_per_packet(
+                lambda: bytes_to_packet(origin, purpose, packet_bytes),
+                count,
+            ),
+        })
+    return results
+
+
+def bench_batch(count=10000):
+    '''
+    Measure packets per second for building and analyzing a burst of
+    s_connected packets one at a time and in batches.
+    '''
+    values_list = [{'peer_id_new': i % 65535 + 2} for i in range(count)]
+    columns = {'peer_id_new': [values['peer_id_new']
+                               for values in values_list]}
+    buffer, offsets = get_packets_bytes("server", "connected", columns)
+    size = offsets.step
+    return {
+        'packet': "server connected",
+        'count': count,
+        'encode_single': _pps(
+            lambda: b"".join(get_packet_bytes("server", "connected", v)
+                             for v in values_list),
+            1,
+        ) * count,
+        'encode_dicts': _pps(
+            lambda: get_packets_bytes("server", "connected",
+                                      values_list),
+            1,
+        ) * count,
+        'encode_columns': _pps(
+            lambda: get_packets_bytes("server", "connected", columns),
+            1,
+        ) * count,
+        'decode_single': _pps(
+            lambda: [bytes_to_packet("server", "connected",
+                                     buffer[offset:offset+size])
+                     for offset in offsets],
+            1,
+        ) * count,
+        'decode_columns': _pps(
+            lambda: bytes_to_columns("server", "connected", buffer),
+            1,
+        ) * count,
+    }
+
+
+def main():
+    for result in bench_codec():
+        print("{packet}:".format(**result))
+        for direction in ("encode", "decode"):
+            before = result[direction+"_before"]
+            after = result[direction+"_after"]
+            print("  {}: {:,.0f} -> {:,.0f} packets/s ({:.1f}x)"
+                  "".format(direction, before, after, after / before))
+    for result in bench_memory():
+        print("{packet}: {bytes_before:.0f} -> {bytes_after:.0f}"
+              " bytes/packet".format(**result))
+    result = bench_batch()
+    print("{packet} burst of {count}:".format(**result))
+    for key in ("encode_single", "encode_dicts", "encode_columns",
+                "decode_single", "decode_columns"):
+        print("  {}: {:,.0f} packets/s".format(key, result[key]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+'''
+Measure reading a large minetest.conf and getting settings through the
+layers (SL_DEFAULTS, SL_GAME, SL_GLOBAL).
+
+Usage: bench_settings.py [minetest.conf]
+
+Without a file, a config like a server's minetest.conf (many mod
+settings, comments, noise parameter groups and multiline values) is
+generated.
+'''
+from __future__ import print_function
+from __future__ import division
+import os
+import random
+import sys
+import tempfile
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.realpath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+
+if __name__ == "__main__":
+    sys.path.insert(0, REPO_DIR)
+
+from voxboxor.settings import (  # noqa: E402
+    Settings,
+    SettingsHierarchy,
+    SettingsLayer,
+)
+
+NOISE_PARAMS = """{
+	offset = 0
+	scale = 1
+	spread = (600, 600, 600)
+	seed = 5934
+	octaves = 5
+	persistence = 0.6
+	lacunarity = 2.0
+	flags = eased
+	}
+"""
+
+
+def generate_config(path, mod_count=200, settings_per_mod=50, seed=0):
+    '''
+    Write a generated config.
+
+    Returns:
+    the number of lines.
+    '''
+    rng = random.Random(seed)
+    lines = ["# This file is written by the server. Comments are kept.\n"]
+    for mod in range(mod_count):
+        lines.append("\n# Settings of mod{}\n".format(mod))
+        for i in range(settings_per_mod):
+            name = "mod{}.setting_{}".format(mod, i)
+            kind = rng.random()
+            if kind < 0.2:
+                lines.append("# {} is described here.\n".format(name))
+            if kind < 0.02:
+                lines.append(name + " = " + NOISE_PARAMS)
+            elif kind < 0.04:
+                lines.append(name + ' = """\nfirst line\nsecond line\n"""\n')
+            elif kind < 0.4:
+                lines.append("{} = {}\n".format(name, rng.randint(0, 1000)))
+            elif kind < 0.7:
+                lines.append("{} = {}\n".format(name, rng.random()))
+            else:
+                lines.append("{} = {}\n".format(
+                    name, rng.choice(("true", "false", "some text"))))
+    text = "".join(lines)
+    with open(path, 'w') as stream:
+        stream.write(text)
+    return text.count("\n")
+
+
+def _layers(path):
+    h = SettingsHierarchy()
+    defaults = Settings(h=h, settings_layer=SettingsLayer.SL_DEFAULTS)
+    game = Settings(h=h, settings_layer=SettingsLayer.SL_GAME)
+    settings = Settings(h=h, settings_layer=SettingsLayer.SL_GLOBAL)
+    defaults.readConfigFile(path)
+    names = defaults.getNames()
+    # Override a tenth in the game and a tenth in the world (a server's
+    #   own minetest.conf mostly relies on defaults).
+    for name in names[::10]:
+        game.set(name, "game")
+    for name in names[5::10]:
+        settings.set(name, "global")
+    return settings, names
+
+
+def _per_s(func, count):
+    start = time.perf_counter()
+    func()
+    return count / (time.perf_counter() - start)
+
+
+def bench_settings(path, get_rounds=20):
+    '''
+    Measure lines read per second, gets per second from the SL_GLOBAL
+    layer by walking down the layers (before) and with the merged view
+    (after), and getFloat calls per second parsing the string each time
+    (before) and with the typed value cache (after).
+    '''
+    with open(path, 'r') as stream:
+        line_count = sum(1 for _ in stream)
+    settings = Settings()
+    read = _per_s(lambda: settings.readConfigFile(path), line_count)
+    settings, names = _layers(path)
+    lookups = names * get_rounds
+
+    def walk():
+        find = settings._findEntry
+        for name in lookups:
+            find(name)
+
+    def merged():
+        get = settings._getEntry
+        for name in lookups:
+            get(name)
+
+    float_names = []
+    for name in names:
+        try:
+            settings.getFloat(name)
+        except (ValueError, KeyError):
+            continue
+        float_names.append(name)
+    float_lookups = float_names * get_rounds
+
+    def parse_each():
+        get = settings.get
+        for name in float_lookups:
+            float(get(name))
+
+    def cached():
+        get_float = settings.getFloat
+        for name in float_lookups:
+            get_float(name)
+
+    settings._getMerged()
+    return {
+        'lines': line_count,
+        'settings': len(names),
+        'read': read,
+        'get_before': _per_s(walk, len(lookups)),
+        'get_after': _per_s(merged, len(lookups)),
+        'get_float_before': _per_s(parse_each, len(float_lookups)),
+        'get_float_after': _per_s(cached, len(float_lookups)),
+    }
+
+
+def main():
+    if len(sys.argv) > 1:
+        result = bench_settings(sys.argv[1])
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "minetest.conf")
+            generate_config(path)
+            result = bench_settings(path)
+    print("{lines:,} lines ({settings:,} settings): read {read:,.0f}"
+          " lines/s, get {get_before:,.0f} -> {get_after:,.0f} gets/s,"
+          " getFloat {get_float_before:,.0f} -> {get_float_after:,.0f}"
+          " gets/s".format(**result))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+'''
+Measure split packet throughput on multi-megabyte payloads.
+'''
+from __future__ import print_function
+from __future__ import division
+import os
+import sys
+import random
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.realpath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+
+if __name__ == "__main__":
+    sys.path.insert(0, REPO_DIR)
+
+from voxboxor.network.connection import (  # noqa: E402
+    MAX_PACKET_SIZE,
+    decode_packet,
+)
+from voxboxor.network.reliable import (  # noqa: E402
+    ReliableConnection,
+)
+from voxboxor.network.split import (  # noqa: E402
+    SplitReassembler,
+    split_payload,
+)
+
+MIB = 1024 * 1024
+
+
+def _concatenate(chunks):
+    # Collect chunks by number then concatenate them one at a time.
+    received = {}
+    for chunk_num, chunk in chunks:
+        received[chunk_num] = bytes(chunk)
+    data = b""
+    for chunk_num in range(len(received)):
+        data += received[chunk_num]
+    return data
+
+
+def _reassemble(chunks):
+    reassembler = SplitReassembler(memory_budget=256 * MIB)
+    for chunk_num, chunk in chunks:
+        result = reassembler.add(0, len(chunks), chunk_num, chunk, 0.0)
+    return result
+
+
+def _transfer(payload):
+    client = ReliableConnection("client", 2,
+                                window_size=0x8000)
+    server = ReliableConnection("server", 1)
+    client.send(0, payload)
+    now = 0.0
+    results = []
+    while not results:
+        for data in client.datagrams(now):
+            results += server.receive(decode_packet(data), now)
+        for data in server.datagrams(now):
+            client.receive(decode_packet(data), now)
+        now += 0.001
+    return results[0][1]
+
+
+def _mib_per_s(func, size):
+    start = time.perf_counter()
+    func()
+    return size / MIB / (time.perf_counter() - start)
+
+
+def bench_split(sizes=(1 * MIB, 4 * MIB, 16 * MIB)):
+    '''
+    For each payload size, measure MiB/s for splitting, for
+    reassembling shuffled chunks with repeated concatenation (before)
+    and with SplitReassembler (after), and for a whole transfer between
+    two ReliableConnection objects (without sockets).
+    '''
+    rng = random.Random(0)
+    chunk_size = MAX_PACKET_SIZE - 17
+    results = []
+    for size in sizes:
+        payload = rng.randbytes(size)
+        chunks = list(enumerate(split_payload(payload, chunk_size)))
+        rng.shuffle(chunks)
+        assert _concatenate(chunks) == payload
+        assert _reassemble(chunks) == payload
+        assert _transfer(payload) == payload
+        results.append({
+            'size_mib': size / MIB,
+            'chunks': len(chunks),
+            'split': _mib_per_s(
+                lambda: split_payload(payload, chunk_size), size),
+            'reassemble_before': _mib_per_s(
+                lambda: _concatenate(chunks), size),
+            'reassemble_after': _mib_per_s(
+                lambda: _reassemble(chunks), size),
+            'transfer': _mib_per_s(lambda: _transfer(payload), size),
+        })
+    return results
+
+
+def main():
+    for result in bench_split():
+        print("{size_mib:.0f} MiB ({chunks} chunks): split {split:,.0f}"
+              " MiB/s, reassemble {reassemble_before:,.0f} ->"
+              " {reassemble_after:,.0f} MiB/s, transfer {transfer:,.1f}"
+              " MiB/s".format(**result))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+'''
+Measure handshake latency and throughput of voxboxor.network.transport
+over loopback with many concurrent clients in one event loop.
+'''
+from __future__ import print_function
+from __future__ import division
+import os
+import sys
+import asyncio
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.realpath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+
+if __name__ == "__main__":
+    sys.path.insert(0, REPO_DIR)
+
+from voxboxor.network.transport import (  # noqa: E402
+    create_server,
+    open_connection,
+)
+
+
+def _percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1,
+                             int(len(sorted_values) * fraction))]
+
+
+async def _handshakes(count):
+    server_transport, server = await create_server("127.0.0.1", 0)
+    host, port = server_transport.get_extra_info('sockname')[:2]
+
+    async def timed_connection():
+        start = time.perf_counter()
+        connection = await open_connection(host, port)
+        return connection, time.perf_counter() - start
+
+    try:
+        start = time.perf_counter()
+        results = await asyncio.gather(*(timed_connection()
+                                         for _ in range(count)))
+        seconds = time.perf_counter() - start
+        for (_, client), _ in results:
+            client.disconnect()
+        # c_disconnect is unreliable, so don't wait forever.
+        for _ in range(100):
+            if not server.peers:
+                break
+            await asyncio.sleep(0.01)
+        lost = len(server.peers)
+    finally:
+        server_transport.close()
+    latencies = sorted(latency for _, latency in results)
+    return {
+        'peers': count,
+        'lost_disconnects': lost,
+        'handshakes_per_s': count / seconds,
+        'latency_p50_ms': _percentile(latencies, 0.5) * 1000,
+        'latency_p99_ms': _percentile(latencies, 0.99) * 1000,
+    }
+
+
+def bench_handshake(levels=(1, 100, 1000, 4000)):
+    '''
+    Connect and disconnect count clients concurrently for each count in
+    levels.
+
+    Returns:
+    a list of dicts, one for each level.
+    '''
+    return [asyncio.run(_handshakes(count)) for count in levels]
+
+
+def main():
+    for result in bench_handshake():
+        print("{peers} peers: {handshakes_per_s:,.0f} handshakes/s,"
+              " p50 {latency_p50_ms:.2f} ms, p99 {latency_p99_ms:.2f} ms,"
+              " {lost_disconnects} lost disconnect(s)"
+              "".format(**result))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+'''
+Run the network benchmark suite and write the results as JSON, or
+compare them to a stored baseline to catch regressions.
+
+Usage:
+    python benchmarks/run.py [--quick] [--repeats 5] [--output results.json]
+    python benchmarks/run.py --baseline baseline.json [--threshold 0.1]
+
+Each metric is measured several times (See REPEATS) and records the
+median, the spread (the range of the samples relative to the median)
+and whether higher is better, so the comparison knows which direction
+is a regression. A metric only regressed if it got worse by more than
+the threshold and by more than the spread of both runs, so noise isn't
+reported as a regression. The exit code is 1 if any metric regressed.
+A quick run can only be compared to a quick baseline (and a full run to
+a full one), since they use different iteration counts.
+'''
+from __future__ import print_function
+from __future__ import division
+import os
+import sys
+import argparse
+import json
+import platform
+import statistics
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.realpath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+
+if __name__ == "__main__":
+    sys.path.insert(0, REPO_DIR)
+
+from bench_network import (  # noqa: E402
+    CASES,
+    _pps_samples,
+)
+from bench_transport import (  # noqa: E402
+    bench_handshake,
+)
+from voxboxor.network.connection import (  # noqa: E402
+    get_packet_bytes,
+    bytes_to_packet,
+)
+
+FORMAT_VERSION = 2
+DEFAULT_THRESHOLD = 0.1  # a 10% slowdown is a regression
+REPEATS = 5  # samples of each metric
+HANDSHAKE_LEVELS = (1, 100, 1000)
+QUICK_HANDSHAKE_LEVELS = (1, 100)
+# Latency percentiles need this many handshakes at once to mean more
+#   than one sample (the 1-peer level only reports the rate).
+MIN_LATENCY_PEERS = 100
+
+
+def _metric(samples, unit, higher_is_better=True):
+    value = statistics.median(samples)
+    spread = 0.0
+    if value:
+        spread = (max(samples) - min(samples)) / abs(value)
+    return {
+        'value': value,
+        'spread': spread,
+        'unit': unit,
+        'higher_is_better': higher_is_better,
+    }
+
+
+def bench_get_packet_bytes(number, repeats):
+    '''
+    Measure encoding each case with get_packet_bytes.
+    '''
+    return {
+        "get_packet_bytes[{} {}]".format(origin, purpose): _metric(
+            _pps_samples(lambda: get_packet_bytes(origin, purpose, values),
+                         number, repeats),
+            "packets/s",
+        )
+        for origin, purpose, values in CASES
+    }
+
+
+def bench_bytes_to_packet(number, repeats):
+    '''
+    Measure decoding each case with bytes_to_packet.
+    '''
+    results = {}
+    for origin, purpose, values in CASES:
+        packet_bytes = get_packet_bytes(origin, purpose, values)
+        results["bytes_to_packet[{} {}]".format(origin, purpose)] = \
+            _metric(
+                _pps_samples(lambda: bytes_to_packet(origin, purpose,
+                                                     packet_bytes),
+                             number, repeats),
+                "packets/s",
+            )
+    return results
+
+
+def bench_packet_get(number, repeats):
+    '''
+    Measure looking up a field of a decoded packet by name.
+    '''
+    packet = bytes_to_packet(
+        "server", "connected",
+        get_packet_bytes("server", "connected", {'peer_id_new': 2}),
+    )
+    return {
+        "MinetestPacket.get[peer_id_new]": _metric(
+            _pps_samples(lambda: packet.get('peer_id_new'), number,
+                         repeats),
+            "calls/s",
+        ),
+        "MinetestPacket.get[basic sender_peer_id]": _metric(
+            _pps_samples(lambda: packet.get('sender_peer_id',
+                                            category='basic'),
+                         number, repeats),
+            "calls/s",
+        ),
+    }
+
+
+def bench_handshakes(levels, repeats):
+    '''
+    Measure loopback handshakes at each concurrency level.
+    '''
+    runs = [bench_handshake(levels) for _ in range(repeats)]
+    results = {}
+    for level_results in zip(*runs):
+        peers = level_results[0]['peers']
+        prefix = "handshake[{} peers]".format(peers)
+        results[prefix+" rate"] = _metric(
+            [result['handshakes_per_s'] for result in level_results],
+            "handshakes/s",
+        )
+        if peers < MIN_LATENCY_PEERS:
+            continue
+        results[prefix+" p50"] = _metric(
+            [result['latency_p50_ms'] for result in level_results],
+            "ms", higher_is_better=False,
+        )
+        results[prefix+" p99"] = _metric(
+            [result['latency_p99_ms'] for result in level_results],
+            "ms", higher_is_better=False,
+        )
+    return results
+
+
+SUITES = (
+    ("get_packet_bytes", bench_get_packet_bytes),
+    ("bytes_to_packet", bench_bytes_to_packet),
+    ("MinetestPacket.get", bench_packet_get),
+    ("handshake", bench_handshakes),
+)
+
+
+def run_suite(quick=False, only=None, repeats=REPEATS):
+    '''
+    Run the benchmarks.
+
+    Keyword arguments:
+    quick -- run fewer iterations and concurrency levels (noisier)
+    only -- a collection of suite names to run (None for all)
+    repeats -- how many times to measure each metric
+
+    Returns:
+    a dict that can be saved as JSON.
+    '''
+    number = 20000 if quick else 100000
+    levels = QUICK_HANDSHAKE_LEVELS if quick else HANDSHAKE_LEVELS
+    metrics = {}
+    for name, bench in SUITES:
+        if (only is not None) and (name not in only):
+            continue
+        if name == "handshake":
+            metrics.update(bench(levels, repeats))
+        else:
+            metrics.update(bench(number, repeats))
+    return {
+        'format': FORMAT_VERSION,
+        'time': time.time(),
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'quick': quick,
+        'repeats': repeats,
+        'metrics': metrics,
+    }
+
+
+def check_comparable(results, baseline):
+    '''
+    Raise ValueError if results (or the options of a run, as a dict
+    with 'format' and 'quick') can't be compared to baseline.
+    '''
+    if baseline.get('format') != results['format']:
+        raise ValueError("The baseline has format {} but this version"
+                         " writes format {} (run it again)."
+                         "".format(baseline.get('format'),
+                                   results['format']))
+    if baseline['quick'] != results['quick']:
+        raise ValueError("A {} run can't be compared to a {} baseline"
+                         " (the iteration counts differ)."
+                         "".format("quick" if results['quick'] else "full",
+                                   "quick" if baseline['quick']
+                                   else "full"))
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    '''
+    Compare results to baseline (both in the format of run_suite).
+
+    Returns:
+    a list of (name, baseline_value, value, change, noise, regressed)
+    tuples for every metric in both, where change is the relative
+    improvement (negative is worse, whichever direction is better for
+    the metric), noise is the sum of the spreads of both runs, and
+    regressed is True if change is worse than both -threshold and
+    -noise.
+
+    Raises:
+    ValueError if the runs can't be compared (See check_comparable).
+    '''
+    check_comparable(results, baseline)
+    rows = []
+    old_metrics = baseline['metrics']
+    for name, metric in sorted(results['metrics'].items()):
+        old = old_metrics.get(name)
+        if (old is None) or not old['value']:
+            continue
+        change = (metric['value'] - old['value']) / old['value']
+        if not metric['higher_is_better']:
+            change = -change
+        noise = old['spread'] + metric['spread']
+        rows.append((name, old['value'], metric['value'], change, noise,
+                     change < -max(threshold, noise)))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark voxboxor.network and write JSON.",
+    )
+    parser.add_argument("--output", "-o",
+                        help="Write the results to this JSON file"
+                             " (otherwise print them).")
+    parser.add_argument("--baseline", "-b",
+                        help="Compare to this JSON file from an earlier"
+                             " run.")
+    parser.add_argument("--threshold", "-t", type=float,
+                        default=DEFAULT_THRESHOLD,
+                        help="The relative slowdown that counts as a"
+                             " regression (default: %(default)s).")
+    parser.add_argument("--quick", action="store_true",
+                        help="Run fewer iterations.")
+    parser.add_argument("--repeats", "-r", type=int, default=REPEATS,
+                        help="Measure each metric this many times"
+                             " (default: %(default)s).")
+    parser.add_argument("--only", action="append",
+                        choices=[name for name, _ in SUITES],
+                        help="Run only this suite (may be repeated).")
+    args = parser.parse_args()
+    if args.repeats < 1:
+        parser.error("--repeats must be at least 1.")
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r') as stream:
+            baseline = json.load(stream)
+        # Check before spending time on the benchmarks.
+        try:
+            check_comparable({'format': FORMAT_VERSION,
+                              'quick': args.quick}, baseline)
+        except ValueError as ex:
+            parser.error(str(ex))
+
+    results = run_suite(quick=args.quick, only=args.only,
+                        repeats=args.repeats)
+    if args.output:
+        with open(args.output, 'w') as stream:
+            json.dump(results, stream, indent=2, sort_keys=True)
+    elif not args.baseline:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        print()
+    if baseline is None:
+        return 0
+    regressed = 0
+    for name, old, new, change, noise, is_regression in compare(
+            results, baseline, threshold=args.threshold):
+        print("{} {}: {:,.2f} -> {:,.2f} ({:+.1%}, noise {:.1%})"
+              "".format("REGRESSED" if is_regression else "ok",
+                        name, old, new, change, noise))
+        regressed += is_regression
+    if regressed:
+        print("{} metric(s) regressed more than {:.0%} and more than"
+              " their noise".format(regressed, args.threshold))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
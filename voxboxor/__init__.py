@@ -24,49 +24,106 @@ from __future__ import print_function
 from __future__ import division
 import sys
 import os
-import platform
 
-# see <https://stackoverflow.com/questions/5574702/how-to-print-to-stderr-in-python>
-verbosity = 0
-for argI in range(1, len(sys.argv)):
-    arg = sys.argv[argI]
-    if arg.startswith("--"):
-        if arg == "--verbose":
-            verbosity = 1
-        elif arg == "--debug":
-            verbosity = 2
+verbosity = 0  # See parse_command_line
 
 
 def set_verbosity(verbosity_level):
+    '''
+    Set the verbosity of echo1 and echo2 and the level of each
+    voxboxor.log subsystem that doesn't have its own level.
+    '''
     global verbosity
     verbosity = verbosity_level
+    log = sys.modules.get('voxboxor.log')
+    if log is not None:  # otherwise it reads verbosity when imported
+        log.set_verbosity(verbosity_level)
+
+
+def parse_command_line(argv=None, allowed_options=None):
+    '''
+    Parse the command line into the global SL_COMMANDLINE settings
+    layer (which overrides SL_GLOBAL) and set the verbosity to 1 if
+    there is --verbose or 2 if there is --debug.
+
+    Programs call this once at startup (importing voxboxor doesn't read
+    sys.argv).
+
+    Keyword arguments:
+    argv -- the arguments (default: sys.argv)
+    allowed_options -- a dict of ValueSpec for options other than
+                       verbose and debug
+
+    Returns:
+    the SL_COMMANDLINE Settings object, or None if an argument isn't
+    valid (after showing an error).
+    '''
+    from voxboxor.settings import (
+        Settings,
+        SettingsLayer,
+        ValueSpec,
+        ValueType,
+    )
+    if argv is None:
+        argv = sys.argv
+    options = {
+        'verbose': ValueSpec(ValueType.VALUETYPE_FLAG,
+                             "Show more messages"),
+        'debug': ValueSpec(ValueType.VALUETYPE_FLAG,
+                           "Show debugging messages"),
+    }
+    if allowed_options:
+        options.update(allowed_options)
+    settings = Settings.getLayer(SettingsLayer.SL_COMMANDLINE)
+    if settings is None:
+        settings = Settings.createLayer(SettingsLayer.SL_COMMANDLINE)
+    if not settings.parseCommandLine(argv, options):
+        return None
+    if settings.getFlag("debug"):
+        set_verbosity(2)
+    elif settings.getFlag("verbose"):
+        set_verbosity(1)
+    return settings
+
+
+# The echo functions take arguments like print and log them to the
+#   voxboxor logger (shown on stderr by default). New code should use
+#   voxboxor.log instead, which only formats enabled messages.
+# see <https://stackoverflow.com/questions/5574702/how-to-print-to-stderr-in-python>
+
+_echo = None  # voxboxor.log.echo (imported by the first message)
+
+
+def _load_echo():
+    global _echo
+    from voxboxor.log import echo
+    _echo = echo
+    return echo
 
 
 def echo0(*args, **kwargs):
-    print(*args, file=sys.stderr, **kwargs)
+    echo = _echo
+    if echo is None:
+        echo = _load_echo()
+    echo(30, args, kwargs)  # WARNING
+
 
 def echo1(*args, **kwargs):
     if verbosity < 1:
         return
-    print(*args, file=sys.stderr, **kwargs)
+    echo = _echo
+    if echo is None:
+        echo = _load_echo()
+    echo(20, args, kwargs)  # INFO
+
 
 def echo2(*args, **kwargs):
     if verbosity < 2:
         return
-    print(*args, file=sys.stderr, **kwargs)
-
-from voxboxor.settings import Settings
-
-
-myPath = os.path.realpath(__file__)
-myPackage = os.path.split(myPath)[0]
-myRepo = os.path.split(myPackage)[0]
-repos = os.path.split(myRepo)[0]
-me = '__init__.py'
-
-if not os.path.isfile(os.path.join(myPackage, me)):
-    raise RuntimeError('{} is not in package {}.'.format(me, myPackage))
-
+    echo = _echo
+    if echo is None:
+        echo = _load_echo()
+    echo(10, args, kwargs)  # DEBUG
 
 loaded_mod_list = []
 
@@ -76,36 +133,105 @@ new_mod_list = []
 
 user_excluded_mod_count = 0
 
-profile_path = None
-appdata_path = None
-sysdirs = {}
-if "windows" in platform.system().lower():
-    if 'USERPROFILE' in os.environ:
-        profile_path = os.environ['USERPROFILE']
-        appdatas_path = os.path.join(profile_path, "AppData")
-        appdata_path = os.path.join(appdatas_path, "Local")
-        sysdirs['caches'] = os.path.join(appdatas_path, "Local")
-    else:
-        raise ValueError("ERROR: The USERPROFILE variable is missing"
-                         " though platform.system() is {}."
-                         "".format(platform.system()))
-else:
-    if 'HOME' in os.environ:
-        profile_path = os.environ['HOME']
-        appdata_path = os.path.join(profile_path, ".config")
-        sysdirs['caches'] = os.path.join(profile_path, ".cache")
-    else:
-        raise ValueError("ERROR: The HOME variable is missing"
-                         " though the platform {} is not Windows."
-                         "".format(platform.system()))
-
 luid = 'voxboxor'  # Locally-unique identifier
 # (LUID should be unique among names of packages on various distros)
 
-mydirs = {
-    'cache': os.path.join(sysdirs['caches'], luid)
+
+def _load_paths():
+    '''
+    Set the package paths (myPath, myPackage, myRepo, repos and me).
+    '''
+    myPath = os.path.realpath(__file__)
+    myPackage = os.path.split(myPath)[0]
+    myRepo = os.path.split(myPackage)[0]
+    me = '__init__.py'
+    if not os.path.isfile(os.path.join(myPackage, me)):
+        raise RuntimeError('{} is not in package {}.'.format(me, myPackage))
+    globals().update(
+        myPath=myPath,
+        myPackage=myPackage,
+        myRepo=myRepo,
+        repos=os.path.split(myRepo)[0],
+        me=me,
+    )
+
+
+def _load_sysdirs():
+    '''
+    Set the platform's directories (profile_path, appdatas_path on
+    Windows, appdata_path, sysdirs and mydirs).
+    '''
+    import platform
+    sysdirs = {}
+    if "windows" in platform.system().lower():
+        if 'USERPROFILE' in os.environ:
+            profile_path = os.environ['USERPROFILE']
+            appdatas_path = os.path.join(profile_path, "AppData")
+            appdata_path = os.path.join(appdatas_path, "Local")
+            sysdirs['caches'] = os.path.join(appdatas_path, "Local")
+            globals()['appdatas_path'] = appdatas_path
+        else:
+            raise ValueError("ERROR: The USERPROFILE variable is missing"
+                             " though platform.system() is {}."
+                             "".format(platform.system()))
+    else:
+        if 'HOME' in os.environ:
+            profile_path = os.environ['HOME']
+            appdata_path = os.path.join(profile_path, ".config")
+            sysdirs['caches'] = os.path.join(profile_path, ".cache")
+        else:
+            raise ValueError("ERROR: The HOME variable is missing"
+                             " though the platform {} is not Windows."
+                             "".format(platform.system()))
+    globals().update(
+        profile_path=profile_path,
+        appdata_path=appdata_path,
+        sysdirs=sysdirs,
+        mydirs={
+            'cache': os.path.join(sysdirs['caches'], luid)
+        },
+    )
+
+
+def _load_settings():
+    from voxboxor.settings import Settings
+    globals()['Settings'] = Settings
+
+
+# Attributes that are only set on first use (by the function), so
+#   that importing the package doesn't read the environment nor the
+#   file system and doesn't import voxboxor.settings (See __getattr__).
+_lazy_attributes = {
+    'myPath': _load_paths,
+    'myPackage': _load_paths,
+    'myRepo': _load_paths,
+    'repos': _load_paths,
+    'me': _load_paths,
+    'profile_path': _load_sysdirs,
+    'appdatas_path': _load_sysdirs,
+    'appdata_path': _load_sysdirs,
+    'sysdirs': _load_sysdirs,
+    'mydirs': _load_sysdirs,
+    'Settings': _load_settings,
 }
 
+
+def __getattr__(name):
+    '''
+    Get a lazy attribute (only called if name isn't set yet).
+    '''
+    load = _lazy_attributes.get(name)
+    if load is not None:
+        load()
+        if name in globals():
+            return globals()[name]
+    raise AttributeError("module {} has no attribute {}"
+                         "".format(repr(__name__), repr(name)))
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_lazy_attributes))
+
 # settings = Settings()
 
 
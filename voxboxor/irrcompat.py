@@ -23,10 +23,21 @@ from __future__ import print_function
 
 import os
 import sys
+from array import array
 from datetime import datetime
+from itertools import repeat
+from operator import (
+    mul,
+    truediv,
+)
 import platform
 import json
 
+try:
+    import numpy
+except ImportError:
+    numpy = None  # arrays are converted one value at a time instead
+
 from voxboxor import (
     echo0,
 )
@@ -35,10 +46,73 @@ UPM = 10.0  # (unused, hard-coded for speed) Engine units per game meter
 
 # TODO: crafts (scrape list of ingredients to remove from inventory)
 
-def irr_to_mt(irr_pos):
+
+def _is_array(value):
+    return isinstance(value, array) or ((numpy is not None)
+                                        and isinstance(value, numpy.ndarray))
+
+
+def _convert_array(values, out, multiply):
+    '''
+    Multiply or divide every value by 10.0 in one operation (in NumPy
+    if available, otherwise in one pass).
+
+    Sequential arguments:
+    values -- a NumPy array of any shape, or an array.array (such as
+              array('f') with x, y, z for each position)
+    out -- an array of the same type and size for the results (may be
+           values to convert in place), or None for a new array
+    multiply -- If True, multiply, otherwise divide.
+    '''
+    if not isinstance(values, array):
+        op = numpy.multiply if multiply else numpy.divide
+        if out is None:
+            return op(values, 10.0)
+        return op(values, 10.0, out=out)
+    if out is not None:
+        if out.typecode not in "fd":
+            raise TypeError("out must be an array of floats ('f' or 'd')")
+        if len(out) != len(values):
+            raise ValueError("out has {} values but there are {}"
+                             "".format(len(out), len(values)))
+    if numpy is not None:
+        if out is None:
+            typecode = values.typecode if values.typecode in "fd" else "d"
+            out = array(typecode)
+            out.frombytes(bytes(len(values) * out.itemsize))
+        op = numpy.multiply if multiply else numpy.divide
+        op(numpy.asarray(memoryview(values)), 10.0,
+           out=numpy.asarray(memoryview(out)))
+        return out
+    # map runs the loop in C (without a Python function call per value).
+    results = map(mul if multiply else truediv, values, repeat(10.0))
+    if out is None:
+        typecode = values.typecode if values.typecode in "fd" else "d"
+        return array(typecode, results)
+    out[:] = array(out.typecode, results)
+    return out
+
+
+def irr_to_mt(irr_pos, out=None):
     '''
     Convert from engine units to Minetest meters.
+
+    Sequential arguments:
+    irr_pos -- a number, a tuple of up to 3 numbers, or many positions
+               at once as an (N, 3) NumPy array or as an array.array
+               (such as array('f') with x, y, z for each position)
+
+    Keyword arguments:
+    out -- (only for arrays) an array of the same type and size for the
+           results, such as irr_pos itself to convert in place (If
+           None, return a new array)
+
+    Returns:
+    the same type as irr_pos (an array.array of ints becomes
+    array('d')).
     '''
+    if _is_array(irr_pos):
+        return _convert_array(irr_pos, out, False)
     c = None
     try:
         c = len(irr_pos)
@@ -65,10 +139,14 @@ def irr_to_mt_s(irr_pos):
     return ','.join(irr_to_mt(irr_pos))
 
 
-def mt_to_irr(mt_pos):
+def mt_to_irr(mt_pos, out=None):
     '''
     Convert from Minetest meters to engine units.
+
+    The arguments and return are the same as irr_to_mt.
     '''
+    if _is_array(mt_pos):
+        return _convert_array(mt_pos, out, True)
     c = None
     try:
         c = len(mt_pos)
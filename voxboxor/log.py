@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+'''
+Logging for voxboxor subsystems (based on the logging module).
+
+Each subsystem ("network", "settings", "mainmenu") has a Log (See
+get_log) with its own level. Messages use str.format placeholders and
+take the arguments separately, so nothing is formatted unless the
+message is logged:
+
+    _log = get_log("network")
+    _log.debug("Ignored {} byte(s) from peer {}", len(data), peer_id)
+
+When the level is disabled, each call costs a method call and one
+attribute comparison. Code that builds arguments that are expensive
+even before formatting can check _log.level first (for example
+"if _log.level <= DEBUG:").
+
+Messages are written to stderr. After start_queue, they are written
+by a background thread instead, so logging never waits for the stream
+(such as while handling packets). Enabled messages are still formatted
+on the thread that logs them, since they are formatted before they are
+queued.
+'''
+from __future__ import print_function
+import atexit
+import logging
+import queue
+import sys
+
+from logging import (
+    DEBUG,
+    INFO,
+    WARNING,
+    ERROR,
+)
+from logging.handlers import (
+    QueueHandler,
+    QueueListener,
+)
+
+import voxboxor
+
+SUBSYSTEMS = ("network", "settings", "mainmenu")
+
+_VERBOSITY_LEVELS = (WARNING, INFO, DEBUG)  # See set_verbosity
+
+
+class _Message:
+    '''
+    A message formatted only when a handler needs the string (once,
+    even if there are several handlers).
+    '''
+    __slots__ = ('msg', 'args', 'text')
+
+    def __init__(self, msg, args):
+        self.msg = msg
+        self.args = args
+        self.text = None
+
+    def __str__(self):
+        text = self.text
+        if text is None:
+            if self.args:
+                text = self.msg.format(*self.args)
+            else:
+                text = str(self.msg)
+            self.text = text
+        return text
+
+
+class _StderrHandler(logging.Handler):
+    '''
+    Write each message to sys.stderr as it is when the message is
+    written (like print in echo0), so redirecting sys.stderr works.
+    '''
+    def emit(self, record):
+        try:
+            print(self.format(record), file=sys.stderr)
+        except Exception:
+            self.handleError(record)
+
+
+class Log:
+    '''
+    The logging facade of a subsystem.
+
+    Attributes:
+    subsystem -- the subsystem name ("" for the voxboxor package)
+    logger -- the logging.Logger ("voxboxor" or "voxboxor.<subsystem>")
+    level -- the lowest level logged (read-only, See set_level)
+
+    Private members:
+    _own_level -- the level given to set_level, or None to use the
+                  level set by set_verbosity
+    '''
+    __slots__ = ('subsystem', 'logger', 'level', '_own_level')
+
+    def __init__(self, subsystem):
+        self.subsystem = subsystem
+        name = "voxboxor"
+        if subsystem:
+            name += "." + subsystem
+        self.logger = logging.getLogger(name)
+        self._own_level = None
+        self._setLevel(_default_level)
+
+    def _setLevel(self, level):
+        if self._own_level is not None:
+            level = self._own_level
+        self.level = level
+        self.logger.setLevel(level)
+
+    def isEnabledFor(self, level):
+        return level >= self.level
+
+    def log(self, level, msg, *args, **kwargs):
+        '''
+        Log msg.format(*args) (or msg if there are no args) at level.
+
+        Keyword arguments:
+        exc_info -- If True, add the exception being handled.
+        '''
+        if level >= self.level:
+            self.logger.log(level, _Message(msg, args), **kwargs)
+
+    def debug(self, msg, *args):
+        if self.level <= DEBUG:
+            self.logger.log(DEBUG, _Message(msg, args))
+
+    def info(self, msg, *args):
+        if self.level <= INFO:
+            self.logger.log(INFO, _Message(msg, args))
+
+    def warning(self, msg, *args):
+        if self.level <= WARNING:
+            self.logger.log(WARNING, _Message(msg, args))
+
+    def error(self, msg, *args):
+        if self.level <= ERROR:
+            self.logger.log(ERROR, _Message(msg, args))
+
+    def exception(self, msg, *args):
+        '''
+        Log an error with the exception being handled.
+        '''
+        if self.level <= ERROR:
+            self.logger.log(ERROR, _Message(msg, args), exc_info=True)
+
+
+_default_level = _VERBOSITY_LEVELS[
+    max(0, min(voxboxor.verbosity, len(_VERBOSITY_LEVELS) - 1))
+]
+_handler = _StderrHandler()
+_base = Log("")
+_base.logger.addHandler(_handler)
+_base.logger.propagate = False
+_logs = {"": _base}
+for _subsystem in SUBSYSTEMS:
+    _logs[_subsystem] = Log(_subsystem)
+_listener = None
+
+
+def get_log(subsystem=""):
+    '''
+    Get the Log of a subsystem (or of the voxboxor package if "").
+    '''
+    log = _logs.get(subsystem)
+    if log is None:
+        log = Log(subsystem)
+        _logs[subsystem] = log
+    return log
+
+
+def set_level(subsystem, level):
+    '''
+    Set the level of a subsystem (use this instead of the setLevel of
+    its logger, so that the Log's level stays the same).
+
+    Sequential arguments:
+    subsystem -- a name such as "network"
+    level -- a logging level such as logging.DEBUG, or None to use the
+             level set by set_verbosity again
+    '''
+    log = get_log(subsystem)
+    log._own_level = level
+    log._setLevel(_default_level)
+
+
+def set_verbosity(verbosity):
+    '''
+    Set the level of each subsystem that doesn't have its own level
+    (See set_level) to WARNING if verbosity is 0, INFO if 1 or DEBUG if
+    2 or more. This is called by voxboxor.set_verbosity.
+    '''
+    global _default_level
+    _default_level = _VERBOSITY_LEVELS[
+        max(0, min(verbosity, len(_VERBOSITY_LEVELS) - 1))
+    ]
+    for log in list(_logs.values()):
+        log._setLevel(_default_level)
+
+
+def _replace_handler(old, new):
+    '''
+    Replace a handler of the voxboxor logger in one step, so each
+    message is handled by one of them (not by both or by neither).
+    '''
+    handlers = _base.logger.handlers
+    handlers[handlers.index(old)] = new
+
+
+def start_queue():
+    '''
+    Write messages from a background thread. Logging then only adds the
+    record to an unbounded queue, so it never waits for the stream.
+    Messages are formatted before they are queued (so that arguments
+    changed later don't change the message).
+    '''
+    global _listener
+    if _listener is not None:
+        return
+    records = queue.SimpleQueue()
+    _listener = QueueListener(records, _handler)
+    _listener.start()
+    _replace_handler(_handler, QueueHandler(records))
+    atexit.register(stop_queue)
+
+
+def stop_queue():
+    '''
+    Write the queued messages then write messages directly again.
+    '''
+    global _listener
+    listener = _listener
+    if listener is None:
+        return
+    _listener = None
+    listener.stop()
+    # Messages logged while the listener stopped are still queued. Hold
+    #   the handler's lock (which it takes to write each message) until
+    #   they are written, so newer messages are written after them.
+    with _handler.lock:
+        for handler in _base.logger.handlers:
+            if isinstance(handler, QueueHandler):
+                _replace_handler(handler, _handler)
+                break
+        records = listener.queue
+        while not records.empty():
+            _handler.handle(records.get_nowait())
+    atexit.unregister(stop_queue)
+
+
+def echo(level, args, kwargs):
+    '''
+    Log like print(*args, **kwargs) (used by voxboxor.echo0, echo1 and
+    echo2).
+    '''
+    if level < _base.level:
+        return
+    end = kwargs.get('end', "\n")
+    if end.endswith("\n"):
+        end = end[:-1]
+    msg = kwargs.get('sep', " ").join(str(arg) for arg in args) + end
+    _base.logger.log(level, msg)
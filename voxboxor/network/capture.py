@@ -0,0 +1,593 @@
+#!/usr/bin/env python3
+'''
+Record datagrams to a capture file and replay them.
+
+A capture file is a file header followed by records, each of which is a
+fixed-size record header followed by the raw datagram:
+- timestamp (f64 seconds since the epoch)
+- direction (u8: DIRECTION_IN or DIRECTION_OUT)
+- flags (u8, reserved)
+- peer_id (u16: the sender_peer_id in the basic header, or
+  PEER_ID_INEXISTENT if the datagram is too short to have one)
+- stream (u32: the remote address, numbered in the order each address
+  was first recorded, so replay can send each stream from its own
+  socket)
+- length (u32: the size of the datagram)
+
+Records are only ever appended, so recording is cheap and a capture
+that was cut short (such as by a crash) is still readable up to the
+last whole record. When a CaptureWriter is closed it appends a trailer
+(a record header with DIRECTION_TRAILER, TRAILER_FLAGS, TRAILER_PEER_ID,
+the stream count as the stream, and a length of 0), so the next
+CaptureWriter can continue the file without reading it. Readers skip
+trailers. CaptureReader memory-maps the file, so a capture
+much bigger than RAM can be indexed and decoded (See decode_packet)
+without reading it all into memory.
+
+Usage:
+    python -m voxboxor.network.capture info <file>
+    python -m voxboxor.network.capture replay <file> <host> <port>
+        [--speed <factor>] [--max-speed]
+'''
+from __future__ import print_function
+import argparse
+import asyncio
+import mmap
+import os
+import struct
+import sys
+import time
+
+from array import array
+from collections import Counter
+
+from voxboxor.log import (
+    get_log,
+)
+
+from voxboxor.network.connection import (
+    PEER_ID_INEXISTENT,
+    decode_packet,
+    classify_packet,
+)
+
+_log = get_log("network")
+
+CAPTURE_MAGIC = b"VXBXCAP\0"
+CAPTURE_VERSION = 1
+FILE_HEADER = struct.Struct(">8sHH")  # magic, version, record header size
+RECORD_HEADER = struct.Struct(">dBBHII")
+DIRECTION_IN = 0  # received by the recording side
+DIRECTION_OUT = 1  # sent by the recording side
+DIRECTION_TRAILER = 2  # See CaptureWriter.close
+DIRECTION_NAMES = ("in", "out")
+TRAILER_FLAGS = 0x54
+TRAILER_PEER_ID = 0xC0DE
+WRITE_BUFFER_SIZE = 1024 * 1024  # bytes
+REPLAY_YIELD_COUNT = 64  # datagrams sent between yields at max speed
+REPLAY_CONNECT_TIMEOUT = 5.0  # seconds to wait for a peer ID on replay
+
+_sender_peer_id_struct = struct.Struct(">H")
+_SENDER_PEER_ID_OFFSET = 4
+
+
+def _read_trailer(path):
+    '''
+    Get the stream count from the trailer at the end of the capture
+    file (reading only the file header and the last record header).
+
+    Returns:
+    the stream count, or None if the file doesn't end with a trailer
+    (such as if the writer wasn't closed).
+    '''
+    with open(path, 'rb') as stream:
+        size = os.fstat(stream.fileno()).st_size
+        if size < FILE_HEADER.size + RECORD_HEADER.size:
+            return None
+        magic = FILE_HEADER.unpack(stream.read(FILE_HEADER.size))[0]
+        if magic != CAPTURE_MAGIC:
+            raise ValueError("{} is not a capture file.".format(path))
+        stream.seek(size - RECORD_HEADER.size)
+        _, direction, flags, peer_id, stream_count, length = \
+            RECORD_HEADER.unpack(stream.read(RECORD_HEADER.size))
+    if ((direction, flags, peer_id, length)
+            != (DIRECTION_TRAILER, TRAILER_FLAGS, TRAILER_PEER_ID, 0)):
+        return None
+    return stream_count
+
+
+class CaptureWriter:
+    '''
+    Append datagrams to a capture file.
+
+    Attributes:
+    path -- the capture file
+    streams -- a dict of address to stream number
+    count -- the number of records written by this writer
+    '''
+    def __init__(self, path, buffering=WRITE_BUFFER_SIZE):
+        '''
+        Open the capture file for appending (and write the file header
+        if the file is new or empty).
+
+        If the file ends with a trailer (See close), the trailer is
+        removed and stream numbers continue after it without reading
+        the records. Otherwise (such as after a crash) the records are
+        scanned, and an incomplete record at the end is removed.
+        '''
+        self.path = path
+        self.streams = {}
+        self.count = 0
+        self._next_stream = 0
+        end = None
+        incomplete = False
+        if os.path.isfile(path) and os.path.getsize(path):
+            stream_count = _read_trailer(path)
+            if stream_count is not None:
+                self._next_stream = stream_count
+                end = os.path.getsize(path) - RECORD_HEADER.size
+            else:
+                # Continue numbering streams after those already
+                #   recorded, and drop an incomplete record.
+                with CaptureReader(path) as reader:
+                    end = FILE_HEADER.size
+                    for record in reader:
+                        self._next_stream = max(self._next_stream,
+                                                record.stream + 1)
+                        end = record.end
+                    incomplete = reader.truncated
+                if not incomplete:
+                    end = None
+        self._stream = open(path, 'ab', buffering=buffering)
+        if end is not None:
+            if incomplete:
+                _log.info("Removed an incomplete record from the end of"
+                          " {}", path)
+            self._stream.truncate(end)
+        if self._stream.tell() == 0:
+            self._stream.write(FILE_HEADER.pack(
+                CAPTURE_MAGIC, CAPTURE_VERSION, RECORD_HEADER.size,
+            ))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, direction, address, data, timestamp=None):
+        '''
+        Append a record.
+
+        Sequential arguments:
+        direction -- DIRECTION_IN or DIRECTION_OUT
+        address -- the remote address (any hashable value)
+        data -- the datagram (any buffer)
+
+        Keyword arguments:
+        timestamp -- the time in seconds since the epoch (None for now)
+        '''
+        stream = self.streams.get(address)
+        if stream is None:
+            stream = self._next_stream
+            self._next_stream += 1
+            self.streams[address] = stream
+        if len(data) >= _SENDER_PEER_ID_OFFSET + 2:
+            peer_id = _sender_peer_id_struct.unpack_from(
+                data, _SENDER_PEER_ID_OFFSET)[0]
+        else:
+            peer_id = PEER_ID_INEXISTENT
+        if timestamp is None:
+            timestamp = time.time()
+        self._stream.write(RECORD_HEADER.pack(
+            timestamp, direction, 0, peer_id, stream, len(data),
+        ))
+        self._stream.write(data)
+        self.count += 1
+
+    def flush(self):
+        self._stream.flush()
+
+    def close(self):
+        '''
+        Write the trailer then close the file.
+        '''
+        if self._stream.closed:
+            return
+        self._stream.write(RECORD_HEADER.pack(
+            time.time(), DIRECTION_TRAILER, TRAILER_FLAGS, TRAILER_PEER_ID,
+            self._next_stream, 0,
+        ))
+        self._stream.close()
+
+
+class _RecordingTransport:
+    '''
+    Forward everything to a DatagramTransport but record each datagram
+    sent with sendto.
+    '''
+    def __init__(self, transport, writer):
+        self._transport = transport
+        self._writer = writer
+        self._peername = transport.get_extra_info('peername')
+
+    def sendto(self, data, addr=None):
+        self._writer.write(DIRECTION_OUT,
+                           self._peername if addr is None else addr, data)
+        self._transport.sendto(data, addr)
+
+    def __getattr__(self, name):
+        return getattr(self._transport, name)
+
+
+def recording_protocol(protocol_factory, writer):
+    '''
+    Wrap a DatagramProtocol factory (such as ServerProtocol) so every
+    datagram that the protocol receives or sends is written to the
+    CaptureWriter.
+
+    Returns:
+    a protocol factory for create_datagram_endpoint (or create_server).
+    '''
+    def factory():
+        protocol = protocol_factory()
+        connection_made = protocol.connection_made
+        datagram_received = protocol.datagram_received
+
+        def recording_connection_made(transport):
+            connection_made(_RecordingTransport(transport, writer))
+
+        def recording_datagram_received(data, addr):
+            writer.write(DIRECTION_IN, addr, data)
+            datagram_received(data, addr)
+
+        protocol.connection_made = recording_connection_made
+        protocol.datagram_received = recording_datagram_received
+        return protocol
+    return factory
+
+
+class CaptureRecord:
+    '''
+    Attributes:
+    timestamp -- seconds since the epoch
+    direction -- DIRECTION_IN or DIRECTION_OUT
+    peer_id -- the sender_peer_id of the datagram
+    stream -- the number of the remote address
+    offset -- where the datagram starts in CaptureReader.data
+    end -- where the datagram ends in CaptureReader.data
+    '''
+    __slots__ = ('timestamp', 'direction', 'peer_id', 'stream', 'offset',
+                 'end')
+
+    def __init__(self, timestamp, direction, peer_id, stream, offset, end):
+        self.timestamp = timestamp
+        self.direction = direction
+        self.peer_id = peer_id
+        self.stream = stream
+        self.offset = offset
+        self.end = end
+
+
+class CaptureReader:
+    '''
+    Read a capture file through a read-only memory map.
+
+    The memoryviews returned by data_of and the packets returned by
+    decode point into the map, so release them before calling close.
+
+    Attributes:
+    path -- the capture file
+    data -- the memory map (None if the file has no records)
+    offsets -- an array of the offset of each record header (built by
+        index)
+    truncated -- True if the file ends with part of a record
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.data = None
+        self.offsets = None
+        self.truncated = False
+        self._file = open(path, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        if size < FILE_HEADER.size:
+            raise ValueError("{} is too short to be a capture file."
+                             "".format(path))
+        header = FILE_HEADER.unpack(self._file.read(FILE_HEADER.size))
+        magic, version, record_header_size = header
+        if magic != CAPTURE_MAGIC:
+            raise ValueError("{} is not a capture file.".format(path))
+        if (version != CAPTURE_VERSION
+                or record_header_size != RECORD_HEADER.size):
+            raise ValueError("{} is capture version {} but only version {}"
+                             " is supported.".format(path, version,
+                                                     CAPTURE_VERSION))
+        if size > FILE_HEADER.size:
+            self.data = mmap.mmap(self._file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self.data is not None:
+            self.data.close()
+            self.data = None
+        self._file.close()
+
+    def _scan(self):
+        '''
+        Yield the offset of each whole record header (except trailers).
+        '''
+        data = self.data
+        if data is None:
+            return
+        unpack_from = RECORD_HEADER.unpack_from
+        header_size = RECORD_HEADER.size
+        size = len(data)
+        offset = FILE_HEADER.size
+        while offset + header_size <= size:
+            header = unpack_from(data, offset)
+            length = header[5]
+            if offset + header_size + length > size:
+                break
+            if header[1] != DIRECTION_TRAILER:
+                yield offset
+            offset += header_size + length
+        self.truncated = (offset != size)
+
+    def index(self):
+        '''
+        Find every record (reading only the record headers) so records
+        can be accessed by number. This is done automatically by len and
+        by getting a record by number.
+
+        Returns:
+        the offsets array (8 bytes per record).
+        '''
+        if self.offsets is None:
+            self.offsets = array('Q', self._scan())
+        return self.offsets
+
+    def __len__(self):
+        return len(self.index())
+
+    def _record_at(self, offset):
+        timestamp, direction, _, peer_id, stream, length = \
+            RECORD_HEADER.unpack_from(self.data, offset)
+        start = offset + RECORD_HEADER.size
+        return CaptureRecord(timestamp, direction, peer_id, stream, start,
+                             start + length)
+
+    def __getitem__(self, i):
+        return self._record_at(self.index()[i])
+
+    def __iter__(self):
+        '''
+        Iterate over the records in order (without building the index
+        if it wasn't built yet).
+        '''
+        offsets = self.offsets
+        if offsets is None:
+            offsets = self._scan()
+        for offset in offsets:
+            yield self._record_at(offset)
+
+    def data_of(self, record):
+        '''
+        Get the datagram of the record as a memoryview (no copy).
+        '''
+        return memoryview(self.data)[record.offset:record.end]
+
+    def decode(self, record):
+        '''
+        Decode the datagram of the record without copying it (See
+        decode_packet).
+
+        Raises:
+        ValueError if the datagram isn't a known packet.
+        '''
+        return decode_packet(self.data, record.offset, record.end)
+
+    def streams(self):
+        '''
+        Get the set of stream numbers in the capture.
+        '''
+        return set(record.stream for record in self)
+
+
+class _ReplayProtocol(asyncio.DatagramProtocol):
+    '''
+    Receive the replies to one replayed stream to get the peer ID that
+    the server assigns to it.
+
+    Attributes:
+    connected -- a Future of the peer_id_new of the first s_connected
+        reply (None if there was no reply in time)
+    '''
+    def __init__(self):
+        self.connected = asyncio.get_running_loop().create_future()
+
+    def datagram_received(self, data, addr):
+        if self.connected.done():
+            return
+        try:
+            codec = classify_packet(data)
+            if (codec.origin, codec.purpose) != ("server", "connected"):
+                return
+            packet = codec.unpack_from(data)
+        except ValueError:
+            return
+        self.connected.set_result(packet.peer_id_new)
+
+    async def peer_id(self, timeout):
+        '''
+        Wait for the peer ID (See connected).
+        '''
+        if not self.connected.done():
+            try:
+                await asyncio.wait_for(asyncio.shield(self.connected),
+                                       timeout)
+            except asyncio.TimeoutError:
+                self.connected.set_result(None)
+        return self.connected.result()
+
+
+async def replay(reader, host, port, speed=1.0, direction=DIRECTION_IN):
+    '''
+    Send the datagrams in the capture to (host, port), one UDP socket
+    per stream so that the server sees each stream as a separate peer.
+
+    The server assigns a new peer ID to each stream, so the recorded
+    sender_peer_id of each datagram sent after the connect packet is
+    replaced by the peer_id_new of the server's s_connected reply
+    (waiting up to REPLAY_CONNECT_TIMEOUT for the reply).
+
+    Sequential arguments:
+    reader -- a CaptureReader
+
+    Keyword arguments:
+    speed -- 1.0 for the original timing, 2.0 for twice as fast, etc.,
+        or None to send as fast as possible
+    direction -- which records to send (DIRECTION_IN sends what the
+        recording side received, so a capture from a server can be
+        replayed against a server)
+
+    Returns:
+    a dict of statistics.
+    '''
+    loop = asyncio.get_running_loop()
+    transports = {}
+    protocols = {}
+    sent = 0
+    sent_bytes = 0
+    start = loop.time()
+    first_timestamp = None
+    try:
+        for record in reader:
+            if record.direction != direction:
+                continue
+            transport = transports.get(record.stream)
+            if transport is None:
+                transport, protocol = await loop.create_datagram_endpoint(
+                    _ReplayProtocol,
+                    remote_addr=(host, port),
+                )
+                transports[record.stream] = transport
+                protocols[record.stream] = protocol
+            if speed is None:
+                if sent % REPLAY_YIELD_COUNT == 0:
+                    await asyncio.sleep(0)
+            else:
+                if first_timestamp is None:
+                    first_timestamp = record.timestamp
+                delay = (start + (record.timestamp - first_timestamp)
+                         / speed - loop.time())
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            # Copy since the transport may hold the data until it is
+            #   sent, and the map may be closed before that.
+            data = bytes(reader.data[record.offset:record.end])
+            if ((record.peer_id != PEER_ID_INEXISTENT)
+                    and (len(data) >= _SENDER_PEER_ID_OFFSET + 2)):
+                peer_id = await protocols[record.stream].peer_id(
+                    REPLAY_CONNECT_TIMEOUT)
+                if peer_id is not None:
+                    data = bytearray(data)
+                    _sender_peer_id_struct.pack_into(
+                        data, _SENDER_PEER_ID_OFFSET, peer_id)
+            transport.sendto(data)
+            sent += 1
+            sent_bytes += len(data)
+        await asyncio.sleep(0)
+    finally:
+        for transport in transports.values():
+            transport.close()
+    seconds = loop.time() - start
+    return {
+        'datagrams': sent,
+        'bytes': sent_bytes,
+        'streams': len(transports),
+        'seconds': seconds,
+    }
+
+
+def summarize(reader):
+    '''
+    Count the records in the capture by direction and packet purpose.
+
+    Returns:
+    a dict of statistics.
+    '''
+    purposes = Counter()
+    count = 0
+    size = 0
+    first = None
+    last = None
+    for record in reader:
+        count += 1
+        size += record.end - record.offset
+        if first is None:
+            first = record.timestamp
+        last = record.timestamp
+        try:
+            codec = classify_packet(reader.data, record.offset, record.end)
+            purpose = "{} {}".format(codec.origin, codec.purpose)
+        except ValueError:
+            purpose = "unknown"
+        purposes[(DIRECTION_NAMES[record.direction], purpose)] += 1
+    return {
+        'records': count,
+        'bytes': size,
+        'seconds': (last - first) if count else 0.0,
+        'truncated': reader.truncated,
+        'purposes': purposes,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Show or replay a voxboxor capture file.",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    info_parser = subparsers.add_parser("info")
+    info_parser.add_argument("path")
+    replay_parser = subparsers.add_parser("replay")
+    replay_parser.add_argument("path")
+    replay_parser.add_argument("host")
+    replay_parser.add_argument("port", type=int)
+    replay_parser.add_argument("--speed", type=float, default=1.0,
+                               help="Replay this many times faster than"
+                                    " recorded (default: %(default)s).")
+    replay_parser.add_argument("--max-speed", action="store_true",
+                               help="Replay as fast as possible.")
+    args = parser.parse_args()
+    try:
+        reader = CaptureReader(args.path)
+    except (OSError, ValueError) as ex:
+        _log.error("{}", ex)
+        return 1
+    with reader:
+        if args.command == "info":
+            stats = summarize(reader)
+            print("{records} record(s), {bytes} byte(s) of datagrams"
+                  " over {seconds:.3f} s".format(**stats))
+            if stats['truncated']:
+                print("The last record is incomplete.")
+            for (direction, purpose), count in sorted(
+                    stats['purposes'].items()):
+                print("  {} {}: {}".format(direction, purpose, count))
+            return 0
+        speed = None if args.max_speed else args.speed
+        stats = asyncio.run(replay(reader, args.host, args.port,
+                                   speed=speed))
+        print("{datagrams} datagram(s), {bytes} byte(s), {streams}"
+              " stream(s), {seconds:.3f} s".format(**stats))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,14 +3,14 @@ from copy import deepcopy
 import struct
 from struct import Struct
 from collections import namedtuple
+from itertools import repeat
 
-from voxboxor import (
-    # set_verbosity,
-    echo0,
-    echo1,
-    echo2,
+from voxboxor.log import (
+    get_log,
 )
 
+_log = get_log("network")
+
 # See minetest/doc/protocol.txt:
 # - Minetest ints are always big-endian
 def to_u8(i):
@@ -22,13 +22,18 @@ def to_u8(i):
 
 PROTOCOL_ID = 0x4f457403  # 32-bit
 PEER_ID_INEXISTENT = 0  # 16-bit
+PEER_ID_SERVER = 1  # 16-bit
 TYPE_CONTROL = to_u8(0)
 TYPE_ORIGINAL = to_u8(1)
+TYPE_SPLIT = to_u8(2)
 TYPE_RELIABLE = to_u8(3)
 U8_0 = to_u8(0)
 CONTROLTYPE_SET_PEER_ID = to_u8(1)  # 8-bit CONTROLTYPE! 16-bit ID above
+CONTROLTYPE_ACK = to_u8(0)
 CONTROLTYPE_DISCO = to_u8(3)
 SEQNUM_INITIAL = 65500  # 16-bit
+UDP_PAYLOAD_MAXSIZE = 65507  # largest datagram an IPv4 socket receives
+MAX_PACKET_SIZE = 1400  # bytes (so a packet fits in a typical MTU)
 
 
 def _to_c_like_u32(value):
@@ -59,7 +64,8 @@ def _get_aspect(packet_category, key, aspect):
     get_packet_bytes function (which calls to_c_like automatically).
 
     Sequential arguments:
-    packet_category -- 'basic', 'reliable', 'original', or 'control'
+    packet_category -- 'basic', 'reliable', 'original', 'split', or
+        'control'
     key -- c_connect, or any other packet template
     aspect -- any aspect of the packet: 'types', 'names', or 'values'
 
@@ -72,9 +78,8 @@ def _get_aspect(packet_category, key, aspect):
     aspects = catdef.get(key)
     this_key = key
     if aspects is None:
-        echo2("- using * since there are no aspects for catdef of key"
-              " {}"
-              "".format(key))
+        _log.debug("- using * since there are no aspects for catdef of"
+                   " key {}", key)
         this_key = '*'
         aspects = catdef['*']
     if aspect not in aspects:
@@ -94,39 +99,64 @@ def _get_aspect(packet_category, key, aspect):
     return aspects[aspect]
 
 
-def to_c_like(name, value):
+# c_like_index is rebuilt from packetdefs by _rebuild_c_like_index
+#   whenever packet definitions are registered. Each key is a field name
+#   and each value is a (category, Struct format character, converter)
+#   tuple from the first definition using the name.
+c_like_index = {}
+
+
+def _rebuild_c_like_index():
+    c_like_index.clear()
     for category, catdef in packetdefs.items():
         for key, aspects in catdef.items():
-            for aspect, values in aspects.items():
-                if aspect != 'values':
-                    # echo2("")
-                    # echo2("{} != values for {} {}"
-                    #       "".format(aspect, category, key))
+            if 'values' not in aspects:
+                continue
+            # Get everything else based on values.
+            c_types = _get_aspect(category, key, 'types')
+            names = _get_aspect(category, key, 'names')
+            for i in range(len(names)):
+                if names[i] in c_like_index:
                     continue
-                # Get everything else based on values.
-                c_types = _get_aspect(category, key, 'types')
-                names = _get_aspect(category, key, 'names')
-                # echo2("")
-                # echo2("{} {} values={}".format(category, key,
-                #                                values))
-                # echo2("{} {} c_types={}".format(category, key,
-                #                                 c_types))
-                # echo2("{} {} names={}".format(category, key, names))
-                for i in range(len(names)):
-                    known_name = names[i]
-                    if known_name == name:
-                        c = c_types[i]
-                        # f = _c_like_converters[c]
-                        # return f(value)
-                        echo2("to_c_like({}) converts to {}"
-                              "".format(name, _c_like_names[c]))
-                        return _c_like_converters[c](value)
-    raise ValueError("to_c_like({}) converts to None".format(name))
-    return None
+                c = c_types[i]
+                c_like_index[names[i]] = (category, c,
+                                          _c_like_converters[c])
+
+
+def to_c_like(name, value):
+    '''
+    Convert the value to the C-like type of the named field.
+    '''
+    entry = c_like_index.get(name)
+    if entry is None:
+        raise ValueError("to_c_like({}) converts to None".format(name))
+    return entry[2](value)
+
+
+def to_c_like_values(values):
+    '''
+    Convert every value in the values dict at once (See to_c_like).
+
+    Returns:
+    a new dict with the same keys.
+    '''
+    results = {}
+    for name, value in values.items():
+        entry = c_like_index.get(name)
+        if entry is None:
+            raise ValueError("to_c_like({}) converts to None".format(name))
+        results[name] = entry[2](value)
+    return results
 
 # "for" variables each have a purpose. Some standard purposes include:
 # - c_connect: client's first packet requesting a connection
 # - s_connect: server's response to a connection request from a client
+# - c_reliable, s_reliable: a reliable original packet (the payload
+#   follows the headers). The layout is the same as c_connect, which is
+#   only different since the sender_peer_id is PEER_ID_INEXISTENT.
+# - c_ack, s_ack: acknowledge a reliable packet's seqnum
+# - c_split, s_split: a reliable chunk of a payload that is too large
+#   for one packet (the chunk follows the headers).
 
 basic_h_p = "LHc"
 basic_h_p_names = ('protocol_id', 'sender_peer_id', 'channel')
@@ -134,28 +164,51 @@ basic_h_p_values_for = {}
 basic_h_p_values_for['c_connect'] = (PROTOCOL_ID, PEER_ID_INEXISTENT, U8_0)
 basic_h_p_values_for['s_connected'] = (PROTOCOL_ID, PEER_ID_INEXISTENT, U8_0)
 basic_h_p_values_for['c_disconnect'] = (PROTOCOL_ID, None, U8_0)
+basic_h_p_values_for['c_reliable'] = (PROTOCOL_ID, None, None)
+basic_h_p_values_for['s_reliable'] = (PROTOCOL_ID, None, None)
+basic_h_p_values_for['c_ack'] = (PROTOCOL_ID, None, None)
+basic_h_p_values_for['s_ack'] = (PROTOCOL_ID, None, None)
+basic_h_p_values_for['c_split'] = (PROTOCOL_ID, None, None)
+basic_h_p_values_for['s_split'] = (PROTOCOL_ID, None, None)
 reliable_h_p = "cH"
 reliable_h_p_names = ('type', 'seqnum')
 reliable_h_p_values_for = {}
 reliable_h_p_values_for['c_connect'] = (TYPE_RELIABLE, SEQNUM_INITIAL)
 reliable_h_p_values_for['s_connected'] = (TYPE_RELIABLE, SEQNUM_INITIAL)
+reliable_h_p_values_for['c_reliable'] = (TYPE_RELIABLE, None)
+reliable_h_p_values_for['s_reliable'] = (TYPE_RELIABLE, None)
+reliable_h_p_values_for['c_split'] = (TYPE_RELIABLE, None)
+reliable_h_p_values_for['s_split'] = (TYPE_RELIABLE, None)
 # There is no reliable packet header for disconnect, only basic+control
 orig_h_p = "c"
 orig_h_p_names = ('type',)
 orig_h_p_values_for = {}
 orig_h_p_values_for['c_connect'] = (TYPE_ORIGINAL,)
+orig_h_p_values_for['c_reliable'] = (TYPE_ORIGINAL,)
+orig_h_p_values_for['s_reliable'] = (TYPE_ORIGINAL,)
+split_h_p = "cHHH"
+split_h_p_names = ('type', 'seqnum', 'chunk_count', 'chunk_num')
+split_h_p_values_for = {}
+split_h_p_values_for['c_split'] = (TYPE_SPLIT, None, None, None)
+split_h_p_values_for['s_split'] = (TYPE_SPLIT, None, None, None)
 
 # control packets (c_ if from this client, s_ if from server):
 control_p_for = {}
 # There is no control packet for c_connect, only an original packet.
 control_p_for['s_connected'] = "ccH"
 control_p_for['c_disconnect'] = "cc"
+control_p_for['c_ack'] = "ccH"
+control_p_for['s_ack'] = "ccH"
 control_p_names_for = {}
 control_p_names_for['s_connected'] = ('type', 'controltype', 'peer_id_new')
 control_p_names_for['c_disconnect'] = ('type', 'controltype')
+control_p_names_for['c_ack'] = ('type', 'controltype', 'seqnum')
+control_p_names_for['s_ack'] = ('type', 'controltype', 'seqnum')
 control_p_values_for = {}
 control_p_values_for['s_connected'] = (TYPE_CONTROL, CONTROLTYPE_SET_PEER_ID, None)
 control_p_values_for['c_disconnect'] = (TYPE_CONTROL, CONTROLTYPE_DISCO)
+control_p_values_for['c_ack'] = (TYPE_CONTROL, CONTROLTYPE_ACK, None)
+control_p_values_for['s_ack'] = (TYPE_CONTROL, CONTROLTYPE_ACK, None)
 
 packetdefs = {}
 packetdefs['basic'] = {}
@@ -183,6 +236,14 @@ for key, values in orig_h_p_values_for.items():
     packetdefs['original'][key] = {}
     packetdefs['original'][key]['values'] = values
 
+packetdefs['split'] = {}
+packetdefs['split']['*'] = {}
+packetdefs['split']['*']['types'] = split_h_p
+packetdefs['split']['*']['names'] = split_h_p_names
+for key, values in split_h_p_values_for.items():
+    packetdefs['split'][key] = {}
+    packetdefs['split'][key]['values'] = values
+
 packetdefs['control'] = {}
 for key, values in control_p_values_for.items():
     packetdefs['control'][key] = {}
@@ -191,6 +252,69 @@ for key, values in control_p_values_for.items():
     packetdefs['control'][key]['values'] = values
 
 
+_values_for = {
+    'basic': basic_h_p_values_for,
+    'reliable': reliable_h_p_values_for,
+    'original': orig_h_p_values_for,
+    'split': split_h_p_values_for,
+    'control': control_p_values_for,
+}
+
+
+def register_packet_def(category, key, values, types=None, names=None):
+    '''
+    Add or replace the definition of one category (section) of a packet
+    then update everything that was compiled from packetdefs.
+
+    Sequential arguments:
+    category -- 'basic', 'reliable', 'original', 'split', or 'control'
+    key -- c_connect, or any other packet template
+    values -- a tuple of defaults, where None is for each value that
+        must be set by the caller of get_packet_bytes.
+
+    Keyword arguments:
+    types -- a string of Struct format characters (required for the
+        'control' category; other categories use the shared '*' types).
+    names -- a tuple of names (required for the 'control' category;
+        other categories use the shared '*' names).
+    '''
+    values_for = _values_for.get(category)
+    if values_for is None:
+        raise ValueError("There is no packet category {}"
+                         "".format(category))
+    if not isinstance(values, tuple):
+        raise ValueError("values for {} {} must be a tuple"
+                         "".format(category, key))
+    if category == 'control':
+        if (types is None) or (names is None):
+            raise ValueError("A control packet requires types and names.")
+        if len(types) != len(names):
+            raise ValueError("Bad packed definition: length {} != {}"
+                             " for control {} types <- names"
+                             "".format(len(types), len(names), key))
+    elif (types is not None) or (names is not None):
+        raise ValueError("Only a control packet can have its own types"
+                         " and names.")
+    else:
+        names = packetdefs[category]['*']['names']
+    if len(names) != len(values):
+        raise ValueError("Bad packed definition: length {} != {}"
+                         " for {} {} names <- values"
+                         "".format(len(names), len(values), category,
+                                   key))
+    if category == 'control':
+        control_p_for[key] = types
+        control_p_names_for[key] = names
+    values_for[key] = values
+    packetdefs[category][key] = {}
+    if category == 'control':
+        packetdefs[category][key]['types'] = types
+        packetdefs[category][key]['names'] = names
+    packetdefs[category][key]['values'] = values
+    _rebuild_c_like_index()
+    clear_packet_codecs()
+
+
 # See https://docs.python.org/3/library/struct.html:
 # 'H': unsigned 16-bit int
 # 'c': char (unsigned byte)
@@ -283,6 +407,7 @@ def get_packet_format(origin, purpose):
         fieldsdef.append(('reliable', len(reliable_h_p_values)))
 
     orig_h_p_values = orig_h_p_values_for.get(key)
+    split_h_p_values = split_h_p_values_for.get(key)
     control_p_values = control_p_values_for.get(key)
     if orig_h_p_values is not None:
         pack += orig_h_p
@@ -296,6 +421,18 @@ def get_packet_format(origin, purpose):
         pack_names += orig_h_p_names
         defaults += orig_h_p_values_for[key]
         fieldsdef.append(('original', len(orig_h_p_values_for[key])))
+    elif split_h_p_values is not None:
+        pack += split_h_p
+        if len(split_h_p_names) != len(split_h_p_values):
+            raise ValueError(
+                "Bad packed definition: length {} != {}"
+                " for split_h_p_names <- split_h_p_values_for[{}]"
+                "".format(len(split_h_p_names),
+                          len(split_h_p_values), key)
+            )
+        pack_names += split_h_p_names
+        defaults += split_h_p_values
+        fieldsdef.append(('split', len(split_h_p_values)))
     elif control_p_values:
         pack += control_p_for[key]
         if len(control_p_names_for[key]) != len(control_p_values):
@@ -310,7 +447,7 @@ def get_packet_format(origin, purpose):
         fieldsdef.append(('control', len(control_p_values)))
     else:
         raise ValueError(
-            "Only a connect packet (one with an original packet header)"
+            "Only a packet with an original or split packet header"
             " doesn't have a control packet."
         )
 
@@ -332,6 +469,183 @@ def get_packet_format(origin, purpose):
     return pack, pack_names, defaults, fieldsdef
 
 
+class PacketCodec:
+    '''
+    A packet layout that is validated and compiled only once (see
+    get_packet_codec) so that encoding or decoding a packet doesn't
+    have to resolve the format again for every datagram.
+
+    Attributes:
+    origin -- 'client' or 'server'
+    purpose -- the purpose (See get_packet_format for documentation).
+    pack -- a string of Struct format characters, one char per field
+    names -- the names of the fields (See get_packet_format).
+    defaults -- the default values of the fields (See
+        get_packet_format).
+    fieldsdef -- a tuple of (category, count) tuples (See
+        get_packet_format).
+    struct -- a big-endian Struct compiled from pack
+    size -- the length in bytes of a packet with this layout
+    index -- a dict where each key is a (category, name) tuple and each
+        value is the sequential index of the field.
+    offsets -- a dict where each key is a (category, name) tuple and
+        each value is the byte offset of the field in the packet.
+    required -- a tuple of (index, name, converter) tuples, one for each
+        field that has no default and must be set by the caller.
+    packet_class -- the MinetestPacket subclass for this layout
+    '''
+    def __init__(self, origin, purpose):
+        pack, pack_names, defaults, fieldsdef = get_packet_format(
+            origin,
+            purpose,
+        )
+        self.origin = origin
+        self.purpose = purpose
+        self.pack = pack
+        self.names = tuple(pack_names)
+        self.defaults = tuple(defaults)
+        self.fieldsdef = tuple(tuple(pair) for pair in fieldsdef)
+        self.struct = Struct(">"+pack)  # '>': Minetest is always big-endian
+        self.size = self.struct.size
+        self.index = {}
+        self.offsets = {}
+        i = 0
+        for category, count in self.fieldsdef:
+            for _ in range(count):
+                key = (category, self.names[i])
+                if key in self.index:
+                    raise ValueError(
+                        "The packet definitions are bad for {} {}"
+                        "--{} {} is defined more than once."
+                        "".format(origin, purpose, category,
+                                  self.names[i])
+                    )
+                self.index[key] = i
+                self.offsets[key] = struct.calcsize(">"+pack[:i])
+                i += 1
+        required = []
+        for i in range(len(self.defaults)):
+            if self.defaults[i] is None:
+                required.append((i, self.names[i],
+                                 _c_like_converters[pack[i]]))
+        self.required = tuple(required)
+        self.packet_class = packet_class(self.names, self.fieldsdef)
+
+    def pack_values(self, values):
+        '''
+        Get the values (a tuple or list) that can be packed by
+        self.struct, using defaults for fields that the values dict
+        doesn't set.
+
+        Sequential arguments:
+        values -- See get_packet_bytes for documentation.
+        '''
+        if not self.required:
+            return self.defaults
+        pack_values = list(self.defaults)
+        missing_keys = []
+        for i, name, convert in self.required:
+            custom_value = values.get(name)
+            if custom_value is None:
+                missing_keys.append(name)
+                continue
+            pack_values[i] = convert(custom_value)
+        if len(missing_keys) > 0:
+            raise ValueError(
+                "Constructing a {} {} packet requires values to have the"
+                " keys with no default: {}"
+                "".format(self.origin, self.purpose, missing_keys)
+            )
+        return pack_values
+
+    def unpack_from(self, buffer, offset=0, end=None):
+        '''
+        Decode the headers directly from the buffer without copying the
+        packet out of it first.
+
+        Sequential arguments:
+        buffer -- any buffer such as bytes, a bytearray or a memoryview
+
+        Keyword arguments:
+        offset -- where the packet starts in the buffer
+        end -- where the packet ends in the buffer (defaults to the end
+            of the buffer)
+
+        Returns:
+        a MinetestPacket where payload is a memoryview of the bytes
+        after the headers (it refers to the buffer, so it is only valid
+        until the buffer is reused).
+
+        Raises:
+        ValueError if the packet (from offset to end) is shorter than
+        the headers (bytes after end, such as those left in a reused
+        buffer by a longer packet, are never read).
+        '''
+        if end is None:
+            end = len(buffer)
+        if end - offset < self.size:
+            raise ValueError("The {} {} packet is only {} byte(s) but the"
+                             " headers are {}"
+                             "".format(self.origin, self.purpose,
+                                       end - offset, self.size))
+        values = self.struct.unpack_from(buffer, offset)
+        if not isinstance(buffer, memoryview):
+            buffer = memoryview(buffer)
+        payload = buffer[offset+self.size:end]
+        return self.packet_class(self.names, values, self.fieldsdef,
+                                 payload)
+
+
+_packet_codecs = {}
+
+# The packed header values of each channel (filled by
+#   voxboxor.network.reliable), keyed by (origin, purpose,
+#   sender_peer_id, channel_count). Like _packet_codecs, it is cleared
+#   when packet definitions change.
+packet_templates = {}
+_origins = {'c': "client", 's': "server"}
+
+
+def get_packet_codec(origin, purpose):
+    '''
+    Get the PacketCodec for the origin and purpose, compiling it from
+    packetdefs on first use.
+
+    Sequential arguments:
+    origin -- See get_packet_format for documentation.
+    purpose -- See get_packet_format for documentation.
+    '''
+    codec = _packet_codecs.get((origin, purpose))
+    if codec is None:
+        codec = PacketCodec(origin, purpose)
+        _packet_codecs[(origin, purpose)] = codec
+    return codec
+
+
+def clear_packet_codecs():
+    '''
+    Forget all compiled PacketCodec objects. This must be called after
+    changing packet definitions so they are compiled again.
+    '''
+    _packet_codecs.clear()
+    _classifier_table.clear()
+    packet_templates.clear()
+
+
+def compile_packet_codecs():
+    '''
+    Validate and compile a PacketCodec for each key (such as
+    c_connect) that has a basic header definition.
+
+    Returns:
+    the dict of compiled codecs, where each key is (origin, purpose).
+    '''
+    for key in basic_h_p_values_for.keys():
+        o_pre, purpose = key.split("_", 1)
+        get_packet_codec(_origins[o_pre], purpose)
+    return _packet_codecs
+
+
 def get_packet_bytes(origin, purpose, values):
     '''
     Translate values to bytes in the form of a packet.
@@ -346,46 +660,193 @@ def get_packet_bytes(origin, purpose, values):
         peer_id_new, therefore the server must set values['peer_id_new']
         or an exception will be raised.
     '''
-    pack, pack_names, pack_values, fieldsdef = get_packet_format(
-        origin,
-        purpose,
-    )
-    missing_keys = []
-    for i in range(len(pack_values)):
-        default_value = pack_values[i]
-        if default_value is None:
-            custom_value = values.get(pack_names[i])
-            if custom_value is None:
-                missing_keys.append(pack_names[i])
-                continue
-            pack_values = list(pack_values)
-            pack_values[i] = to_c_like(pack_names[i], custom_value)
-            pack_values = tuple(pack_values)
-    if len(missing_keys) > 0:
-        raise ValueError(
-            "Constructing a {} {} packet requires values to have the"
-            " keys with no default: {}"
-            "".format(origin, purpose, missing_keys)
-        )
-    # See https://docs.python.org/3/library/struct.html:
-    # '>': big-endian
-    Packet = Struct(">"+pack)  # '>': Minetest is always big-endian
+    codec = get_packet_codec(origin, purpose)
+    pack_values = codec.pack_values(values)
     try:
-        return Packet.pack(*pack_values)
+        return codec.struct.pack(*pack_values)
     except struct.error as ex:
-        echo0(
+        _log.error(
             "Struct couldn't pack packet values for {} {}"
             " pack={}, pack_names={}, pack_values={}"
-            " len(pack)={}, len(pack_names)={}, len(pack_values)={}"
-            "".format(origin, purpose,
-                      pack, pack_names, pack_values,
-                      len(pack), len(pack_names), len(pack_values))
+            " len(pack)={}, len(pack_names)={}, len(pack_values)={}",
+            origin, purpose, codec.pack, codec.names, pack_values,
+            len(codec.pack), len(codec.names), len(pack_values),
         )
         raise ex
 
 
+def get_packets_bytes(origin, purpose, values_list, count=None):
+    '''
+    Translate values for many packets with the same origin and purpose
+    into one contiguous buffer of packets.
+
+    Sequential arguments:
+    origin -- See get_packet_format for documentation.
+    purpose -- See get_packet_format for documentation.
+    values_list -- Either an iterable of values dicts (See
+        get_packet_bytes), or a dict of columns where each key is the
+        name of a field with no default and each value is a sequence
+        with one value for each packet.
+
+    Keyword arguments:
+    count -- the number of packets (only required if values_list is a
+        dict of columns and the packet has no fields without defaults).
+
+    Returns:
+    a tuple of buffer, offsets where buffer is a bytearray and offsets
+    is a range of where each packet starts in the buffer.
+    '''
+    codec = get_packet_codec(origin, purpose)
+    if isinstance(values_list, dict):
+        columns = []
+        missing_keys = []
+        for i in range(len(codec.defaults)):
+            default_value = codec.defaults[i]
+            if default_value is not None:
+                columns.append(repeat(default_value))
+                continue
+            column = values_list.get(codec.names[i])
+            if column is None:
+                missing_keys.append(codec.names[i])
+                continue
+            if count is None:
+                count = len(column)
+            elif len(column) != count:
+                raise ValueError(
+                    "The {} column has {} value(s) but there are {}"
+                    " packet(s).".format(codec.names[i], len(column),
+                                         count)
+                )
+            columns.append(map(_c_like_converters[codec.pack[i]],
+                               column))
+        if len(missing_keys) > 0:
+            raise ValueError(
+                "Constructing a {} {} packet requires values to have the"
+                " keys with no default: {}"
+                "".format(origin, purpose, missing_keys)
+            )
+        if count is None:
+            raise ValueError("The count is required since {} {} has no"
+                             " columns.".format(origin, purpose))
+        rows = zip(*columns)
+    else:
+        rows = [codec.pack_values(values) for values in values_list]
+        count = len(rows)
+    size = codec.size
+    buffer = bytearray(count * size)
+    offsets = range(0, count * size, size)
+    pack_into = codec.struct.pack_into
+    for offset, row in zip(offsets, rows):
+        pack_into(buffer, offset, *row)
+    return buffer, offsets
+
+
+def bytes_to_columns(origin, purpose, buffer):
+    '''
+    Translate a buffer of packets that all have the same origin and
+    purpose (such as from get_packets_bytes) into columns of values.
+
+    Sequential arguments:
+    origin -- See the get_packet_bytes documentation.
+    purpose -- See the get_packet_bytes documentation.
+    buffer -- a buffer with a whole number of packets and nothing else
+
+    Returns:
+    a dict where each key is a (category, name) tuple (See
+    MinetestPacket.get) and each value is a tuple of values with one
+    value for each packet.
+    '''
+    codec = get_packet_codec(origin, purpose)
+    if len(buffer) % codec.size != 0:
+        raise ValueError(
+            "The buffer is {} byte(s) which isn't a multiple of the {}"
+            " {} packet size {}".format(len(buffer), origin, purpose,
+                                        codec.size)
+        )
+    columns = tuple(zip(*codec.struct.iter_unpack(buffer)))
+    if not columns:
+        columns = ((),) * len(codec.names)
+    results = {}
+    for key, i in codec.index.items():
+        results[key] = columns[i]
+    return results
+
+
+# Each of these common header fields can be read as an attribute of a
+#   MinetestPacket (whenever the packet's layout has it) instead of by
+#   calling get.
+_header_attrs = {
+    'protocol_id': 'basic',
+    'sender_peer_id': 'basic',
+    'channel': 'basic',
+    'seqnum': 'reliable',
+    'peer_id_new': 'control',
+}
+
+_packet_classes = {}
+
+
+def _field_property(i):
+    return property(lambda self: self.values[i])
+
+
+def packet_class(names, fieldsdef):
+    '''
+    Get the MinetestPacket subclass for a packet layout, creating it on
+    first use. The layout (names, fieldsdef and an index of fields) is
+    stored once by the class instead of by each packet.
+
+    Sequential arguments:
+    names -- See MinetestPacket.
+    fieldsdef -- See MinetestPacket.
+    '''
+    names = tuple(names)
+    fieldsdef = tuple(tuple(pair) for pair in fieldsdef)
+    cls = _packet_classes.get((names, fieldsdef))
+    if cls is not None:
+        return cls
+    index = {}
+    i = 0
+    for category, count in fieldsdef:
+        for _ in range(count):
+            index.setdefault((category, names[i]), i)
+            i += 1
+    if i != len(names):
+        raise ValueError("The fieldsdef counts total {} but there are {}"
+                         " names.".format(i, len(names)))
+    namespace = {
+        '__slots__': (),
+        'names': names,
+        'fieldsdef': fieldsdef,
+        '_index': index,
+    }
+    for attr, category in _header_attrs.items():
+        i = index.get((category, attr))
+        if i is not None:
+            namespace[attr] = _field_property(i)
+    cls_name = "".join(pair[0].title() for pair in fieldsdef) + "Packet"
+    cls = type(cls_name, (MinetestPacket,), namespace)
+    _packet_classes[(names, fieldsdef)] = cls
+    return cls
+
+
 class MinetestPacket:
-    def __init__(self, names, values, fieldsdef):
+    '''
+    A decoded packet. Constructing a MinetestPacket actually constructs
+    the subclass for the layout (See packet_class), so each packet only
+    stores its values and payload.
+    '''
+    __slots__ = ('values', 'payload')
+    names = ()
+    fieldsdef = ()
+    _index = {}
+
+    def __new__(cls, names, values, fieldsdef, payload=None):
+        if cls is MinetestPacket:
+            cls = packet_class(names, fieldsdef)
+        return object.__new__(cls)
+
+    def __init__(self, names, values, fieldsdef, payload=None):
         '''
         Sequential arguments:
         fieldsdef -- A list of tuples, each like (category, count) where
@@ -394,31 +855,25 @@ class MinetestPacket:
         names -- a list of names of variables.
         values -- values that correspond to names by the same sequential
             index
+
+        Keyword arguments:
+        payload -- a memoryview of any bytes after the headers (or None
+            if the packet wasn't decoded from a buffer).
         '''
-        self.names = names
         self.values = values
-        self.fieldsdef = fieldsdef
+        self.payload = payload
 
     def get(self, name, category='control'):
         '''
         Sequential arguments:
         category -- Names are not unique in a Minetest packet, only a
             packet section. The category name defines the packet
-            section: 'basic', 'reliable', 'original', 'control
+            section: 'basic', 'reliable', 'original', 'split', 'control'
         '''
-        cat_i = 0
-        cat_name = self.fieldsdef[cat_i][0]
-        cat_sub_i = 0
-        for i in range(len(self.names)):
-            if cat_sub_i == self.fieldsdef[cat_i][1]:
-                cat_i += 1
-                cat_name = self.fieldsdef[cat_i][0]
-                cat_sub_i = 0
-            if cat_name == category:
-                if self.names[i] == name:
-                    return self.values[i]
-            cat_sub_i += 1
-        raise KeyError("There is no {} in {}".format(name, category))
+        i = self._index.get((category, name))
+        if i is None:
+            raise KeyError("There is no {} in {}".format(name, category))
+        return self.values[i]
 
 
 def bytes_to_packet(origin, purpose, packet_bytes):
@@ -433,15 +888,185 @@ def bytes_to_packet(origin, purpose, packet_bytes):
         eventually.
     '''
     # formerly packet_to_dict
-    pack, pack_names, pack_values, fieldsdef = get_packet_format(
-        origin,
-        purpose,
-    )
-    del pack_values
+    codec = get_packet_codec(origin, purpose)
     # See <https://docs.python.org/2/library/struct.html#struct.unpack>
-    # Packet = Struct(">"+pack)  # '>': Minetest is always big-endian
     # PacketNT = namedtuple('Packet', pack_names)
     # return PacketNT._make(struct.unpack(">"+pack, packet_bytes))
     # ^ Above is impossible because there are duplicate field names :(
-    values = struct.unpack(">"+pack, packet_bytes)
-    return MinetestPacket(pack_names, values, fieldsdef)
+    values = codec.struct.unpack(packet_bytes)
+    return codec.packet_class(codec.names, values, codec.fieldsdef)
+
+
+def buffer_to_packet(origin, purpose, buffer, offset=0, end=None):
+    '''
+    Translate a packet in a buffer into a MinetestPacket object without
+    copying it out of the buffer (See PacketCodec.unpack_from). Unlike
+    bytes_to_packet, the buffer may be larger than the headers, in which
+    case the rest of the packet is the payload of the MinetestPacket.
+
+    Sequential arguments:
+    origin -- See the get_packet_bytes documentation.
+    purpose -- See the get_packet_bytes documentation.
+    buffer -- any buffer such as a bytearray filled by recvfrom_into
+
+    Keyword arguments:
+    offset -- where the packet starts in the buffer
+    end -- where the packet ends in the buffer, such as the byte count
+        returned by recvfrom_into (defaults to the end of the buffer)
+    '''
+    return get_packet_codec(origin, purpose).unpack_from(buffer, offset,
+                                                         end)
+
+
+class PacketBufferRing:
+    '''
+    A preallocated ring of receive buffers, so a receive loop doesn't
+    have to allocate a buffer for each datagram:
+
+        ring = PacketBufferRing()
+        while True:
+            view = ring.next()
+            count, address = sock.recvfrom_into(view)
+            packet = buffer_to_packet("client", "connect", view, 0, count)
+
+    The payload of each packet refers to the ring, so it is only valid
+    until the ring has been used count more times.
+    '''
+    def __init__(self, count=16, size=UDP_PAYLOAD_MAXSIZE):
+        '''
+        Keyword arguments:
+        count -- how many buffers are in the ring
+        size -- the size of each buffer in bytes
+        '''
+        if count < 1:
+            raise ValueError("A PacketBufferRing requires at least 1"
+                             " buffer.")
+        self.count = count
+        self.size = size
+        self.data = bytearray(count * size)
+        view = memoryview(self.data)
+        self.views = tuple(view[i*size:(i+1)*size] for i in range(count))
+        self._next_i = 0
+
+    def next(self):
+        '''
+        Get the next buffer (a writable memoryview) in the ring.
+        '''
+        view = self.views[self._next_i]
+        self._next_i = (self._next_i + 1) % self.count
+        return view
+
+
+# _classifier_table is built by _build_classifier_table from the
+#   compiled codecs. Each key is a packet signature: a (reliable, type,
+#   controltype) tuple where reliable is True if the packet has a
+#   reliable header, type is the (inner) packet type as an int, and
+#   controltype is an int (or None if type isn't TYPE_CONTROL). Each
+#   value is a PacketCodec.
+_classifier_table = {}
+_basic_size = struct.calcsize(">"+basic_h_p)
+_reliable_size = struct.calcsize(">"+reliable_h_p)
+_protocol_id_struct = Struct(">L")
+_TYPE_CONTROL_I = TYPE_CONTROL[0]
+_TYPE_RELIABLE_I = TYPE_RELIABLE[0]
+
+
+def _packet_signature(codec):
+    reliable = False
+    category = codec.fieldsdef[1][0]
+    if category == 'reliable':
+        reliable = True
+        category = codec.fieldsdef[2][0]
+    packet_type = codec.defaults[codec.index[(category, 'type')]]
+    controltype = None
+    if packet_type == TYPE_CONTROL:
+        controltype = codec.defaults[codec.index[(category,
+                                                  'controltype')]][0]
+    return (reliable, packet_type[0], controltype)
+
+
+def _build_classifier_table():
+    for key in basic_h_p_values_for.keys():
+        o_pre, purpose = key.split("_", 1)
+        codec = get_packet_codec(_origins[o_pre], purpose)
+        signature = _packet_signature(codec)
+        old_codec = _classifier_table.get(signature)
+        if old_codec is None:
+            _classifier_table[signature] = codec
+        elif ((old_codec.pack != codec.pack)
+                or (old_codec.packet_class is not codec.packet_class)):
+            raise ValueError(
+                "{} {} and {} {} can't be told apart since they both"
+                " have the signature {} but not the same layout."
+                "".format(old_codec.origin, old_codec.purpose,
+                          codec.origin, codec.purpose, signature)
+            )
+        # else the layout is the same, so either codec can decode it.
+
+
+def classify_packet(buffer, offset=0, end=None):
+    '''
+    Find the codec that can decode the packet by reading only its
+    headers (the basic header, then the type, then the control type if
+    the packet is a control packet), so the caller doesn't need to know
+    the origin and purpose of the packet in advance.
+
+    Sequential arguments:
+    buffer -- See buffer_to_packet.
+
+    Keyword arguments:
+    offset -- See buffer_to_packet.
+    end -- See buffer_to_packet.
+
+    Returns:
+    a PacketCodec, where the codec's purpose is the first one defined
+    (in packetdefs) with the same signature and layout.
+    '''
+    if not _classifier_table:
+        _build_classifier_table()
+    if end is None:
+        end = len(buffer)
+    i = offset + _basic_size
+    if i >= end:
+        raise ValueError("The packet is only {} byte(s) so it is"
+                         " missing the type.".format(end - offset))
+    if _protocol_id_struct.unpack_from(buffer, offset)[0] != PROTOCOL_ID:
+        raise ValueError("The packet doesn't start with the Minetest"
+                         " protocol ID.")
+    reliable = False
+    packet_type = buffer[i]
+    if packet_type == _TYPE_RELIABLE_I:
+        reliable = True
+        i += _reliable_size
+        if i >= end:
+            raise ValueError("The reliable packet is only {} byte(s) so"
+                             " it is missing the inner type."
+                             "".format(end - offset))
+        packet_type = buffer[i]
+    controltype = None
+    if packet_type == _TYPE_CONTROL_I:
+        if i + 1 >= end:
+            raise ValueError("The control packet is only {} byte(s) so"
+                             " it is missing the control type."
+                             "".format(end - offset))
+        controltype = buffer[i+1]
+    codec = _classifier_table.get((reliable, packet_type, controltype))
+    if codec is None:
+        raise ValueError(
+            "There is no packet definition for reliable={} type={}"
+            " controltype={}".format(reliable, packet_type, controltype)
+        )
+    return codec
+
+
+def decode_packet(buffer, offset=0, end=None):
+    '''
+    Classify the packet (See classify_packet) then decode it with the
+    codec (See PacketCodec.unpack_from).
+    '''
+    return classify_packet(buffer, offset, end).unpack_from(buffer,
+                                                            offset, end)
+
+
+_rebuild_c_like_index()
+compile_packet_codecs()
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+'''
+Counters and histograms for the network layer.
+
+The instrumented code checks metrics.enabled before recording
+anything, so when metrics are disabled (the default) each hook costs
+one attribute lookup. Enable them with metrics.enable() then write a
+snapshot with metrics.dump(path) as JSON or as Prometheus text (the
+format read by the Prometheus node exporter's textfile collector).
+'''
+from __future__ import print_function
+import json
+import os
+import tempfile
+
+from bisect import bisect_left
+
+RTT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+               1.0, 2.5)  # seconds
+QUEUE_DEPTH_BUCKETS = (1, 4, 16, 64, 256, 1024, 4096, 16384)  # packets
+
+
+class Counter:
+    '''
+    A count that only goes up, optionally split by one label (such as
+    the packet purpose).
+
+    Attributes:
+    values -- a dict of label value to count (the key is None if the
+        counter has no label)
+    '''
+    __slots__ = ('name', 'help', 'label', 'values')
+
+    def __init__(self, name, help, label=None):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.values = {}
+
+    def inc(self, amount=1, label_value=None):
+        values = self.values
+        values[label_value] = values.get(label_value, 0) + amount
+
+    def total(self):
+        return sum(self.values.values())
+
+    def reset(self):
+        self.values.clear()
+
+    def snapshot(self):
+        if self.label is None:
+            return self.values.get(None, 0)
+        return dict(self.values)
+
+    def prometheus_lines(self):
+        yield "# HELP {} {}".format(self.name, self.help)
+        yield "# TYPE {} counter".format(self.name)
+        if self.label is None:
+            yield "{} {}".format(self.name, self.values.get(None, 0))
+            return
+        for label_value, count in sorted(self.values.items()):
+            yield '{}{{{}="{}"}} {}'.format(self.name, self.label,
+                                            label_value, count)
+
+
+class Histogram:
+    '''
+    Count observations in buckets (each bucket counts the observations
+    that are at most its upper bound but more than the previous bound).
+
+    Attributes:
+    buckets -- the upper bounds in increasing order
+    counts -- the count for each bucket, then the count of observations
+        above the last bound
+    sum -- the sum of all observations
+    count -- the number of observations
+    '''
+    __slots__ = ('name', 'help', 'buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, name, help, buckets):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def reset(self):
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def snapshot(self):
+        return {
+            'buckets': list(self.buckets),
+            'counts': list(self.counts),
+            'sum': self.sum,
+            'count': self.count,
+        }
+
+    def prometheus_lines(self):
+        yield "# HELP {} {}".format(self.name, self.help)
+        yield "# TYPE {} histogram".format(self.name)
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield '{}_bucket{{le="{}"}} {}'.format(self.name, bound,
+                                                   cumulative)
+        yield '{}_bucket{{le="+Inf"}} {}'.format(self.name, self.count)
+        yield "{}_sum {}".format(self.name, self.sum)
+        yield "{}_count {}".format(self.name, self.count)
+
+
+class Metrics:
+    '''
+    The metrics of the network layer (use the metrics instance in this
+    module rather than creating another).
+
+    Attributes:
+    enabled -- True if the hooks should record anything
+    '''
+    def __init__(self):
+        self.enabled = False
+        self.packets_in = Counter(
+            "voxboxor_packets_received_total",
+            "Datagrams received, by packet purpose.", label="purpose",
+        )
+        self.packets_out = Counter(
+            "voxboxor_packets_sent_total",
+            "Datagrams sent, by packet purpose.", label="purpose",
+        )
+        self.bytes_in = Counter("voxboxor_received_bytes_total",
+                                "Bytes received in datagrams.")
+        self.bytes_out = Counter("voxboxor_sent_bytes_total",
+                                 "Bytes sent in datagrams.")
+        self.decode_errors = Counter(
+            "voxboxor_decode_errors_total",
+            "Datagrams dropped because they couldn't be decoded.",
+        )
+        self.resends = Counter("voxboxor_resent_packets_total",
+                               "Reliable packets sent again after their"
+                               " resend timeout.")
+        self.dropped = Counter("voxboxor_dropped_payloads_total",
+                               "Payloads dropped because their send"
+                               " queue was full.")
+        self.rtt = Histogram("voxboxor_rtt_seconds",
+                             "Round-trip times of reliable packets.",
+                             RTT_BUCKETS)
+        self.queue_depth = Histogram(
+            "voxboxor_send_queue_depth",
+            "Packets waiting on the channel when a payload is queued.",
+            QUEUE_DEPTH_BUCKETS,
+        )
+
+    def all(self):
+        '''
+        Get every Counter and Histogram.
+        '''
+        return (self.packets_in, self.packets_out, self.bytes_in,
+                self.bytes_out, self.decode_errors, self.resends,
+                self.dropped, self.rtt, self.queue_depth)
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        for metric in self.all():
+            metric.reset()
+
+    def snapshot(self):
+        '''
+        Get the current values as a dict that can be saved as JSON.
+        '''
+        return {metric.name: metric.snapshot() for metric in self.all()}
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=2, sort_keys=True)
+
+    def to_prometheus(self):
+        lines = []
+        for metric in self.all():
+            lines.extend(metric.prometheus_lines())
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path, format="json"):
+        '''
+        Write a snapshot to the file. The file is replaced all at once,
+        so a reader never sees a partial snapshot.
+
+        Sequential arguments:
+        path -- the file to write
+
+        Keyword arguments:
+        format -- "json" or "prometheus"
+        '''
+        if format == "json":
+            text = self.to_json()
+        elif format == "prometheus":
+            text = self.to_prometheus()
+        else:
+            raise ValueError("The format must be json or prometheus but"
+                             " is {}".format(repr(format)))
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w') as stream:
+                stream.write(text)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+
+metrics = Metrics()
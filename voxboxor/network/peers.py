@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+'''
+A registry of connected peers for a server.
+
+Peer IDs are 16-bit. PEER_ID_INEXISTENT and PEER_ID_SERVER (and any
+other reserved IDs) are never assigned. Allocating and releasing an ID
+are O(1): a bitmap marks IDs in use, IDs never used yet are taken from
+a counter, and released IDs wait in a FIFO free list until the counter
+runs out (so an ID isn't reused right away while stale packets for it
+may still arrive).
+
+Idle peers are found with a timer wheel, so the cost of reaping depends
+on the elapsed time and the number of expiring peers, not the total
+number of peers, and marking a peer as active is O(1).
+'''
+from collections import deque
+
+from voxboxor.network.connection import (
+    PEER_ID_INEXISTENT,
+    PEER_ID_SERVER,
+)
+
+PEER_ID_FIRST = PEER_ID_SERVER + 1
+PEER_ID_LAST = 0xFFFF
+PEER_TIMEOUT = 30.0  # seconds without a packet before a peer is reaped
+TIMER_WHEEL_RESOLUTION = 1.0  # seconds per slot
+TIMER_WHEEL_SLOTS = 64
+
+
+class PeerIdAllocator:
+    '''
+    Allocate 16-bit peer IDs in O(1).
+
+    Attributes:
+    used -- a bytearray where used[peer_id] is 1 if the ID is in use or
+        reserved
+    count -- the number of IDs in use (not counting reserved IDs)
+    capacity -- the number of IDs that can be in use at once
+    '''
+    def __init__(self, first=PEER_ID_FIRST, last=PEER_ID_LAST,
+                 reserved=()):
+        '''
+        Keyword arguments:
+        first -- the lowest ID to assign
+        last -- the highest ID to assign
+        reserved -- IDs that must never be assigned (in addition to
+            PEER_ID_INEXISTENT and PEER_ID_SERVER)
+        '''
+        if not (PEER_ID_SERVER < first <= last <= PEER_ID_LAST):
+            raise ValueError("The peer ID range {}-{} is not valid."
+                             "".format(first, last))
+        self.first = first
+        self.last = last
+        self.used = bytearray(PEER_ID_LAST + 1)
+        self.used[PEER_ID_INEXISTENT] = 1
+        self.used[PEER_ID_SERVER] = 1
+        self.reserved = frozenset(reserved)
+        reserved_count = 0
+        for peer_id in self.reserved:
+            if first <= peer_id <= last and not self.used[peer_id]:
+                reserved_count += 1
+            self.used[peer_id] = 1
+        self.capacity = last - first + 1 - reserved_count
+        self.count = 0
+        self._free = deque()
+        self._next_unused = first
+
+    def __contains__(self, peer_id):
+        return (self.first <= peer_id <= self.last
+                and bool(self.used[peer_id])
+                and peer_id not in self.reserved)
+
+    def _skip_used(self):
+        # Reserved IDs are skipped (each only once, since the counter
+        #   never goes back).
+        peer_id = self._next_unused
+        while peer_id <= self.last and self.used[peer_id]:
+            peer_id += 1
+        self._next_unused = peer_id
+        return peer_id
+
+    def peek(self):
+        '''
+        Get the ID that allocate would return next (None if there are no
+        free IDs) without allocating it.
+        '''
+        peer_id = self._skip_used()
+        if peer_id <= self.last:
+            return peer_id
+        if self._free:
+            return self._free[0]
+        return None
+
+    def allocate(self):
+        '''
+        Get a free peer ID and mark it as used. IDs that were never used
+        are assigned first, then released IDs in the order they were
+        released.
+
+        Returns:
+        the peer ID, or None if there are no free IDs.
+        '''
+        peer_id = self._skip_used()
+        if peer_id <= self.last:
+            self._next_unused = peer_id + 1
+        elif self._free:
+            peer_id = self._free.popleft()
+        else:
+            return None
+        self.used[peer_id] = 1
+        self.count += 1
+        return peer_id
+
+    def release(self, peer_id):
+        '''
+        Mark the peer ID as free.
+        '''
+        if peer_id not in self:
+            raise ValueError("Peer ID {} is not allocated."
+                             "".format(peer_id))
+        self.used[peer_id] = 0
+        self.count -= 1
+        self._free.append(peer_id)
+
+
+class Peer:
+    '''
+    Attributes:
+    peer_id -- the 16-bit peer ID
+    address -- the address (such as (host, port)) of the peer
+    last_seen -- the time (in seconds) of the last packet from the peer
+    data -- anything the server stores for the peer (such as a
+        ReliableConnection)
+    '''
+    __slots__ = ('peer_id', 'address', 'last_seen', 'data', '_wheel_tick')
+
+    def __init__(self, peer_id, address, now, data=None):
+        self.peer_id = peer_id
+        self.address = address
+        self.last_seen = now
+        self.data = data
+        self._wheel_tick = None
+
+
+class PeerTable:
+    '''
+    Map peer IDs to addresses in both directions and reap idle peers.
+
+    Attributes:
+    peers -- a dict of peer ID to Peer
+    peer_ids -- a dict of address to peer ID
+    allocator -- a PeerIdAllocator (or any object with the same methods)
+    timeout -- seconds without a packet before a peer is reaped
+    '''
+    def __init__(self, allocator=None, timeout=PEER_TIMEOUT,
+                 resolution=TIMER_WHEEL_RESOLUTION,
+                 slot_count=TIMER_WHEEL_SLOTS, now=0.0):
+        if allocator is None:
+            allocator = PeerIdAllocator()
+        self.allocator = allocator
+        self.timeout = timeout
+        self.peers = {}
+        self.peer_ids = {}
+        self.added_count = 0
+        self.removed_count = 0
+        self.reaped_count = 0
+        self.full_count = 0
+        self._resolution = resolution
+        self._wheel = [[] for _ in range(slot_count)]
+        self._tick = int(now / resolution)
+
+    def __len__(self):
+        return len(self.peers)
+
+    def __contains__(self, peer_id):
+        return peer_id in self.peers
+
+    def get(self, peer_id):
+        '''
+        Get the Peer (None if the peer ID isn't connected).
+        '''
+        return self.peers.get(peer_id)
+
+    def get_by_address(self, address):
+        '''
+        Get the Peer at the address (None if it isn't connected).
+        '''
+        peer_id = self.peer_ids.get(address)
+        if peer_id is None:
+            return None
+        return self.peers[peer_id]
+
+    def _schedule(self, peer):
+        wheel = self._wheel
+        tick = int((peer.last_seen + self.timeout) / self._resolution) + 1
+        tick = max(tick, self._tick + 1)
+        peer._wheel_tick = tick
+        wheel[tick % len(wheel)].append(peer.peer_id)
+
+    def add(self, address, now, data=None):
+        '''
+        Assign a peer ID to the address.
+
+        Returns:
+        the new Peer, or None if there are no free peer IDs.
+        '''
+        if address in self.peer_ids:
+            raise ValueError("{} is already peer {}"
+                             "".format(address, self.peer_ids[address]))
+        peer_id = self.allocator.allocate()
+        if peer_id is None:
+            self.full_count += 1
+            return None
+        peer = Peer(peer_id, address, now, data=data)
+        self.peers[peer_id] = peer
+        self.peer_ids[address] = peer_id
+        self.added_count += 1
+        self._schedule(peer)
+        return peer
+
+    def remove(self, peer_id):
+        '''
+        Forget the peer and free its ID.
+
+        Returns:
+        the removed Peer.
+        '''
+        peer = self.peers.pop(peer_id)
+        del self.peer_ids[peer.address]
+        peer._wheel_tick = None
+        self.allocator.release(peer_id)
+        self.removed_count += 1
+        return peer
+
+    def touch(self, peer_id, now):
+        '''
+        Mark the peer as active (such as when a packet arrives from it).
+        '''
+        peer = self.peers.get(peer_id)
+        if peer is not None:
+            peer.last_seen = now
+
+    def reap(self, now):
+        '''
+        Remove peers that have been idle longer than the timeout.
+
+        Returns:
+        a list of the removed Peer objects.
+        '''
+        wheel = self._wheel
+        slot_count = len(wheel)
+        target = int(now / self._resolution)
+        if target <= self._tick:
+            return []
+        # Each slot only has to be visited once even after a long gap.
+        start = max(self._tick, target - slot_count)
+        reaped = []
+        for tick in range(start + 1, target + 1):
+            self._tick = tick
+            i = tick % slot_count
+            slot = wheel[i]
+            wheel[i] = []
+            for peer_id in slot:
+                peer = self.peers.get(peer_id)
+                if (peer is None) or (peer._wheel_tick is None):
+                    continue
+                if peer._wheel_tick % slot_count != i:
+                    continue  # rescheduled into another slot
+                if peer._wheel_tick > target:
+                    wheel[i].append(peer_id)  # a later lap
+                elif now - peer.last_seen >= self.timeout:
+                    reaped.append(self.remove(peer_id))
+                else:
+                    self._schedule(peer)
+        self._tick = target
+        self.reaped_count += len(reaped)
+        return reaped
+
+    def stats(self):
+        '''
+        Get occupancy statistics as a dict.
+        '''
+        allocator = self.allocator
+        return {
+            'peers': len(self.peers),
+            'capacity': allocator.capacity,
+            'occupancy': len(self.peers) / allocator.capacity,
+            'added': self.added_count,
+            'removed': self.removed_count,
+            'reaped': self.reaped_count,
+            'full': self.full_count,
+        }
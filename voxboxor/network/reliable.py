@@ -0,0 +1,645 @@
+#!/usr/bin/env python3
+'''
+Reliable delivery for the Minetest low-level protocol.
+
+This module doesn't use sockets or timers itself. The caller passes the
+current time to each method and sends whatever datagrams are returned,
+so the same code runs under asyncio (See voxboxor.network.transport)
+or a simulated lossy network in the tests.
+
+Each channel of each peer has its own ReliableSender and
+ReliableReceiver:
+- The sender keeps up to window_size packets in flight at once (instead
+  of waiting for each ack) and resends each unacknowledged packet when
+  its timer expires. The timer is based on the measured round-trip
+  time (RTT).
+- The receiver delivers payloads in seqnum order, holding packets that
+  arrived early, and collects the acks to send in the next flush so
+  duplicates are only acknowledged once.
+- Sequence numbers are 16-bit and wrap around from 65535 to 0.
+'''
+from collections import deque
+import heapq
+from struct import Struct
+
+from voxboxor.network.connection import (
+    MAX_PACKET_SIZE,
+    SEQNUM_INITIAL,
+    TYPE_RELIABLE,
+    TYPE_SPLIT,
+    basic_h_p,
+    get_packet_codec,
+    packet_templates,
+    reliable_h_p,
+)
+
+from voxboxor.network.metrics import (
+    metrics,
+)
+
+from voxboxor.network.split import (
+    SplitReassembler,
+    split_payload,
+)
+
+SEQNUM_MAX = 0xFFFF
+CHANNEL_COUNT = 3
+# A window must be less than half of the seqnum space so an old seqnum
+#   can't be mistaken for a new one after wrapping around.
+MAX_RELIABLE_WINDOW_SIZE = 0x8000
+MIN_RELIABLE_WINDOW_SIZE = 0x40
+RELIABLE_WINDOW_SIZE = 0x400
+RESEND_TIMEOUT_MIN = 0.1  # seconds
+RESEND_TIMEOUT_MAX = 3.0  # seconds
+RESEND_TIMEOUT_INITIAL = 0.5  # seconds
+
+# The offsets of the type of a datagram and of the type of the packet
+#   inside a reliable packet (See datagram_purpose).
+_TYPE_OFFSET = Struct(">"+basic_h_p).size
+_INNER_TYPE_OFFSET = _TYPE_OFFSET + Struct(">"+reliable_h_p).size
+_TYPE_RELIABLE_I = TYPE_RELIABLE[0]
+_TYPE_SPLIT_I = TYPE_SPLIT[0]
+
+
+def seqnum_add(seqnum, count):
+    '''
+    Add count to the 16-bit seqnum, wrapping around.
+    '''
+    return (seqnum + count) & SEQNUM_MAX
+
+
+def seqnum_diff(seqnum, other):
+    '''
+    Get the signed distance from other to seqnum (positive if seqnum is
+    newer) taking wraparound into account.
+    '''
+    return ((seqnum - other + 0x8000) & SEQNUM_MAX) - 0x8000
+
+
+def datagram_purpose(data):
+    '''
+    Get the purpose of a datagram returned by
+    ReliableConnection.datagrams ("ack", "reliable" or "split") from
+    its type bytes, without decoding it.
+    '''
+    if data[_TYPE_OFFSET] != _TYPE_RELIABLE_I:
+        return "ack"
+    if data[_INNER_TYPE_OFFSET] == _TYPE_SPLIT_I:
+        return "split"
+    return "reliable"
+
+
+class RttEstimator:
+    '''
+    Estimate the round-trip time and the resend timeout the same way
+    as TCP (RFC 6298).
+
+    Attributes:
+    srtt -- the smoothed round-trip time in seconds (None until the
+        first sample)
+    rttvar -- the round-trip time variation in seconds
+    rto -- the resend timeout in seconds
+    '''
+    ALPHA = 0.125
+    BETA = 0.25
+    # Unlike TCP, don't back off further than this many times the
+    #   estimated timeout, so a packet that is lost several times in a
+    #   row doesn't stall the channel for seconds.
+    BACKOFF_LIMIT = 4
+
+    def __init__(self, rto=RESEND_TIMEOUT_INITIAL,
+                 min_rto=RESEND_TIMEOUT_MIN, max_rto=RESEND_TIMEOUT_MAX):
+        self.srtt = None
+        self.rttvar = None
+        self.rto = rto
+        self._estimated_rto = rto
+        self.min_rto = min_rto
+        self.max_rto = max_rto
+
+    def update(self, rtt):
+        '''
+        Add a round-trip time sample (in seconds).
+        '''
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar += RttEstimator.BETA * (abs(self.srtt - rtt)
+                                                - self.rttvar)
+            self.srtt += RttEstimator.ALPHA * (rtt - self.srtt)
+        self.rto = min(self.max_rto,
+                       max(self.min_rto, self.srtt + 4 * self.rttvar))
+        self._estimated_rto = self.rto
+
+    def backoff(self):
+        '''
+        Double the resend timeout after a timeout expired (up to
+        BACKOFF_LIMIT times the estimated timeout).
+        '''
+        self.rto = min(self.max_rto, self.rto * 2,
+                       self._estimated_rto * RttEstimator.BACKOFF_LIMIT)
+
+
+class _InFlight:
+    __slots__ = ('payload', 'sent', 'deadline', 'resends')
+
+    def __init__(self, payload, sent, deadline):
+        self.payload = payload
+        self.sent = sent
+        self.deadline = deadline
+        self.resends = 0
+
+
+class ReliableSender:
+    '''
+    Send reliable packets on one channel of one peer.
+
+    Attributes:
+    next_seqnum -- the seqnum of the next new packet
+    base -- the oldest seqnum that isn't acknowledged yet
+    window_size -- the maximum number of packets in flight
+    queue -- payloads that are waiting for room in the window
+    in_flight -- a dict of seqnum to packets that aren't acknowledged
+    rtt -- an RttEstimator
+    resent_count -- the total number of packets resent
+    acked_count -- the total number of packets acknowledged
+    '''
+    def __init__(self, seqnum=SEQNUM_INITIAL,
+                 window_size=RELIABLE_WINDOW_SIZE, rtt=None):
+        if not (MIN_RELIABLE_WINDOW_SIZE <= window_size
+                <= MAX_RELIABLE_WINDOW_SIZE):
+            raise ValueError(
+                "The window_size must be from {} to {} but is {}"
+                "".format(MIN_RELIABLE_WINDOW_SIZE,
+                          MAX_RELIABLE_WINDOW_SIZE, window_size)
+            )
+        self.next_seqnum = seqnum
+        self.base = seqnum
+        self.window_size = window_size
+        self.queue = deque()
+        self.in_flight = {}
+        if rtt is None:
+            rtt = RttEstimator()
+        self.rtt = rtt
+        self.resent_count = 0
+        self.acked_count = 0
+        self._deadlines = []  # a heap of (deadline, seqnum)
+
+    def send(self, payload):
+        '''
+        Queue the payload to be sent by the next poll. The payload can
+        be any object (ReliableConnection uses tuples of buffers).
+        '''
+        self.queue.append(payload)
+
+    def window_open(self):
+        return seqnum_diff(self.next_seqnum, self.base) < self.window_size
+
+    def poll(self, now, limit=None, new_limit=None):
+        '''
+        Get the packets that should be sent now: packets whose resend
+        timer expired, then new packets that fit in the window.
+
+        Keyword arguments:
+        limit -- the most packets to return (None for no limit). Any
+            others stay due until the next poll.
+        new_limit -- the most new packets to return (None for no limit)
+
+        Returns:
+        a list of (seqnum, payload) tuples.
+        '''
+        results = []
+        deadlines = self._deadlines
+        expired = []
+        backoff = False
+        if limit is None:
+            limit = MAX_RELIABLE_WINDOW_SIZE
+        if (new_limit is None) or (new_limit > limit):
+            new_limit = limit
+        while (deadlines and deadlines[0][0] <= now
+               and len(expired) < limit):
+            deadline, seqnum = heapq.heappop(deadlines)
+            entry = self.in_flight.get(seqnum)
+            if (entry is None) or (entry.deadline != deadline):
+                continue  # acknowledged or rescheduled already
+            expired.append((seqnum, entry))
+            if entry.resends > 0:
+                backoff = True
+        if backoff:
+            # Only back off (once per poll) if a resent packet timed out
+            #   again, since a packet that timed out once was probably
+            #   just lost (the other packets in the window still update
+            #   the RTT).
+            self.rtt.backoff()
+        if expired and metrics.enabled:
+            metrics.resends.inc(len(expired))
+        for seqnum, entry in expired:
+            entry.resends += 1
+            self.resent_count += 1
+            entry.sent = now
+            entry.deadline = now + self.rtt.rto
+            heapq.heappush(deadlines, (entry.deadline, seqnum))
+            results.append((seqnum, entry.payload))
+        new_limit = min(new_limit, limit - len(results))
+        while new_limit > 0 and self.queue and self.window_open():
+            new_limit -= 1
+            payload = self.queue.popleft()
+            seqnum = self.next_seqnum
+            self.next_seqnum = seqnum_add(seqnum, 1)
+            entry = _InFlight(payload, now, now + self.rtt.rto)
+            self.in_flight[seqnum] = entry
+            heapq.heappush(deadlines, (entry.deadline, seqnum))
+            results.append((seqnum, payload))
+        return results
+
+    def on_ack(self, seqnum, now):
+        '''
+        Handle an ack from the peer.
+
+        Returns:
+        True if the seqnum was in flight, otherwise False (such as for
+        a duplicate ack).
+        '''
+        entry = self.in_flight.pop(seqnum, None)
+        if entry is None:
+            return False
+        self.acked_count += 1
+        if entry.resends == 0:
+            # Only measure packets that were sent once (Karn's
+            #   algorithm), since the ack of a resent packet may be for
+            #   any of the copies.
+            self.rtt.update(now - entry.sent)
+            if metrics.enabled:
+                metrics.rtt.observe(now - entry.sent)
+        while (self.base != self.next_seqnum
+                and self.base not in self.in_flight):
+            self.base = seqnum_add(self.base, 1)
+        if not self.in_flight:
+            self._deadlines.clear()
+        return True
+
+    def next_deadline(self):
+        '''
+        Get the time when poll should be called next (None if nothing
+        is queued or in flight).
+        '''
+        if self.queue and self.window_open():
+            return 0.0
+        return self.next_resend_deadline()
+
+    def next_resend_deadline(self):
+        '''
+        Get the time when the next packet in flight should be resent
+        (None if nothing is in flight).
+        '''
+        deadlines = self._deadlines
+        while deadlines:
+            deadline, seqnum = deadlines[0]
+            entry = self.in_flight.get(seqnum)
+            if (entry is not None) and (entry.deadline == deadline):
+                return deadline
+            heapq.heappop(deadlines)
+        return None
+
+    def idle(self):
+        return not (self.queue or self.in_flight)
+
+
+class ReliableReceiver:
+    '''
+    Receive reliable packets on one channel of one peer.
+
+    Attributes:
+    next_seqnum -- the seqnum of the next payload to deliver
+    window_size -- how far ahead of next_seqnum a packet may be
+    buffer -- a dict of seqnum to payloads that arrived early
+    '''
+    def __init__(self, seqnum=SEQNUM_INITIAL,
+                 window_size=MAX_RELIABLE_WINDOW_SIZE, copy=bytes):
+        '''
+        Keyword arguments:
+        copy -- a function that copies a payload that arrived early
+            (so the payload can be any object, not only a buffer).
+        '''
+        self.next_seqnum = seqnum
+        self.window_size = window_size
+        self.buffer = {}
+        self.copy = copy
+        self._acks = []
+        self._ack_set = set()
+
+    def _ack(self, seqnum):
+        if seqnum not in self._ack_set:
+            self._ack_set.add(seqnum)
+            self._acks.append(seqnum)
+
+    def receive(self, seqnum, payload):
+        '''
+        Handle a reliable packet from the peer.
+
+        Sequential arguments:
+        seqnum -- the seqnum of the packet
+        payload -- the payload of the packet (a payload that arrives
+            early is copied, since the buffer it is in may be reused).
+
+        Returns:
+        a list of payloads that can now be delivered, in order.
+        '''
+        diff = seqnum_diff(seqnum, self.next_seqnum)
+        if diff < 0:
+            # It was already delivered, so the ack was probably lost.
+            self._ack(seqnum)
+            return []
+        if diff >= self.window_size:
+            return []  # Don't ack it so the peer sends it again later.
+        self._ack(seqnum)
+        if diff > 0:
+            if seqnum not in self.buffer:
+                self.buffer[seqnum] = self.copy(payload)
+            return []
+        results = [payload]
+        seqnum = seqnum_add(seqnum, 1)
+        buffer = self.buffer
+        while seqnum in buffer:
+            results.append(buffer.pop(seqnum))
+            seqnum = seqnum_add(seqnum, 1)
+        self.next_seqnum = seqnum
+        return results
+
+    def take_acks(self):
+        '''
+        Get the seqnums that should be acknowledged (each only once)
+        and forget them.
+        '''
+        acks = self._acks
+        self._acks = []
+        self._ack_set.clear()
+        return acks
+
+
+def _copy_item(item):
+    return (item[0], bytes(item[1]))
+
+
+class ReliableConnection:
+    '''
+    The reliable channels between this side and one peer.
+
+    A payload larger than fits in one packet of max_packet_size is sent
+    as split packets (See voxboxor.network.split) and reassembled by the
+    receiving ReliableConnection.
+
+    Attributes:
+    origin -- 'client' or 'server' (this side)
+    sender_peer_id -- the peer ID of this side (sent in each packet)
+    senders -- a ReliableSender for each channel
+    receivers -- a ReliableReceiver for each channel
+    reassembler -- the SplitReassembler for split payloads from the
+        peer (it may be shared by the connections to many peers).
+    '''
+    def __init__(self, origin, sender_peer_id, seqnum=SEQNUM_INITIAL,
+                 channel_count=CHANNEL_COUNT,
+                 window_size=RELIABLE_WINDOW_SIZE,
+                 max_packet_size=MAX_PACKET_SIZE, reassembler=None,
+                 peer=None):
+        '''
+        Sequential arguments:
+        origin -- 'client' or 'server' (this side)
+        sender_peer_id -- the peer ID of this side
+
+        Keyword arguments:
+        seqnum -- the first seqnum sent and expected on each channel
+        max_packet_size -- the largest packet to send (in bytes)
+        reassembler -- a shared SplitReassembler (if None, the
+            connection has its own).
+        peer -- anything that identifies the peer in the keys of a
+            shared reassembler, such as its peer ID.
+        '''
+        self.origin = origin
+        self.sender_peer_id = sender_peer_id
+        self.rtt = RttEstimator()
+        self.senders = tuple(
+            ReliableSender(seqnum, window_size=window_size, rtt=self.rtt)
+            for _ in range(channel_count)
+        )
+        self.receivers = tuple(ReliableReceiver(seqnum, copy=_copy_item)
+                               for _ in range(channel_count))
+        if reassembler is None:
+            reassembler = SplitReassembler()
+        self.reassembler = reassembler
+        self.peer = peer
+        self._split_seqnums = [seqnum] * channel_count
+        reliable_codec = get_packet_codec(origin, "reliable")
+        split_codec = get_packet_codec(origin, "split")
+        self._ack_codec = get_packet_codec(origin, "ack")
+        # The packet is a reliable header followed by an inner packet,
+        #   which is an original header or a split header.
+        header_count = (reliable_codec.fieldsdef[0][1]
+                        + reliable_codec.fieldsdef[1][1])
+        self._header_struct = Struct(">"+reliable_codec.pack[:header_count])
+        self._split_struct = Struct(">"+split_codec.pack[header_count:])
+        self._original_header = reliable_codec.defaults[header_count]
+        self._split_type = split_codec.defaults[header_count]
+        self.max_payload_size = (max_packet_size - reliable_codec.size)
+        self.chunk_size = (max_packet_size - self._header_struct.size
+                           - self._split_struct.size)
+        if self.chunk_size < 1:
+            raise ValueError("The max_packet_size {} is too small."
+                             "".format(max_packet_size))
+        # Each template is a list of values to pack for a channel,
+        #   where only the seqnum changes for each packet.
+        self._header_templates = tuple(
+            values[:header_count]
+            for values in self._templates(reliable_codec)
+        )
+        self._ack_templates = self._templates(self._ack_codec)
+        self._header_seqnum_i = reliable_codec.index[('reliable', 'seqnum')]
+        self._ack_seqnum_i = self._ack_codec.index[('control', 'seqnum')]
+
+    def _templates(self, codec):
+        # A server has a connection per peer with the same
+        #   sender_peer_id, so pack the values once per codec.
+        key = (codec.origin, codec.purpose, self.sender_peer_id,
+               len(self.senders))
+        templates = packet_templates.get(key)
+        if templates is None:
+            templates = tuple(
+                tuple(codec.pack_values({
+                    'sender_peer_id': self.sender_peer_id,
+                    'channel': channel,
+                    'seqnum': 0,
+                    'chunk_count': 0,
+                    'chunk_num': 0,
+                }))
+                for channel in range(len(self.senders))
+            )
+            packet_templates[key] = templates
+        return tuple(list(values) for values in templates)
+
+    def send(self, channel, payload):
+        '''
+        Queue the payload (any buffer) to be sent reliably on the
+        channel, as split packets if it is too large for one packet.
+        '''
+        sender = self.senders[channel]
+        if len(payload) <= self.max_payload_size:
+            sender.send((self._original_header, payload))
+            return
+        chunks = split_payload(payload, self.chunk_size)
+        split_seqnum = self._split_seqnums[channel]
+        self._split_seqnums[channel] = seqnum_add(split_seqnum, 1)
+        split_pack = self._split_struct.pack
+        for chunk_num in range(len(chunks)):
+            sender.send((
+                split_pack(self._split_type, split_seqnum, len(chunks),
+                           chunk_num),
+                chunks[chunk_num],
+            ))
+
+    def receive(self, packet, now):
+        '''
+        Handle a packet from the peer that was decoded with the
+        'reliable', 'split' or 'ack' layout (See classify_packet).
+
+        Returns:
+        a list of (channel, payload) tuples that can now be delivered.
+        '''
+        channel = packet.channel[0]
+        if channel >= len(self.receivers):
+            return []
+        category = packet.fieldsdef[-1][0]
+        if category == 'control':
+            self.senders[channel].on_ack(packet.get('seqnum'), now)
+            return []
+        if category == 'split':
+            split = (packet.get('seqnum', 'split'),
+                     packet.get('chunk_count', 'split'),
+                     packet.get('chunk_num', 'split'))
+        else:
+            split = None
+        results = []
+        for split, payload in self.receivers[channel].receive(
+                packet.seqnum, (split, packet.payload)):
+            if split is not None:
+                payload = self.reassembler.add(
+                    (self.peer, channel, split[0]), split[1], split[2],
+                    payload, now,
+                )
+                if payload is None:
+                    continue
+            results.append((channel, payload))
+        return results
+
+    def datagrams(self, now, limit=None, new_limit=None, weights=None):
+        '''
+        Get the datagrams (bytes) that should be sent now: acks first,
+        then resent and new packets.
+
+        Keyword arguments:
+        limit -- the most reliable packets to return, not counting acks
+            (None for no limit)
+        new_limit -- the most new reliable packets to return (None for
+            no limit)
+        weights -- how many packets each channel may send per turn when
+            the limits don't let every channel send everything (None
+            for one each). The channels take turns in order.
+        '''
+        results = []
+        ack_pack = self._ack_codec.struct.pack
+        ack_seqnum_i = self._ack_seqnum_i
+        for channel in range(len(self.senders)):
+            values = self._ack_templates[channel]
+            for seqnum in self.receivers[channel].take_acks():
+                values[ack_seqnum_i] = seqnum
+                results.append(ack_pack(*values))
+        if (limit is None) and (new_limit is None):
+            for channel in range(len(self.senders)):
+                self._append_packets(results, channel,
+                                     self.senders[channel].poll(now))
+            return results
+        if limit is None:
+            limit = MAX_RELIABLE_WINDOW_SIZE * len(self.senders)
+        if new_limit is None:
+            new_limit = limit
+        if weights is None:
+            weights = (1,) * len(self.senders)
+        progress = True
+        while progress and limit > 0:
+            progress = False
+            for channel in range(len(self.senders)):
+                if limit < 1:
+                    break
+                sender = self.senders[channel]
+                next_seqnum = sender.next_seqnum
+                turn = min(weights[channel], limit)
+                packets = sender.poll(now, limit=turn,
+                                      new_limit=min(turn, new_limit))
+                if not packets:
+                    continue
+                progress = True
+                limit -= len(packets)
+                new_limit -= seqnum_diff(sender.next_seqnum, next_seqnum)
+                self._append_packets(results, channel, packets)
+        return results
+
+    def _append_packets(self, results, channel, packets):
+        header_pack = self._header_struct.pack
+        header_seqnum_i = self._header_seqnum_i
+        values = self._header_templates[channel]
+        for seqnum, item in packets:
+            values[header_seqnum_i] = seqnum
+            results.append(b"".join((header_pack(*values), item[0],
+                                     item[1])))
+
+    def in_flight_count(self):
+        '''
+        Get the number of packets sent on all channels that aren't
+        acknowledged yet.
+        '''
+        return sum(len(sender.in_flight) for sender in self.senders)
+
+    def next_deadline(self):
+        '''
+        Get the time when datagrams should be called next (None if
+        there is nothing to send or resend).
+        '''
+        results = [deadline for deadline in
+                   (sender.next_deadline() for sender in self.senders)
+                   if deadline is not None]
+        if self.has_acks():
+            results.append(0.0)
+        if not results:
+            return None
+        return min(results)
+
+    def next_resend_deadline(self):
+        '''
+        Get the time when the next packet in flight should be resent,
+        ignoring new packets that are waiting (None if nothing is in
+        flight).
+        '''
+        results = [deadline for deadline in
+                   (sender.next_resend_deadline()
+                    for sender in self.senders)
+                   if deadline is not None]
+        if not results:
+            return None
+        return min(results)
+
+    def has_acks(self):
+        '''
+        Check whether there are acks waiting to be sent.
+        '''
+        for receiver in self.receivers:
+            if receiver._acks:
+                return True
+        return False
+
+    def idle(self):
+        '''
+        Check whether everything sent was acknowledged.
+        '''
+        for sender in self.senders:
+            if not sender.idle():
+                return False
+        return True
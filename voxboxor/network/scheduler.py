@@ -0,0 +1,425 @@
+#!/usr/bin/env python3
+'''
+Schedule outbound datagrams for many peers.
+
+Each peer has a PeerScheduler that limits how fast its
+ReliableConnection may send:
+- A TokenBucket limits the bytes per second (with bursts).
+- A CongestionWindow limits how many reliable packets may be in flight
+  on all channels together. It grows as packets are acknowledged and
+  shrinks when packets have to be resent (AIMD, like TCP).
+- Each channel still has its own queue (ReliableSender.queue). When the
+  limits don't let every channel send everything, the channels take
+  turns, and lower channel numbers get more packets per turn (See
+  CHANNEL_WEIGHTS).
+- A payload is dropped instead of queued if the channel's queue is
+  already max_queue_depth packets deep.
+
+The SendScheduler collects the peers that have something to send (such
+as acks for packets that just arrived) and flushes all of them at once,
+so the acks for a burst of packets received in one event loop iteration
+are sent together (each seqnum once) instead of after every packet. A
+Minetest low-level packet is always one whole datagram, so acks and
+small packets can't be combined into one datagram; the batching is in
+sending them all in one pass.
+'''
+import heapq
+
+from voxboxor.network.connection import (
+    MAX_PACKET_SIZE,
+)
+
+from voxboxor.network.metrics import (
+    metrics,
+)
+
+PEER_SEND_RATE = 8 * 1024 * 1024  # bytes per second (None for no limit)
+PEER_SEND_BURST = 256 * 1024  # bytes
+CHANNEL_WEIGHTS = (4, 2, 1)  # packets per turn for channels 0, 1, 2
+MAX_QUEUE_DEPTH = 0x4000  # packets waiting on each channel
+CONGESTION_WINDOW_INITIAL = 32  # packets
+CONGESTION_WINDOW_MIN = 4  # packets
+CONGESTION_WINDOW_MAX = 0x1000  # packets
+
+
+class TokenBucket:
+    '''
+    Allow rate bytes per second on average with bursts of up to burst
+    bytes.
+
+    Attributes:
+    tokens -- the bytes that may be sent now (negative if the last send
+        went over, in which case nothing more may be sent until it is
+        paid back)
+    '''
+    __slots__ = ('rate', 'burst', 'tokens', '_updated')
+
+    def __init__(self, rate, burst, now=0.0):
+        if rate <= 0 or burst <= 0:
+            raise ValueError("The rate and burst must be positive.")
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self._updated = now
+
+    def refill(self, now):
+        '''
+        Add the tokens earned since the last refill.
+
+        Returns:
+        the tokens available now.
+        '''
+        if now > self._updated:
+            self.tokens = min(self.burst, self.tokens
+                              + (now - self._updated) * self.rate)
+            self._updated = now
+        return self.tokens
+
+    def consume(self, size):
+        '''
+        Take size tokens (the caller checks that tokens were positive
+        first, so one packet may overdraw the bucket).
+        '''
+        self.tokens -= size
+
+    def ready_time(self, size=1):
+        '''
+        Get when size tokens will be available (as of the last refill).
+        '''
+        if self.tokens >= size:
+            return self._updated
+        return self._updated + (size - self.tokens) / self.rate
+
+
+class CongestionWindow:
+    '''
+    Limit the reliable packets in flight with additive increase and
+    multiplicative decrease.
+
+    Attributes:
+    size -- the number of packets allowed in flight
+    threshold -- the size at which slow start (doubling every round
+        trip) turns into congestion avoidance (one more packet every
+        round trip)
+    loss_count -- how many times the window shrank
+    '''
+    __slots__ = ('size', 'min_size', 'max_size', 'threshold', 'loss_count',
+                 '_recovery_until')
+
+    def __init__(self, size=CONGESTION_WINDOW_INITIAL,
+                 min_size=CONGESTION_WINDOW_MIN,
+                 max_size=CONGESTION_WINDOW_MAX):
+        self.size = float(size)
+        self.min_size = min_size
+        self.max_size = max_size
+        self.threshold = float(max_size)
+        self.loss_count = 0
+        self._recovery_until = None
+
+    def on_ack(self, count):
+        '''
+        Grow the window after count packets were acknowledged.
+        '''
+        for _ in range(count):
+            if self.size < self.threshold:
+                self.size += 1.0
+            else:
+                self.size += 1.0 / self.size
+        if self.size > self.max_size:
+            self.size = float(self.max_size)
+
+    def on_loss(self, now, rtt):
+        '''
+        Halve the window because packets had to be resent (at most once
+        per round trip, since one burst of loss affects a whole
+        window).
+
+        Sequential arguments:
+        now -- the current time in seconds
+        rtt -- the current round-trip time estimate in seconds
+        '''
+        if ((self._recovery_until is not None)
+                and (now < self._recovery_until)):
+            return
+        self._recovery_until = now + rtt
+        self.threshold = max(self.size / 2, float(self.min_size))
+        self.size = self.threshold
+        self.loss_count += 1
+
+    def available(self, in_flight):
+        return max(0, int(self.size) - in_flight)
+
+
+class PeerScheduler:
+    '''
+    Apply the rate limit and congestion window of one peer to its
+    ReliableConnection.
+
+    Attributes:
+    connection -- the ReliableConnection
+    address -- where to send the datagrams (None for a connected
+        transport)
+    bucket -- the TokenBucket (None for no rate limit)
+    window -- the CongestionWindow
+    weights -- the packets per turn for each channel
+    max_queue_depth -- the most packets that may wait on each channel
+    dropped_count -- payloads dropped because their queue was full
+    sent_count -- datagrams sent (including acks)
+    sent_bytes -- bytes sent
+    deadline -- when datagrams should be called next (set by datagrams)
+    '''
+    __slots__ = ('connection', 'address', 'bucket', 'window', 'weights',
+                 'max_queue_depth', 'dropped_count', 'sent_count',
+                 'sent_bytes', 'deadline', '_acked_count', '_resent_count')
+
+    def __init__(self, connection, address=None, rate=PEER_SEND_RATE,
+                 burst=PEER_SEND_BURST, weights=CHANNEL_WEIGHTS,
+                 max_queue_depth=MAX_QUEUE_DEPTH, window=None, now=0.0):
+        self.connection = connection
+        self.address = address
+        self.bucket = None
+        if rate is not None:
+            self.bucket = TokenBucket(rate, burst, now=now)
+        if window is None:
+            window = CongestionWindow()
+        self.window = window
+        channel_count = len(connection.senders)
+        self.weights = tuple(weights[channel] if channel < len(weights)
+                             else 1 for channel in range(channel_count))
+        self.max_queue_depth = max_queue_depth
+        self.dropped_count = 0
+        self.sent_count = 0
+        self.sent_bytes = 0
+        self.deadline = None
+        self._acked_count = 0
+        self._resent_count = 0
+
+    def packet_count(self, payload):
+        '''
+        Get the number of packets the payload will be sent as.
+        '''
+        connection = self.connection
+        if len(payload) <= connection.max_payload_size:
+            return 1
+        return -(-len(payload) // connection.chunk_size)
+
+    def send(self, channel, payload):
+        '''
+        Queue the payload on the channel of the connection.
+
+        Returns:
+        True if it was queued, or False if it was dropped since the
+        channel's queue is full.
+        '''
+        queue = self.connection.senders[channel].queue
+        if len(queue) + self.packet_count(payload) > self.max_queue_depth:
+            self.dropped_count += 1
+            if metrics.enabled:
+                metrics.dropped.inc()
+            return False
+        self.connection.send(channel, payload)
+        if metrics.enabled:
+            metrics.queue_depth.observe(len(queue))
+        return True
+
+    def queue_depths(self):
+        return tuple(len(sender.queue)
+                     for sender in self.connection.senders)
+
+    def _update_window(self, now):
+        connection = self.connection
+        acked = sum(sender.acked_count for sender in connection.senders)
+        resent = sum(sender.resent_count for sender in connection.senders)
+        if acked != self._acked_count:
+            self.window.on_ack(acked - self._acked_count)
+            self._acked_count = acked
+        if resent != self._resent_count:
+            self._resent_count = resent
+            rtt = connection.rtt.srtt
+            if rtt is None:
+                rtt = connection.rtt.rto
+            self.window.on_loss(now, rtt)
+
+    def datagrams(self, now):
+        '''
+        Get the datagrams that may be sent now within the limits, and
+        set deadline to when this should be called next (None if there
+        is nothing more to send).
+        '''
+        connection = self.connection
+        self._update_window(now)
+        new_limit = self.window.available(connection.in_flight_count())
+        limit = None
+        bucket = self.bucket
+        if bucket is not None:
+            tokens = bucket.refill(now)
+            limit = 0
+            if tokens > 0:
+                limit = -(-int(tokens) // MAX_PACKET_SIZE)
+        results = connection.datagrams(now, limit=limit,
+                                       new_limit=new_limit,
+                                       weights=self.weights)
+        size = 0
+        for data in results:
+            size += len(data)
+        if bucket is not None:
+            bucket.consume(size)
+        self.sent_count += len(results)
+        self.sent_bytes += size
+        deadline = connection.next_deadline()
+        if deadline is not None:
+            if (bucket is not None) and (bucket.tokens <= 0):
+                deadline = max(deadline, bucket.ready_time())
+            elif (deadline <= now and not connection.has_acks()
+                  and self.window.available(
+                      connection.in_flight_count()) < 1):
+                # Only new packets are waiting, and they have to wait
+                #   for acks (which call wake).
+                deadline = connection.next_resend_deadline()
+        self.deadline = deadline
+        return results
+
+    def stats(self):
+        connection = self.connection
+        return {
+            'queue_depths': self.queue_depths(),
+            'in_flight': connection.in_flight_count(),
+            'window': self.window.size,
+            'tokens': None if self.bucket is None else self.bucket.tokens,
+            'dropped': self.dropped_count,
+            'sent': self.sent_count,
+            'sent_bytes': self.sent_bytes,
+            'losses': self.window.loss_count,
+        }
+
+
+class SendScheduler:
+    '''
+    Flush the datagrams of many peers in batches.
+
+    Attributes:
+    peers -- a dict of key (such as a peer ID) to PeerScheduler
+    flush_count -- the number of flushes
+    '''
+    def __init__(self, **kwargs):
+        '''
+        Keyword arguments:
+        kwargs -- the defaults for each PeerScheduler (See
+            PeerScheduler)
+        '''
+        self.peer_options = kwargs
+        self.peers = {}
+        self.flush_count = 0
+        self._dirty = set()
+        self._deadlines = []  # a heap of (deadline, key)
+        self._removed_dropped_count = 0
+        self._removed_sent_count = 0
+        self._removed_sent_bytes = 0
+
+    def add(self, key, connection, address=None, now=0.0):
+        '''
+        Start scheduling the connection.
+
+        Returns:
+        the new PeerScheduler.
+        '''
+        peer = PeerScheduler(connection, address, now=now,
+                             **self.peer_options)
+        self.peers[key] = peer
+        return peer
+
+    def remove(self, key):
+        peer = self.peers.pop(key, None)
+        self._dirty.discard(key)
+        if peer is not None:
+            self._removed_dropped_count += peer.dropped_count
+            self._removed_sent_count += peer.sent_count
+            self._removed_sent_bytes += peer.sent_bytes
+
+    def send(self, key, channel, payload):
+        '''
+        Queue the payload for the peer (See PeerScheduler.send) and
+        mark the peer to be flushed.
+        '''
+        queued = self.peers[key].send(channel, payload)
+        if queued:
+            self._dirty.add(key)
+        return queued
+
+    def wake(self, key):
+        '''
+        Mark the peer to be flushed (such as after a packet arrived from
+        it, since there may be acks to send or room in its window).
+        '''
+        if key in self.peers:
+            self._dirty.add(key)
+
+    def pending(self):
+        return bool(self._dirty)
+
+    def flush(self, now, sendto):
+        '''
+        Send the datagrams of every peer that was woken or whose
+        deadline passed.
+
+        Sequential arguments:
+        now -- the current time in seconds
+        sendto -- a function that sends (data, address), such as
+            DatagramTransport.sendto
+
+        Returns:
+        the time when flush should be called next (None if nothing is
+        waiting).
+        '''
+        self.flush_count += 1
+        peers = self.peers
+        deadlines = self._deadlines
+        dirty = self._dirty
+        while deadlines and deadlines[0][0] <= now:
+            deadline, key = heapq.heappop(deadlines)
+            peer = peers.get(key)
+            if (peer is not None) and (peer.deadline == deadline):
+                dirty.add(key)
+        self._dirty = set()
+        for key in dirty:
+            peer = peers.get(key)
+            if peer is None:
+                continue
+            address = peer.address
+            for data in peer.datagrams(now):
+                sendto(data, address)
+            if peer.deadline is not None:
+                heapq.heappush(deadlines, (peer.deadline, key))
+        return self.next_deadline()
+
+    def next_deadline(self):
+        if self._dirty:
+            return 0.0
+        deadlines = self._deadlines
+        peers = self.peers
+        while deadlines:
+            deadline, key = deadlines[0]
+            peer = peers.get(key)
+            if (peer is not None) and (peer.deadline == deadline):
+                return deadline
+            heapq.heappop(deadlines)
+        return None
+
+    def stats(self):
+        '''
+        Get totals for all peers as a dict.
+        '''
+        depths = [depth for peer in self.peers.values()
+                  for depth in peer.queue_depths()]
+        return {
+            'peers': len(self.peers),
+            'queued': sum(depths),
+            'max_queue_depth': max(depths) if depths else 0,
+            'dropped': self._removed_dropped_count + sum(
+                peer.dropped_count for peer in self.peers.values()),
+            'sent': self._removed_sent_count + sum(
+                peer.sent_count for peer in self.peers.values()),
+            'sent_bytes': self._removed_sent_bytes + sum(
+                peer.sent_bytes for peer in self.peers.values()),
+            'flushes': self.flush_count,
+        }
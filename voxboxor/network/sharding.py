@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+'''
+Run a server as several worker processes that share one UDP port.
+
+Each worker binds its own socket to the same address with
+SO_REUSEPORT, and the kernel picks the socket for each datagram by
+hashing its source address, so every datagram from a client goes to the
+same worker and the peer's state (PeerTable, ReliableConnection, etc.)
+never has to move between processes.
+
+Peer IDs must still be unique across all workers, since a client only
+sends its peer ID. The workers share one allocation table in shared
+memory (See SharedPeerIdAllocator), where each entry records which
+worker owns the ID, so the IDs of a worker that crashed can be freed.
+
+SO_REUSEPORT is available on Linux and most BSDs (not Windows).
+'''
+import asyncio
+import multiprocessing
+import socket
+import struct
+import sys
+import time
+
+from multiprocessing import shared_memory
+
+from voxboxor.log import (
+    get_log,
+)
+
+from voxboxor.network.peers import (
+    PEER_ID_FIRST,
+    PEER_ID_LAST,
+    PeerTable,
+)
+
+from voxboxor.network.transport import (
+    ServerProtocol,
+)
+
+_log = get_log("network")
+
+OWNER_FREE = 0
+OWNER_RESERVED = 0xFF  # PEER_ID_INEXISTENT, PEER_ID_SERVER, etc.
+MAX_WORKERS = OWNER_RESERVED - 1
+WORKER_POLL_INTERVAL = 0.1  # seconds between checks for stop
+WORKER_START_TIMEOUT = 10.0  # seconds
+
+# The shared memory is a header (the next ID to try and the number of
+#   IDs in use) followed by one owner byte per peer ID.
+_header_struct = struct.Struct("=II")
+_TABLE_OFFSET = _header_struct.size
+SHARED_SIZE = _TABLE_OFFSET + PEER_ID_LAST + 1
+
+
+def create_shared_peer_ids(reserved=()):
+    '''
+    Create the shared memory for SharedPeerIdAllocator.
+
+    Keyword arguments:
+    reserved -- peer IDs that must never be assigned (in addition to
+        those below PEER_ID_FIRST)
+
+    Returns:
+    a multiprocessing.shared_memory.SharedMemory (the creator must
+    call close and unlink when all workers are done).
+    '''
+    shm = shared_memory.SharedMemory(create=True, size=SHARED_SIZE)
+    buf = shm.buf
+    buf[:SHARED_SIZE] = bytes(SHARED_SIZE)
+    for peer_id in range(PEER_ID_FIRST):
+        buf[_TABLE_OFFSET + peer_id] = OWNER_RESERVED
+    for peer_id in reserved:
+        buf[_TABLE_OFFSET + peer_id] = OWNER_RESERVED
+    _header_struct.pack_into(buf, 0, PEER_ID_FIRST, 0)
+    return shm
+
+
+class SharedPeerIdAllocator:
+    '''
+    Allocate peer IDs from a table in shared memory so that workers
+    never assign the same ID (it has the same methods as
+    PeerIdAllocator, so it can be used by PeerTable).
+
+    IDs are tried in a circle starting after the last ID assigned (by
+    any worker), as the Minetest server does, so an ID isn't reused soon
+    after it was released and allocation is O(1) unless nearly every ID
+    is in use.
+
+    Attributes:
+    worker -- the number of this worker (0 to MAX_WORKERS - 1)
+    count -- the number of IDs in use by this worker
+    capacity -- the number of IDs that all workers can use at once
+    '''
+    def __init__(self, shm_name, lock, worker):
+        '''
+        Sequential arguments:
+        shm_name -- the name of the shared memory from
+            create_shared_peer_ids
+        lock -- a multiprocessing.Lock shared by all workers
+        worker -- the number of this worker
+        '''
+        if not (0 <= worker < MAX_WORKERS):
+            raise ValueError("The worker must be from 0 to {} but is {}"
+                             "".format(MAX_WORKERS - 1, worker))
+        self._shm = shared_memory.SharedMemory(name=shm_name)
+        self._buf = self._shm.buf
+        self._lock = lock
+        self.worker = worker
+        self._owner = worker + 1
+        self.count = 0
+        table = self._buf[_TABLE_OFFSET:SHARED_SIZE]
+        self.capacity = (PEER_ID_LAST + 1) - sum(
+            1 for owner in table.tobytes() if owner == OWNER_RESERVED
+        )
+        table.release()
+
+    def close(self):
+        self._buf.release()
+        self._shm.close()
+
+    def __contains__(self, peer_id):
+        if not (PEER_ID_FIRST <= peer_id <= PEER_ID_LAST):
+            return False
+        return self._buf[_TABLE_OFFSET + peer_id] == self._owner
+
+    def total(self):
+        '''
+        Get the number of IDs in use by all workers.
+        '''
+        return _header_struct.unpack_from(self._buf, 0)[1]
+
+    def peek(self):
+        '''
+        Get the ID that allocate would try next (another worker may take
+        it first), or None if there are no free IDs.
+        '''
+        with self._lock:
+            return self._find(_header_struct.unpack_from(self._buf, 0)[0])
+
+    def _find(self, peer_id):
+        buf = self._buf
+        for _ in range(PEER_ID_LAST - PEER_ID_FIRST + 1):
+            if peer_id > PEER_ID_LAST:
+                peer_id = PEER_ID_FIRST
+            if buf[_TABLE_OFFSET + peer_id] == OWNER_FREE:
+                return peer_id
+            peer_id += 1
+        return None
+
+    def allocate(self):
+        '''
+        Get a free peer ID and mark it as owned by this worker.
+
+        Returns:
+        the peer ID, or None if there are no free IDs.
+        '''
+        buf = self._buf
+        with self._lock:
+            next_id, total = _header_struct.unpack_from(buf, 0)
+            peer_id = self._find(next_id)
+            if peer_id is None:
+                return None
+            buf[_TABLE_OFFSET + peer_id] = self._owner
+            _header_struct.pack_into(buf, 0, peer_id + 1, total + 1)
+        self.count += 1
+        return peer_id
+
+    def release(self, peer_id):
+        '''
+        Mark the peer ID (owned by this worker) as free.
+        '''
+        buf = self._buf
+        with self._lock:
+            if peer_id not in self:
+                raise ValueError("Peer ID {} is not allocated by worker {}."
+                                 "".format(peer_id, self.worker))
+            buf[_TABLE_OFFSET + peer_id] = OWNER_FREE
+            next_id, total = _header_struct.unpack_from(buf, 0)
+            _header_struct.pack_into(buf, 0, next_id, total - 1)
+        self.count -= 1
+
+
+def release_worker_peer_ids(shm, lock, worker):
+    '''
+    Free every peer ID owned by the worker (such as after it crashed).
+
+    Returns:
+    the number of IDs freed.
+    '''
+    owner = worker + 1
+    buf = shm.buf
+    count = 0
+    with lock:
+        for peer_id in range(PEER_ID_FIRST, PEER_ID_LAST + 1):
+            if buf[_TABLE_OFFSET + peer_id] == owner:
+                buf[_TABLE_OFFSET + peer_id] = OWNER_FREE
+                count += 1
+        next_id, total = _header_struct.unpack_from(buf, 0)
+        _header_struct.pack_into(buf, 0, next_id, total - count)
+    return count
+
+
+def _run_worker(host, port, worker, shm_name, lock, protocol_factory,
+                ready, bound, stop):
+    async def serve():
+        allocator = SharedPeerIdAllocator(shm_name, lock, worker)
+        loop = asyncio.get_running_loop()
+        try:
+            transport, _ = await loop.create_datagram_endpoint(
+                lambda: protocol_factory(
+                    peer_table=PeerTable(allocator=allocator),
+                ),
+                local_addr=(host, port),
+                reuse_port=True,
+            )
+        except OSError as ex:
+            _log.error("Worker {} couldn't bind {}:{}: {}",
+                       worker, host, port, ex)
+            allocator.close()
+            return 1
+        bound.set()
+        ready.set()
+        try:
+            while not stop.is_set():
+                await asyncio.sleep(WORKER_POLL_INTERVAL)
+        finally:
+            transport.close()
+            await asyncio.sleep(0)
+            allocator.close()
+        return 0
+    sys.exit(asyncio.run(serve()))
+
+
+class ShardedServer:
+    '''
+    Run protocol_factory (a ServerProtocol subclass) in several worker
+    processes on one UDP port.
+
+    The protocol_factory must accept a peer_table keyword argument, and
+    (since workers are started with the "spawn" method by default) it
+    must be importable by name from a module.
+
+    Attributes:
+    host -- the address to listen on
+    port -- the port (if 0 was requested, the port that was picked)
+    workers -- the multiprocessing.Process of each worker
+    '''
+    def __init__(self, host, port, worker_count=None,
+                 protocol_factory=ServerProtocol, reserved=(),
+                 start_method="spawn"):
+        if worker_count is None:
+            worker_count = multiprocessing.cpu_count()
+        if not (1 <= worker_count <= MAX_WORKERS):
+            raise ValueError("The worker_count must be from 1 to {}"
+                             "".format(MAX_WORKERS))
+        self.host = host
+        self.port = port
+        self.worker_count = worker_count
+        self.protocol_factory = protocol_factory
+        self.workers = []
+        self._context = multiprocessing.get_context(start_method)
+        self._lock = self._context.Lock()
+        self._stop = self._context.Event()
+        self._shm = create_shared_peer_ids(reserved)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self, timeout=WORKER_START_TIMEOUT):
+        '''
+        Start the workers and wait until each has bound the port.
+
+        If the port is 0, a free port is picked by binding a socket
+        that isn't read. It is closed as soon as the first worker binds
+        the port, but the kernel may route a datagram that arrives
+        before then to it, in which case the datagram is dropped.
+        '''
+        placeholder = None
+        if self.port == 0:
+            # Pick a free port and hold it (with SO_REUSEPORT so the
+            #   workers can bind it too) until a worker has bound it.
+            placeholder = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            placeholder.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT,
+                                   1)
+            placeholder.bind((self.host, 0))
+            self.port = placeholder.getsockname()[1]
+        bound = self._context.Event()
+        try:
+            readies = []
+            for worker in range(self.worker_count):
+                ready = self._context.Event()
+                process = self._context.Process(
+                    target=_run_worker,
+                    args=(self.host, self.port, worker, self._shm.name,
+                          self._lock, self.protocol_factory, ready,
+                          bound, self._stop),
+                    daemon=True,
+                )
+                process.start()
+                self.workers.append(process)
+                readies.append(ready)
+            deadline = time.monotonic() + timeout
+            if placeholder is not None:
+                # The placeholder never reads, so stop the kernel from
+                #   routing datagrams to it as soon as possible.
+                while not bound.wait(WORKER_POLL_INTERVAL):
+                    if ((not any(process.is_alive()
+                                 for process in self.workers))
+                            or time.monotonic() > deadline):
+                        self.stop()
+                        raise RuntimeError("No worker started.")
+                placeholder.close()
+                placeholder = None
+            for worker, ready in enumerate(readies):
+                process = self.workers[worker]
+                while not ready.wait(WORKER_POLL_INTERVAL):
+                    if (not process.is_alive()
+                            or time.monotonic() > deadline):
+                        self.stop()
+                        raise RuntimeError("Worker {} didn't start."
+                                           "".format(worker))
+        finally:
+            if placeholder is not None:
+                placeholder.close()
+        _log.info("Started {} workers on {}:{}", self.worker_count,
+                  self.host, self.port)
+
+    def check_workers(self):
+        '''
+        Free the peer IDs of workers that exited unexpectedly.
+
+        Returns:
+        a list of the numbers of workers that exited.
+        '''
+        exited = []
+        for worker, process in enumerate(self.workers):
+            if (process is not None) and not process.is_alive():
+                freed = release_worker_peer_ids(self._shm, self._lock,
+                                                worker)
+                _log.warning("Worker {} exited with code {} ({} peer IDs"
+                             " freed)", worker, process.exitcode, freed)
+                self.workers[worker] = None
+                exited.append(worker)
+        return exited
+
+    def peer_count(self):
+        '''
+        Get the number of peer IDs in use by all workers.
+        '''
+        return _header_struct.unpack_from(self._shm.buf, 0)[1]
+
+    def stop(self, timeout=5.0):
+        '''
+        Stop the workers and free the shared memory.
+        '''
+        self._stop.set()
+        for process in self.workers:
+            if process is None:
+                continue
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        self.workers = []
+        if self._shm is not None:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+'''
+Split (fragmented) packets for payloads that are too large for one
+packet.
+
+A payload is cut into chunks of the same size (except the last one),
+and each chunk is sent reliably with a split header (seqnum,
+chunk_count, chunk_num) where the seqnum identifies the split payload
+(not the reliable packet). The receiver writes each chunk directly into
+one buffer preallocated for the whole payload, instead of collecting
+chunks and concatenating them.
+'''
+from collections import OrderedDict
+
+SPLIT_TIMEOUT = 30.0  # seconds without a new chunk before giving up
+SPLIT_MEMORY_BUDGET = 64 * 1024 * 1024  # bytes for all incomplete sets
+CHUNK_COUNT_MAX = 0xFFFF
+
+
+def split_payload(payload, chunk_size):
+    '''
+    Cut the payload into chunks without copying it.
+
+    Sequential arguments:
+    payload -- any buffer such as bytes
+    chunk_size -- the size of each chunk except the last one
+
+    Returns:
+    a list of memoryviews of the payload.
+    '''
+    if chunk_size < 1:
+        raise ValueError("The chunk_size must be at least 1.")
+    view = memoryview(payload)
+    chunks = [view[i:i+chunk_size]
+              for i in range(0, max(len(view), 1), chunk_size)]
+    if len(chunks) > CHUNK_COUNT_MAX:
+        raise ValueError(
+            "A {} byte payload would need {} chunks of {} bytes but the"
+            " maximum is {}".format(len(view), len(chunks), chunk_size,
+                                    CHUNK_COUNT_MAX)
+        )
+    return chunks
+
+
+class _SplitSet:
+    __slots__ = ('chunk_count', 'chunk_size', 'buffer', 'received',
+                 'received_count', 'last_size', 'pending_last',
+                 'updated')
+
+    def __init__(self, chunk_count, now):
+        self.chunk_count = chunk_count
+        self.chunk_size = None
+        self.buffer = None
+        self.received = bytearray(chunk_count)
+        self.received_count = 0
+        self.last_size = None
+        self.pending_last = None
+        self.updated = now
+
+
+class SplitReassembler:
+    '''
+    Reassemble split payloads from many peers and channels.
+
+    Attributes:
+    timeout -- seconds since the last chunk before an incomplete set is
+        evicted (See expire).
+    memory_budget -- the most bytes that the buffers of incomplete sets
+        may use. If a new set doesn't fit, the least recently updated
+        sets are evicted first.
+    memory_used -- the bytes used by the buffers of incomplete sets
+    evicted_count -- the number of incomplete sets that were evicted
+    dropped_count -- the number of chunks that were invalid or didn't
+        fit in the budget
+    '''
+    def __init__(self, timeout=SPLIT_TIMEOUT,
+                 memory_budget=SPLIT_MEMORY_BUDGET):
+        self.timeout = timeout
+        self.memory_budget = memory_budget
+        self.memory_used = 0
+        self.evicted_count = 0
+        self.dropped_count = 0
+        self._sets = OrderedDict()  # least recently updated first
+
+    def __len__(self):
+        return len(self._sets)
+
+    def _remove(self, key):
+        split_set = self._sets.pop(key)
+        if split_set.buffer is not None:
+            self.memory_used -= len(split_set.buffer)
+        elif split_set.pending_last is not None:
+            self.memory_used -= len(split_set.pending_last)
+
+    def _reserve(self, size, key):
+        '''
+        Evict the least recently updated sets (other than key) until
+        size more bytes fit in the budget.
+        '''
+        if size > self.memory_budget:
+            return False
+        while self.memory_used + size > self.memory_budget:
+            for old_key in self._sets:
+                if old_key != key:
+                    break
+            else:
+                return False
+            self._remove(old_key)
+            self.evicted_count += 1
+        self.memory_used += size
+        return True
+
+    def _drop(self, key):
+        self.dropped_count += 1
+        if key in self._sets:
+            self._remove(key)
+        return None
+
+    def add(self, key, chunk_count, chunk_num, data, now):
+        '''
+        Add a chunk of a split payload.
+
+        Sequential arguments:
+        key -- anything that identifies the split payload, such as a
+            (peer_id, channel, seqnum) tuple
+        chunk_count -- the number of chunks in the split payload
+        chunk_num -- the index of this chunk
+        data -- the chunk (any buffer; it is copied)
+        now -- the current time in seconds
+
+        Returns:
+        a memoryview of the whole payload if this was the last missing
+        chunk, otherwise None.
+        '''
+        if not (0 <= chunk_num < chunk_count <= CHUNK_COUNT_MAX):
+            return self._drop(key)
+        split_set = self._sets.get(key)
+        if split_set is None:
+            if chunk_count == 1:
+                return memoryview(bytes(data))
+            split_set = _SplitSet(chunk_count, now)
+            self._sets[key] = split_set
+        elif split_set.chunk_count != chunk_count:
+            return self._drop(key)
+        else:
+            self._sets.move_to_end(key)
+            split_set.updated = now
+        if split_set.received[chunk_num]:
+            return None  # a duplicate
+        is_last = (chunk_num == chunk_count - 1)
+        if is_last:
+            split_set.last_size = len(data)
+        if split_set.buffer is None:
+            if is_last:
+                # The offsets aren't known until the chunk size is, so
+                #   keep it until a chunk that isn't the last arrives.
+                if not self._reserve(len(data), key):
+                    return self._drop(key)
+                split_set.pending_last = bytes(data)
+                split_set.received[chunk_num] = 1
+                split_set.received_count += 1
+                return None
+            chunk_size = len(data)
+            if (chunk_size < 1) or (split_set.pending_last is not None
+                                    and len(split_set.pending_last)
+                                    > chunk_size):
+                return self._drop(key)
+            size = chunk_count * chunk_size
+            if split_set.pending_last is not None:
+                self.memory_used -= len(split_set.pending_last)
+            if not self._reserve(size, key):
+                split_set.pending_last = None
+                return self._drop(key)
+            split_set.chunk_size = chunk_size
+            split_set.buffer = bytearray(size)
+            if split_set.pending_last is not None:
+                start = (chunk_count - 1) * chunk_size
+                split_set.buffer[start:start+split_set.last_size] = \
+                    split_set.pending_last
+                split_set.pending_last = None
+        elif is_last:
+            if len(data) > split_set.chunk_size:
+                return self._drop(key)
+        elif len(data) != split_set.chunk_size:
+            return self._drop(key)
+        start = chunk_num * split_set.chunk_size
+        split_set.buffer[start:start+len(data)] = data
+        split_set.received[chunk_num] = 1
+        split_set.received_count += 1
+        if split_set.received_count < chunk_count:
+            return None
+        size = (chunk_count - 1) * split_set.chunk_size + split_set.last_size
+        self._remove(key)
+        return memoryview(split_set.buffer)[:size]
+
+    def expire(self, now):
+        '''
+        Evict incomplete sets that haven't received a chunk for longer
+        than the timeout.
+
+        Returns:
+        the number of sets evicted.
+        '''
+        count = 0
+        sets = self._sets
+        while sets:
+            key, split_set = next(iter(sets.items()))
+            if now - split_set.updated <= self.timeout:
+                break
+            self._remove(key)
+            count += 1
+        self.evicted_count += count
+        return count
+
+    def next_deadline(self):
+        '''
+        Get the time when expire should be called next (None if there
+        are no incomplete sets).
+        '''
+        for split_set in self._sets.values():
+            return split_set.updated + self.timeout
+        return None
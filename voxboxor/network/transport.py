@@ -0,0 +1,533 @@
+#!/usr/bin/env python3
+'''
+asyncio UDP transport for the Minetest low-level protocol.
+
+The server and client are asyncio.DatagramProtocol objects, so one
+event loop can serve many peers (one socket for the server, no thread
+per peer). The connection handshake works like this:
+- The client sends c_connect until the server responds.
+- The server assigns a peer ID and responds with s_connected
+  (CONTROLTYPE_SET_PEER_ID).
+- The client sends c_disconnect and the server forgets the peer.
+
+After the handshake, payloads can be sent reliably on any channel (See
+voxboxor.network.reliable). Outbound datagrams go through a
+SendScheduler (See voxboxor.network.scheduler), which flushes
+everything that became ready during one event loop iteration together.
+Since c_connect and s_connected used SEQNUM_INITIAL, the reliable
+channels start at the seqnum after it.
+'''
+import asyncio
+import socket
+
+from voxboxor.log import (
+    get_log,
+)
+
+from voxboxor.network.connection import (
+    PEER_ID_INEXISTENT,
+    PEER_ID_SERVER,
+    SEQNUM_INITIAL,
+    get_packet_bytes,
+    classify_packet,
+)
+
+from voxboxor.network.reliable import (
+    ReliableConnection,
+    datagram_purpose,
+    seqnum_add,
+)
+
+from voxboxor.network.metrics import (
+    metrics,
+)
+
+from voxboxor.network.peers import (
+    PeerTable,
+)
+
+from voxboxor.network.scheduler import (
+    SendScheduler,
+)
+
+from voxboxor.network.split import (
+    SplitReassembler,
+)
+
+_log = get_log("network")
+
+CONNECT_RESEND_INTERVAL = 0.5  # seconds
+CONNECT_TIMEOUT = 5.0  # seconds
+SERVER_RCVBUF = 4 * 1024 * 1024  # bytes (the OS may cap it lower)
+REAP_INTERVAL = 1.0  # seconds between checks for idle peers
+
+# c_connect and c_reliable (or s_reliable) have the same layout, so
+#   classify_packet may return the codec of any of these purposes for
+#   a reliable original packet (See connection.py).
+_RELIABLE_PURPOSES = ("connect", "reliable", "split")
+
+
+def _count_datagram(packets_counter, bytes_counter, data, codec, packet):
+    purpose = codec.purpose
+    if purpose == "connect":
+        # See _RELIABLE_PURPOSES.
+        if packet.sender_peer_id != PEER_ID_INEXISTENT:
+            purpose = "reliable"
+    packets_counter.inc(label_value=purpose)
+    bytes_counter.inc(len(data))
+
+
+class _ReliableProtocol(asyncio.DatagramProtocol):
+    '''
+    Send the datagrams of ReliableConnection objects through a
+    SendScheduler and run its timer.
+
+    Attributes:
+    scheduler -- the SendScheduler (its keys are peer IDs for the server
+        and None for the client)
+    '''
+    def __init__(self, scheduler=None):
+        self.transport = None
+        if scheduler is None:
+            scheduler = SendScheduler()
+        self.scheduler = scheduler
+        self._flush_timer = None
+        self._flush_time = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def _wake(self, key):
+        '''
+        Flush the peer soon. Everything woken during one event loop
+        iteration is flushed together.
+        '''
+        self.scheduler.wake(key)
+        self._schedule_flush(0.0)
+
+    def _schedule_flush(self, when):
+        loop = asyncio.get_running_loop()
+        if self._flush_timer is not None:
+            if self._flush_time <= when:
+                return
+            self._flush_timer.cancel()
+        self._flush_time = when
+        if when <= loop.time():
+            self._flush_timer = loop.call_soon(self._flush)
+        else:
+            self._flush_timer = loop.call_at(when, self._flush)
+
+    def _flush(self):
+        self._flush_timer = None
+        self._flush_time = None
+        if self.transport is None or self.transport.is_closing():
+            return
+        loop = asyncio.get_running_loop()
+        sendto = self.transport.sendto
+        if metrics.enabled:
+            sendto = self._send_counted
+        deadline = self.scheduler.flush(loop.time(), sendto)
+        if deadline is not None:
+            self._schedule_flush(deadline)
+
+    def _send_counted(self, data, address):
+        '''
+        Send and count a datagram from ReliableConnection.datagrams.
+        '''
+        self.transport.sendto(data, address)
+        metrics.packets_out.inc(label_value=datagram_purpose(data))
+        metrics.bytes_out.inc(len(data))
+
+    def _sendto(self, data, purpose, address=None):
+        '''
+        Send a datagram that isn't from a ReliableConnection.
+
+        Sequential arguments:
+        data -- the datagram
+        purpose -- the purpose of its codec (to count it if metrics are
+            enabled)
+        '''
+        self.transport.sendto(data, address)
+        if metrics.enabled:
+            metrics.packets_out.inc(label_value=purpose)
+            metrics.bytes_out.inc(len(data))
+
+    def connection_lost(self, exc):
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+            self._flush_time = None
+
+
+class ServerProtocol(_ReliableProtocol):
+    '''
+    Accept connections from Minetest low-level protocol clients.
+
+    Attributes:
+    peer_table -- the PeerTable that assigns peer IDs. The data of each
+        Peer is the ReliableConnection for the peer.
+    peers -- a dict where each key is a peer ID and each value is the
+        Peer (the same dict as peer_table.peers).
+    peer_ids -- a dict where each key is an address and each value is a
+        peer ID (the same dict as peer_table.peer_ids).
+    reassembler -- the SplitReassembler shared by all peers, so split
+        payloads from all peers share one memory budget.
+    '''
+    def __init__(self, rcvbuf=SERVER_RCVBUF, peer_table=None,
+                 reap_interval=REAP_INTERVAL, scheduler=None):
+        '''
+        Keyword arguments:
+        rcvbuf -- the socket receive buffer size, so that a burst of
+            packets from many peers isn't dropped by the OS before the
+            event loop reads it (None to keep the OS default).
+        peer_table -- a PeerTable (None to create one with the default
+            timeout).
+        reap_interval -- seconds between checks for idle peers (None to
+            never remove idle peers).
+        scheduler -- a SendScheduler (None to create one with the
+            default limits).
+        '''
+        _ReliableProtocol.__init__(self, scheduler=scheduler)
+        self.rcvbuf = rcvbuf
+        self.reap_interval = reap_interval
+        if peer_table is None:
+            peer_table = PeerTable()
+        self.peer_table = peer_table
+        self.peers = peer_table.peers
+        self.peer_ids = peer_table.peer_ids
+        self.reassembler = SplitReassembler()
+        self._reap_timer = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        sock = transport.get_extra_info('socket')
+        if (self.rcvbuf is not None) and (sock is not None):
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,
+                                self.rcvbuf)
+            except OSError as ex:
+                _log.info("The receive buffer size couldn't be set: {}",
+                          ex)
+        if self.reap_interval is not None:
+            self._reap_timer = asyncio.get_running_loop().call_later(
+                self.reap_interval, self._reap,
+            )
+
+    def connection_lost(self, exc):
+        if self._reap_timer is not None:
+            self._reap_timer.cancel()
+            self._reap_timer = None
+        _ReliableProtocol.connection_lost(self, exc)
+
+    def _reap(self):
+        loop = asyncio.get_running_loop()
+        for peer in self.peer_table.reap(loop.time()):
+            self.scheduler.remove(peer.peer_id)
+            self.on_timeout(peer)
+        self._reap_timer = loop.call_later(self.reap_interval, self._reap)
+
+    def add_peer(self, address):
+        '''
+        Get the peer ID of the address, assigning a new one if the
+        address isn't connected yet.
+
+        Returns:
+        the peer ID, or None if there are no free peer IDs.
+        '''
+        peer_id = self.peer_ids.get(address)
+        if peer_id is not None:
+            return peer_id
+        now = asyncio.get_running_loop().time()
+        peer = self.peer_table.add(address, now)
+        if peer is None:
+            return None
+        peer.data = ReliableConnection(
+            "server",
+            PEER_ID_SERVER,
+            seqnum=seqnum_add(SEQNUM_INITIAL, 1),
+            reassembler=self.reassembler,
+            peer=peer.peer_id,
+        )
+        self.scheduler.add(peer.peer_id, peer.data, address, now=now)
+        return peer.peer_id
+
+    def remove_peer(self, peer_id):
+        self.peer_table.remove(peer_id)
+        self.scheduler.remove(peer_id)
+
+    def datagram_received(self, data, addr):
+        try:
+            codec = classify_packet(data)
+            packet = codec.unpack_from(data)
+        except ValueError as ex:
+            if metrics.enabled:
+                metrics.decode_errors.inc()
+            _log.info("Dropped a packet from {}: {}", addr, ex)
+            return
+        if metrics.enabled:
+            _count_datagram(metrics.packets_in, metrics.bytes_in, data,
+                            codec, packet)
+        purpose = codec.purpose
+        if purpose in _RELIABLE_PURPOSES:
+            if packet.sender_peer_id == PEER_ID_INEXISTENT:
+                self.on_connect(addr)
+            else:
+                self._on_reliable(packet, addr)
+        elif purpose == "ack":
+            self._on_reliable(packet, addr)
+        elif purpose == "disconnect":
+            if self.peer_ids.get(addr) != packet.sender_peer_id:
+                _log.info("Dropped a disconnect packet from {} with the"
+                          " wrong sender_peer_id {}",
+                          addr, packet.sender_peer_id)
+                return
+            self.on_disconnect(packet.sender_peer_id)
+        else:
+            self.on_packet(codec, packet, addr)
+
+    def _on_reliable(self, packet, address):
+        peer_id = packet.sender_peer_id
+        peer = self.peers.get(peer_id)
+        if (peer is None) or (peer.address != address):
+            _log.info("Dropped a packet from {} with the wrong"
+                      " sender_peer_id {}", address, peer_id)
+            return
+        connection = peer.data
+        now = asyncio.get_running_loop().time()
+        peer.last_seen = now
+        self.reassembler.expire(now)
+        for channel, payload in connection.receive(packet, now):
+            self.on_payload(peer_id, channel, payload)
+        self._wake(peer_id)
+
+    def on_connect(self, address):
+        '''
+        Respond to c_connect. This is also called if the client resends
+        c_connect, in which case the same peer ID is sent again.
+        '''
+        peer_id = self.add_peer(address)
+        if peer_id is None:
+            _log.warning("There are no free peer IDs for {}", address)
+            return
+        self._sendto(
+            get_packet_bytes("server", "connected",
+                             {'peer_id_new': peer_id}),
+            "connected",
+            address,
+        )
+
+    def on_disconnect(self, peer_id):
+        '''
+        Respond to c_disconnect.
+        '''
+        self.remove_peer(peer_id)
+
+    def on_timeout(self, peer):
+        '''
+        Handle a peer that was removed since nothing arrived from it
+        for peer_table.timeout seconds (override this in a subclass).
+        '''
+        _log.info("Peer {} at {} timed out", peer.peer_id, peer.address)
+
+    def on_payload(self, peer_id, channel, payload):
+        '''
+        Handle a payload that was sent reliably by the peer (override
+        this in a subclass). The payload is only valid during the call.
+        '''
+        _log.debug("Ignored {} byte(s) from peer {} on channel {}",
+                   len(payload), peer_id, channel)
+
+    def on_packet(self, codec, packet, address):
+        '''
+        Handle any other packet (override this in a subclass).
+        '''
+        _log.debug("Ignored a {} {} packet from {}",
+                   codec.origin, codec.purpose, address)
+
+    def send_reliable(self, peer_id, channel, payload):
+        '''
+        Send the payload (bytes) to the peer reliably on the channel.
+
+        Returns:
+        True if it was queued, or False if it was dropped since too
+        much is already queued on the channel (See SendScheduler).
+        '''
+        queued = self.scheduler.send(peer_id, channel, payload)
+        if queued:
+            self._schedule_flush(0.0)
+        return queued
+
+    def error_received(self, exc):
+        _log.info("The server socket had an error: {}", exc)
+
+
+class ClientProtocol(_ReliableProtocol):
+    '''
+    Connect to a Minetest low-level protocol server.
+
+    Attributes:
+    peer_id -- the peer ID assigned by the server (PEER_ID_INEXISTENT
+        until connected).
+    connection -- the ReliableConnection to the server (None until
+        connected).
+    '''
+    def __init__(self, scheduler=None):
+        _ReliableProtocol.__init__(self, scheduler=scheduler)
+        self.peer_id = PEER_ID_INEXISTENT
+        self.connection = None
+        self._connected = None
+
+    def datagram_received(self, data, addr):
+        try:
+            codec = classify_packet(data)
+            packet = codec.unpack_from(data)
+        except ValueError as ex:
+            if metrics.enabled:
+                metrics.decode_errors.inc()
+            _log.info("Dropped a packet from {}: {}", addr, ex)
+            return
+        if metrics.enabled:
+            _count_datagram(metrics.packets_in, metrics.bytes_in, data,
+                            codec, packet)
+        purpose = codec.purpose
+        if purpose == "connected":
+            if self.connection is None:
+                self.peer_id = packet.peer_id_new
+                self.connection = ReliableConnection(
+                    "client",
+                    self.peer_id,
+                    seqnum=seqnum_add(SEQNUM_INITIAL, 1),
+                )
+                self.scheduler.add(None, self.connection,
+                                   now=asyncio.get_running_loop().time())
+            if (self._connected is not None
+                    and not self._connected.done()):
+                self._connected.set_result(self.peer_id)
+        elif (purpose in _RELIABLE_PURPOSES) or (purpose == "ack"):
+            if self.connection is None:
+                _log.info("Dropped a reliable packet before connecting.")
+                return
+            now = asyncio.get_running_loop().time()
+            self.connection.reassembler.expire(now)
+            for channel, payload in self.connection.receive(packet, now):
+                self.on_payload(channel, payload)
+            self._wake(None)
+        else:
+            self.on_packet(codec, packet)
+
+    def on_payload(self, channel, payload):
+        '''
+        Handle a payload that was sent reliably by the server (override
+        this in a subclass). The payload is only valid during the call.
+        '''
+        _log.debug("Ignored {} byte(s) on channel {}",
+                   len(payload), channel)
+
+    def on_packet(self, codec, packet):
+        '''
+        Handle any other packet (override this in a subclass).
+        '''
+        _log.debug("Ignored a {} {} packet", codec.origin, codec.purpose)
+
+    def send_reliable(self, channel, payload):
+        '''
+        Send the payload (bytes) to the server reliably on the channel.
+
+        Returns:
+        True if it was queued, or False if it was dropped (See
+        ServerProtocol.send_reliable).
+        '''
+        if self.connection is None:
+            raise RuntimeError("The client isn't connected.")
+        queued = self.scheduler.send(None, channel, payload)
+        if queued:
+            self._schedule_flush(0.0)
+        return queued
+
+    def error_received(self, exc):
+        # Such as ConnectionRefusedError if the server isn't running
+        #   (yet), so keep trying until connect times out.
+        _log.info("The client socket had an error: {}", exc)
+
+    async def connect(self, timeout=CONNECT_TIMEOUT,
+                      resend_interval=CONNECT_RESEND_INTERVAL):
+        '''
+        Send c_connect (again every resend_interval seconds) until the
+        server sends s_connected.
+
+        Returns:
+        the peer ID assigned by the server.
+
+        Raises:
+        asyncio.TimeoutError if the server doesn't respond in time.
+        '''
+        loop = asyncio.get_running_loop()
+        self._connected = loop.create_future()
+        connect_bytes = get_packet_bytes("client", "connect", {})
+        deadline = loop.time() + timeout
+        while True:
+            self._sendto(connect_bytes, "connect")
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                raise asyncio.TimeoutError(
+                    "The server didn't respond to c_connect."
+                )
+            try:
+                return await asyncio.wait_for(
+                    asyncio.shield(self._connected),
+                    min(resend_interval, remaining),
+                )
+            except asyncio.TimeoutError:
+                pass
+
+    def disconnect(self):
+        '''
+        Send c_disconnect and close the transport.
+        '''
+        if self.peer_id != PEER_ID_INEXISTENT:
+            self._sendto(
+                get_packet_bytes("client", "disconnect",
+                                 {'sender_peer_id': self.peer_id}),
+                "disconnect",
+            )
+            self.peer_id = PEER_ID_INEXISTENT
+            self.connection = None
+        self.scheduler.remove(None)
+        self.transport.close()
+
+
+async def create_server(host, port, protocol_factory=ServerProtocol):
+    '''
+    Start a server listening on the UDP address (host, port).
+
+    Returns:
+    a tuple of transport, protocol (See
+    asyncio.loop.create_datagram_endpoint).
+    '''
+    loop = asyncio.get_running_loop()
+    return await loop.create_datagram_endpoint(
+        protocol_factory,
+        local_addr=(host, port),
+    )
+
+
+async def open_connection(host, port, protocol_factory=ClientProtocol,
+                          timeout=CONNECT_TIMEOUT):
+    '''
+    Connect to the server at the UDP address (host, port) and wait for
+    the handshake to finish.
+
+    Returns:
+    a tuple of transport, protocol where protocol.peer_id is set.
+    '''
+    loop = asyncio.get_running_loop()
+    transport, protocol = await loop.create_datagram_endpoint(
+        protocol_factory,
+        remote_addr=(host, port),
+    )
+    try:
+        await protocol.connect(timeout=timeout)
+    except BaseException:
+        transport.close()
+        raise
+    return transport, protocol
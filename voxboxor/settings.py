@@ -28,6 +28,19 @@ C++ to Python changes:
 (this list isn't comprehensive)
 - The SettingEntries type is replaced with a dict of SettingsEntry
   objects.
+- Instead of walking the parent layers on each get, each Settings
+  object in a hierarchy keeps a merged view (a dict of every entry it
+  can see, including those of lower layers) that is updated when any
+  of those layers changes (See SettingsHierarchy._onLayerChanged).
+- The instance method getLayer is renamed getSettingsLayer, since
+  Python can't overload it with the static getLayer(sl).
+- The C++ out-parameters of parseConfigObject and getMultiline are
+  return values.
+- Changed callbacks get a set of names, so that changing many settings
+  at once calls each callback once (See registerChangedCallback).
+- getFlagStr has no flagmask out-parameter, and the getNoiseParams
+  methods take an optional NoiseParams to change and return it (or
+  None instead of False).
 '''
 
 # Old C++ imports (delete each from comment whenever replaced by Python)
@@ -36,23 +49,93 @@ C++ to Python changes:
 #include "util/string.h"
 #include "util/basic_macros.h"
 
-struct NoiseParams;
-
 // Global objects
 extern Settings *g_settings; // Same as Settings::getLayer(SL_GLOBAL);
 extern std::string g_settings_path;
 
 '''
 
+import io
+import os
+import re
+import tempfile
+import threading
+
 from enum import Enum
 
+from voxboxor.log import (
+    get_log,
+)
+
+_log = get_log("settings")
+
 U32_MAX = 0xFFFFFFFF
 
+# noise.h
+NOISE_FLAG_DEFAULTS = 0x01
+NOISE_FLAG_EASED = 0x02
+NOISE_FLAG_ABSVALUE = 0x04
+NOISE_FLAG_POINTBUFFER = 0x08
+NOISE_FLAG_SIMPLEX = 0x10
+
+FLAG_STRING_CACHE_SIZE = 256  # compiled flag strings kept per FlagDesc
+
+_invalid_name_re = re.compile(r'[="{}#\s]')
+_int_prefix_re = re.compile(r'\s*[+-]?\d+')
+_MISSING = object()
+
 # Regarding converting from symbolic (string-represented) values to
 # real (Python-typed) values: See also mtanalyze/minebest
 #   in https://github.com/poikilos/mtanalyze (name_types,
 #   get_conf_value, symbol_to_value, symbol_to_tuple).
 
+
+def atoi(value):
+    '''
+    Convert the leading integer in the string to an int, or 0 if it
+    doesn't start with one (like C atoi, so "12abc" is 12).
+    '''
+    match = _int_prefix_re.match(value)
+    if match is None:
+        return 0
+    return int(match.group())
+
+
+def is_yes(value):
+    '''
+    Check if the string means true (like is_yes in Minetest's
+    util/string.h: "y", "yes", "true" or a nonzero number).
+    '''
+    value = value.strip().lower()
+    return value in ("y", "yes", "true") or (atoi(value) != 0)
+
+
+def parse_floats(value, count):
+    '''
+    Convert a vector string such as "(1, 2.5, 3)" to a tuple of floats
+    (the parentheses are optional).
+
+    Sequential arguments:
+    value -- the string
+    count -- the number of floats it must contain
+    '''
+    start = value.find("(") + 1  # 0 if there is no "("
+    end = value.find(")", start)
+    if end < 0:
+        end = len(value)
+    parts = value[start:end].split(",")
+    if len(parts) != count:
+        raise ValueError("Expected {} comma-separated numbers but got {}"
+                         "".format(count, repr(value)))
+    return tuple(float(part) for part in parts)
+
+
+class SettingNotFoundException(KeyError):
+    '''
+    The setting isn't in the Settings object nor in any lower layer.
+    '''
+
+
 class ValueType(Enum):
     VALUETYPE_STRING = 0
     VALUETYPE_FLAG = 1  # Doesn't take any arguments
@@ -70,14 +153,21 @@ class SettingsParseEvent(Enum):
 
 class SettingsLayer(Enum):
     '''
-    Describe global setting layers.
+    Describe global setting layers. A setting missing from a layer is
+    looked up in the next lower layer that exists.
 
+    SL_DEFAULTS -- the lowest layer (the built-in defaults)
+    SL_GAME -- defaults set by the game (overrides SL_DEFAULTS)
     SL_GLOBAL -- where settings are stored
+    SL_COMMANDLINE -- options from the command line, which override
+                      SL_GLOBAL but aren't saved with it (See
+                      parseCommandLine)
     '''
     SL_DEFAULTS = 0
     SL_GAME = 1
     SL_GLOBAL = 2
-    SL_TOTAL_COUNT = 3
+    SL_COMMANDLINE = 3
+    SL_TOTAL_COUNT = 4
 
 
 class SettingsHierarchy:
@@ -85,10 +175,20 @@ class SettingsHierarchy:
     This class is friends with Settings.
 
     Private members:
-    _layers -- a list of Settings references
+    _layers -- a list of Settings references (None for each layer that
+               doesn't exist)
+    _mutex -- a threading.RLock that is the _m_mutex of every layer
+              (changing one layer changes the merged views of those
+              above it)
     '''
     def __init__(self, fallback=None):
-        self._layers = None
+        '''
+        Keyword arguments:
+        fallback -- a Settings object to use as layer 0
+        '''
+        self._layers = [None] * SettingsLayer.SL_TOTAL_COUNT.value
+        self._layers[0] = fallback
+        self._mutex = threading.RLock()
 
     def __copy__(self):
         raise RuntimeError("Copying this object is not a proper usage.")
@@ -98,16 +198,55 @@ class SettingsHierarchy:
         raise RuntimeError("Copying this object is not a proper usage.")
         # return None
 
+    def getLayer(self, layer):
+        '''
+        Get the Settings object of a layer number (or None if the layer
+        doesn't exist).
+        '''
+        if (layer < 0) or (layer >= len(self._layers)):
+            raise ValueError("Invalid settings layer {}".format(layer))
+        return self._layers[layer]
+
     def _getParent(self, layer):
         '''
         Get the parent Settings object using a layer number.
         '''
+        for index in range(layer - 1, -1, -1):
+            parent = self._layers[index]
+            if parent is not None:
+                return parent
+        return None
+
+    def _onLayerCreated(self, layer, _settings):
+        if layer < 0:
+            raise ValueError("Invalid settings layer {}".format(layer))
+        with self._mutex:
+            if len(self._layers) < layer + 1:
+                self._layers.extend([None]
+                                    * (layer + 1 - len(self._layers)))
+            if self._layers[layer] is not None:
+                raise ValueError("Setting layer {} already exists"
+                                 "".format(layer))
+            self._layers[layer] = _settings
+            self._onLayerChanged(layer)
+
+    def _onLayerRemoved(self, layer):
+        with self._mutex:
+            self._layers[layer] = None
+            self._onLayerChanged(layer)
+
+    def _onLayerChanged(self, layer, names=None):
+        '''
+        Update the merged view and typed value cache of each layer from
+        the given layer up after settings in the layer changed.
 
-    def _onLayerCreated(layer, _settings):
-        pass
-
-    def _onLayerRemoved(layer):
-        pass
+        Keyword arguments:
+        names -- the names that changed (or None to rebuild the merged
+                 views, such as after reading a whole file)
+        '''
+        for settings in self._layers[layer:]:
+            if settings is not None:
+                settings._updateMerged(names)
 
 
 class ValueSpec:
@@ -128,14 +267,17 @@ class ValueSpec:
 
 
 class SettingsEntry:
+    '''
+    A value or a group. An entry isn't changed after it is created (set
+    replaces it), so entries can be shared by several dicts.
+    '''
+    __slots__ = ('value', 'group', 'is_group')
+
     def __init__(self, value=None, group=None):
         '''
         group -- type: Settings
         '''
         if (value is not None) and (group is not None):
-            if not isinstance(group, str):
-                raise TypeError("group must be a string but"
-                                "is type {}".format(type(value)))
             raise ValueError("Only a value or group can be specified,"
                              " but group was {} and value was {}"
                              .format(group, value))
@@ -143,6 +285,7 @@ class SettingsEntry:
             if not isinstance(group, Settings):
                 raise TypeError("group must be a settings object but"
                                 "is type {}".format(type(group)))
+            self.value = ""
             self.group = group
             self.is_group = True
         elif value is not None:
@@ -155,43 +298,247 @@ class SettingsEntry:
             self.is_group = False
 
 
+class FlagDesc:
+    '''
+    Describe the flags that a flag string setting (such as
+    "caves,nodungeons") can contain (The C++ version is an array of
+    {name, flag} structs ending with {NULL, 0}).
+
+    Attributes:
+    flags -- a tuple of (name, flag) tuples in the order written
+    bits -- a dict of lowercase name to flag
+    '''
+    __slots__ = ('flags', 'bits', '_compiled')
+
+    def __init__(self, flags):
+        '''
+        Sequential arguments:
+        flags -- a sequence of (name, flag) pairs where each flag is an
+                 int with one bit set
+        '''
+        self.flags = tuple((name, flag) for name, flag in flags)
+        self.bits = {name.lower(): flag for name, flag in self.flags}
+        self._compiled = {}
+
+    def readFlagString(self, value):
+        '''
+        Convert a flag string to integers. Each comma-separated name
+        sets its flag, or clears it if prefixed by "no" (names are not
+        case-sensitive and unknown names are ignored).
+
+        Each string is only parsed the first time (up to
+        FLAG_STRING_CACHE_SIZE strings are kept).
+
+        Returns:
+        a (flags, flagmask) tuple where flagmask has a bit set for each
+        flag that the string sets or clears.
+        '''
+        result = self._compiled.get(value)
+        if result is not None:
+            return result
+        bits = self.bits
+        flags = 0
+        flagmask = 0
+        for name in value.lower().split(","):
+            name = name.strip()
+            flag = bits.get(name)
+            if flag is not None:
+                flags |= flag
+            elif name.startswith("no"):
+                flag = bits.get(name[2:])
+            if flag is not None:
+                flagmask |= flag
+        result = (flags, flagmask)
+        if len(self._compiled) >= FLAG_STRING_CACHE_SIZE:
+            self._compiled = {}
+        self._compiled[value] = result
+        return result
+
+    def writeFlagString(self, flags, flagmask=U32_MAX):
+        '''
+        Convert integer flags to a flag string (only including the
+        flags in flagmask).
+        '''
+        return ", ".join(
+            name if (flags & flag) else "no" + name
+            for name, flag in self.flags if flagmask & flag
+        )
+
+
+flagdesc_noiseparams = FlagDesc((
+    ("defaults", NOISE_FLAG_DEFAULTS),
+    ("eased", NOISE_FLAG_EASED),
+    ("absvalue", NOISE_FLAG_ABSVALUE),
+    ("pointbuffer", NOISE_FLAG_POINTBUFFER),
+    ("simplex", NOISE_FLAG_SIMPLEX),
+))
+
+
+class NoiseParams:
+    '''
+    Parameters of a noise (such as for map generation) as in Minetest's
+    noise.h.
+
+    Attributes:
+    spread -- a tuple of 3 floats
+    persist -- the persistence (stored as "persistence" in a group)
+    flags -- an int using the NOISE_FLAG_* bits
+    '''
+    __slots__ = ('offset', 'scale', 'spread', 'seed', 'octaves',
+                 'persist', 'lacunarity', 'flags')
+
+    def __init__(self, offset=0.0, scale=1.0, spread=(250.0, 250.0, 250.0),
+                 seed=12345, octaves=3, persist=0.6, lacunarity=2.0,
+                 flags=NOISE_FLAG_DEFAULTS):
+        self.offset = offset
+        self.scale = scale
+        self.spread = tuple(spread)
+        self.seed = seed
+        self.octaves = octaves
+        self.persist = persist
+        self.lacunarity = lacunarity
+        self.flags = flags
+
+    def __eq__(self, other):
+        if not isinstance(other, NoiseParams):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name)
+                   for name in NoiseParams.__slots__)
+
+    def __repr__(self):
+        return "NoiseParams({})".format(", ".join(
+            "{}={}".format(name, repr(getattr(self, name)))
+            for name in NoiseParams.__slots__
+        ))
+
+    def update(self, fields):
+        '''
+        Set attributes from a sequence of (name, value) pairs.
+        '''
+        for name, value in fields:
+            setattr(self, name, value)
+        return self
+
+
+def _parseNoiseParamsValue(value):
+    '''
+    Parse a noise parameters string in the format
+    "offset, scale, (x, y, z), seed, octaves, persistence[, lacunarity]"
+
+    Returns:
+    a tuple of (NoiseParams attribute, value) pairs
+    '''
+    before, sep, rest = value.partition("(")
+    spread, sep2, after = rest.partition(")")
+    head = before.split(",")  # offset, scale, ""
+    tail = after.split(",")  # "", seed, octaves, persistence[, lacunarity]
+    if ((not sep) or (not sep2) or (len(head) != 3) or head[2].strip()
+            or (len(tail) not in (4, 5)) or tail[0].strip()):
+        raise ValueError("Invalid noise parameters: {}".format(repr(value)))
+    fields = [
+        ('offset', float(head[0])),
+        ('scale', float(head[1])),
+        ('spread', parse_floats(spread, 3)),
+        ('seed', int(tail[1])),
+        ('octaves', int(tail[2])),
+        ('persist', float(tail[3])),
+    ]
+    if (len(tail) == 5) and tail[4].strip():
+        fields.append(('lacunarity', float(tail[4])))
+    return tuple(fields)
+
+
 SettingEntries = {}
 
 
 class Settings:
     '''
+    Settings can be read from any number of threads while another
+    changes them. Only changes take _m_mutex. A change of one setting
+    replaces a dict item (which is atomic), and a change of several
+    (such as by updateNoLock) builds new dicts then swaps them in, so a
+    reader sees all of it or none of it. A dict is never resized in
+    place after it is shared (entries are added or removed by copying
+    it), so readers can iterate over it without locking.
 
     Private members:
     _m_settings -- a SettingsEntries object
-    _m_callbacks -- a dict of SettingsCallbackList objects where
+    _m_merged -- a dict of every entry visible from this layer
+                 (including entries of lower layers), or the same dict
+                 as _m_settings if there is no lower layer
+    _m_typed -- a dict of name to a (token, dict of parse function to
+                typed value) tuple, so typed getters only parse the
+                string the first time (See _getCached)
+    _m_typed_hits -- the number of typed gets that used _m_typed
+    _m_typed_misses -- the number of typed gets that parsed the string
+    _m_dirty -- True if entries of this object changed since the last
+                updateConfigFile (entries of groups have their own)
+    _m_version -- a count of changes to the entries of this object
+                  (See _getToken)
+    _m_synced_file -- the path and _statSignature of the file that the
+                      last updateConfigFile wrote or found to be up to
+                      date, or None
+    _m_callbacks -- a dict of name to SettingsCallbackList where
                     SettingsCallbackList is merely a list of
                     (SettingsChangedCallback, reference to anything)
-                    tuples and SettingsChangedCallback is a (name,
-                    reference to data) tuple
+                    tuples and SettingsChangedCallback is a function
+                    that accepts (names, reference to data) (See
+                    registerChangedCallback)
     _m_end_tag -- a string
-    _m_callback_mutex -- C++ type: mutable std::mutex
-    _m_mutex -- C++ type: mutable std::mutex
+    _m_callback_mutex -- a threading.Lock for _m_callbacks
+    _m_callback_executor -- a concurrent.futures.Executor to run
+                            callbacks, or None to run them in the
+                            thread that changed the settings
+    _m_mutex -- a threading.RLock held while changing settings (the
+                same one for every layer of a SettingsHierarchy)
     _m_hierarchy -- a SettingsHierarchy object
     _m_settingslayer -- an int
-    _s_flags -- a dictionary of FlagDesc objects
+    _s_flags -- a dictionary of FlagDesc objects (static, as in C++,
+                See setDefault)
     '''
+    _s_flags = {}
+
     def __init__(self, end_tag="", h=None, settings_layer=None):
         '''
         end_tag -- type: str
-        settings_layer -- type: int
+        h -- type: SettingsHierarchy (the hierarchy to join)
+        settings_layer -- type: SettingsLayer or int (the layer in h)
 
         (This replaces both C++ overloads of the constructor).
         '''
         self._m_settings = None
+        self._m_merged = None
+        self._m_typed = None
+        self._m_typed_hits = 0
+        self._m_typed_misses = 0
+        self._m_dirty = False
+        self._m_version = 0
+        self._m_synced_file = None
         self._m_callbacks = None
         self._m_end_tag = None
         self._m_callback_mutex = None
+        self._m_callback_executor = None
+        self._m_mutex = None
         self._m_hierarchy = None
         self._m_settingslayer = -1
-        self._s_flags = {}
         # end C++ defaults
 
+        self._m_settings = {}
+        self._m_merged = self._m_settings
+        self._m_typed = {}
+        self._m_callbacks = {}
+        self._m_callback_mutex = threading.Lock()
+        self._m_mutex = threading.RLock()
         self._m_end_tag = end_tag
+        if isinstance(settings_layer, SettingsLayer):
+            settings_layer = settings_layer.value
+        if h is not None:
+            if settings_layer is None:
+                raise ValueError("A settings_layer is required with h.")
+            self._m_mutex = h._mutex
+            self._m_hierarchy = h
+            self._m_settingslayer = settings_layer
+            h._onLayerCreated(settings_layer, self)
 
     def __add__(self, o1, o2):
         pass
@@ -199,37 +546,220 @@ class Settings:
     @staticmethod
     def createLayer(sl, end_tag=""):
         '''
+        Create the Settings object of a global layer.
+
         sl -- type: SettingsLayer
         end_tag -- type: str
         '''
+        if (not isinstance(sl, SettingsLayer)
+                or (sl is SettingsLayer.SL_TOTAL_COUNT)):
+            raise ValueError("Invalid settings layer {}".format(sl))
+        return Settings(end_tag, g_hierarchy, sl)
 
     @staticmethod
     def getLayer(sl):
         '''
+        Get the Settings object of a global layer (or None if it
+        wasn't created).
+
         sl -- type: SettingsLayer
         '''
+        return g_hierarchy.getLayer(sl.value)
 
     def readConfigFile(self, filename):
-        pass
+        '''
+        Read settings from a file.
+
+        Returns:
+        False if the file can't be opened or a group is missing its end,
+        otherwise True.
+        '''
+        try:
+            ins = open(filename, 'r', encoding='utf-8')
+        except OSError:
+            return False
+        with ins:
+            return self.parseConfigLines(ins)
 
     def updateConfigFile(self, filename):
-        pass
+        '''
+        Write the settings to a file, keeping the comments, order and
+        formatting of the lines in the file except for settings that
+        changed. Settings not in the file are appended and settings no
+        longer in this object are removed.
+
+        The new file is written to a temporary file in one pass over
+        the old one then renamed over it, so readers never see a
+        partial file. If nothing differs, the file isn't replaced, and
+        if nothing changed since the last call wrote (or checked) the
+        same file, the file isn't even read.
+
+        Returns:
+        False if the file couldn't be written, otherwise True.
+        '''
+        with self._m_mutex:
+            return self._updateConfigFile(filename)
+
+    def _updateConfigFile(self, filename):
+        path = os.path.abspath(filename)
+        if (self._m_synced_file == (path, _statSignature(path))
+                and not self._isDirty()):
+            return True
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path),
+                                            suffix=".tmp")
+        except OSError as ex:
+            _log.error('Error writing configuration file: "{}": {}',
+                       filename, ex)
+            return False
+        try:
+            mode = None
+            try:
+                ins = open(path, 'r', encoding='utf-8')
+                mode = os.fstat(ins.fileno()).st_mode
+            except FileNotFoundError:
+                ins = io.StringIO()
+            with ins, os.fdopen(fd, 'w', encoding='utf-8') as outs:
+                was_modified = self._updateConfigObject(ins, outs)
+            if was_modified:
+                if mode is not None:
+                    os.chmod(tmp_path, mode)
+                os.replace(tmp_path, path)
+            else:
+                os.unlink(tmp_path)
+        except OSError as ex:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            _log.error('Error writing configuration file: "{}": {}',
+                       filename, ex)
+            return False
+        self._clearDirty()
+        self._m_synced_file = (path, _statSignature(path))
+        return True
 
     def parseCommandLine(self, argv, allowed_options):
         '''
+        Read settings from command line arguments.
+
+        Each "--name" must be in allowed_options. A VALUETYPE_FLAG
+        option is set to "true" and any other option is set to the next
+        argument. Other arguments (not starting with "-") are set as
+        "nonopt0", "nonopt1" and so on.
+
+        The settings are only set if every argument is valid, and are
+        then set all at once (See parseConfigLines).
+
+        Sequential arguments:
+        argv -- the arguments (like sys.argv, argv[0] is skipped)
         allowed_options -- dictionary of ValueSpec
-        '''
+
+        Returns:
+        False if an argument isn't valid (after showing an error),
+        otherwise True.
+        '''
+        settings = {}
+        nonopt_index = 0
+        FLAG = ValueType.VALUETYPE_FLAG
+        arg_i = 1
+        arg_count = len(argv)
+        while arg_i < arg_count:
+            arg = argv[arg_i]
+            arg_i += 1
+            if not arg.startswith("--"):
+                # If option doesn't start with -, read it in as nonoptX
+                if not arg.startswith("-"):
+                    if not self._checkValueValid(arg):
+                        return False
+                    name = "nonopt{}".format(nonopt_index)
+                    settings[name] = SettingsEntry(arg)
+                    nonopt_index += 1
+                    continue
+                _log.error('Invalid command-line parameter "{}":'
+                           ' --<option> expected.', arg)
+                return False
+            name = arg[2:]
+            spec = allowed_options.get(name)
+            if spec is None:
+                _log.error('Unknown command-line parameter "{}"', arg)
+                return False
+            if spec._type is FLAG:
+                value = "true"
+            elif arg_i < arg_count:
+                value = argv[arg_i]
+                arg_i += 1
+            else:
+                _log.error('Invalid command-line parameter "{}": missing'
+                           ' value', name)
+                return False
+            if not (self._checkNameValid(name)
+                    and self._checkValueValid(value)):
+                return False
+            settings[name] = SettingsEntry(value)
+        with self._m_mutex:
+            merged = self._m_settings.copy()
+            merged.update(settings)
+            self._m_settings = merged
+            self._onChanged(tuple(settings))
+        self.doCallbacks(settings)
+        return True
 
     def parseConfigLines(self, ins):
         '''
+        Read settings from lines. The lines are consumed one at a time
+        until the end tag (or the end of ins), so a file can be passed
+        without reading it into memory first.
+
         ins -- input stream (iterator)
-        '''
+
+        Returns:
+        False if the end tag of this object or of a group wasn't found,
+        otherwise True.
+        '''
+        ins = iter(ins)
+        # Collect the entries then add them all at once so callbacks
+        #   run once for the whole file (See doCallbacks).
+        settings = {}
+        parse = self._parseConfigObject
+        SPE_KVPAIR = SettingsParseEvent.SPE_KVPAIR
+        SPE_END = SettingsParseEvent.SPE_END
+        SPE_GROUP = SettingsParseEvent.SPE_GROUP
+        SPE_MULTILINE = SettingsParseEvent.SPE_MULTILINE
+        ok = not self._m_end_tag
+        try:
+            for line in ins:
+                event, name, value = parse(line)
+                if event is SPE_KVPAIR:
+                    settings[name] = SettingsEntry(value)
+                elif event is SPE_END:
+                    ok = True
+                    break
+                elif event is SPE_GROUP:
+                    group = Settings("}")
+                    if not group.parseConfigLines(ins):
+                        ok = False
+                        break
+                    settings[name] = SettingsEntry(group=group)
+                elif event is SPE_MULTILINE:
+                    settings[name] = SettingsEntry(self._getMultiline(ins))
+        finally:
+            with self._m_mutex:
+                merged = self._m_settings.copy()
+                merged.update(settings)
+                self._m_settings = merged
+                self._onChanged(None)
+            self.doCallbacks(settings)
+        return ok
 
     def writeLines(self, outs, tab_depth=0):
         '''
         Write lines to the output stream outs.
         (This should not change the object).
         '''
+        for name, entry in self._m_settings.items():
+            self._printEntry(outs, name, entry, tab_depth)
+        # For groups this must be "}"
+        if self._m_end_tag:
+            outs.write("\t" * tab_depth + self._m_end_tag + "\n")
 
     def getGroup(self, name, noEx=False):
         '''
@@ -238,6 +768,16 @@ class Settings:
         Keyword arguments:
         noEx -- If True, don't raise exceptions.
         '''
+        entry = self._getEntry(name)
+        if (entry is None) or not entry.is_group:
+            if noEx:
+                return None
+            raise SettingNotFoundException(
+                "Setting [{}] {}".format(
+                    name, "not found." if entry is None else "isn't a group."
+                )
+            )
+        return entry.group
 
     def get(self, name, noEx=False):
         '''
@@ -246,6 +786,97 @@ class Settings:
         Keyword arguments:
         noEx -- If True, don't raise exceptions.
         '''
+        entry = self._getEntry(name)
+        if (entry is None) or entry.is_group:
+            if noEx:
+                return None
+            raise SettingNotFoundException(
+                "Setting [{}] {}".format(
+                    name, "not found." if entry is None else "is a group."
+                )
+            )
+        return entry.value
+
+    def _getTyped(self, name, parse, noEx):
+        '''
+        Get a named setting converted by parse (a function that takes
+        the string and raises ValueError if it isn't valid). The result
+        is cached until the setting changes in this layer or a lower
+        one, so parse must return an immutable value.
+        '''
+        entry = self._m_merged.get(name)
+        value = self._getCached(name, parse, entry)
+        if value is not _MISSING:
+            return value
+        if (entry is None) or entry.is_group:
+            return self.get(name, noEx=noEx)  # raise or return None
+        try:
+            value = parse(entry.value)
+        except ValueError:
+            if noEx:
+                return None
+            raise
+        self._setCached(name, parse, entry, value)
+        return value
+
+    def _getCached(self, name, key, token):
+        '''
+        Get a value from the typed value cache.
+
+        A cached value is only used if the token (what the value was
+        computed from, such as the SettingsEntry) is the same as when
+        it was cached, so a value computed while another thread changed
+        the setting is never used.
+
+        Sequential arguments:
+        name -- the setting name
+        key -- the parse function (or another key for the kind of value)
+        token -- the current token (compared to the cached one by ==,
+                 which compares SettingsEntry objects by identity)
+
+        Returns:
+        the value, or _MISSING if it isn't cached.
+        '''
+        cached = self._m_typed.get(name)
+        if (cached is not None) and (cached[0] == token):
+            value = cached[1].get(key, _MISSING)
+            if value is not _MISSING:
+                self._m_typed_hits += 1
+                return value
+        self._m_typed_misses += 1
+        return _MISSING
+
+    def _setCached(self, name, key, token, value):
+        '''
+        Cache a value (See _getCached).
+        '''
+        cached = self._m_typed.get(name)
+        if (cached is None) or not (cached[0] == token):
+            cached = (token, {})
+            self._m_typed[name] = cached
+        cached[1][key] = value
+
+    def _getToken(self, entry):
+        '''
+        Get the token for _getCached of a value computed from the entry
+        (the entry itself, or if it is a group, the entry and a count of
+        changes to the group, since groups are changed in place).
+        '''
+        if (entry is not None) and entry.is_group:
+            return (entry, entry.group._m_version)
+        return entry
+
+    def getCacheStats(self):
+        '''
+        Get the statistics of the typed value cache (for the typed
+        getters such as getInt) as a dict with the number of hits and
+        misses and the number of names that have cached values.
+        '''
+        return {
+            'hits': self._m_typed_hits,
+            'misses': self._m_typed_misses,
+            'names': len(self._m_typed),
+        }
 
     def getBool(self, name, noEx=False):
         '''
@@ -254,6 +885,7 @@ class Settings:
         Keyword arguments:
         noEx -- If True, don't raise exceptions.
         '''
+        return self._getTyped(name, is_yes, noEx)
 
     def getInt(self, name, noEx=False):
         '''
@@ -264,6 +896,7 @@ class Settings:
         Keyword arguments:
         noEx -- If True, don't raise exceptions.
         '''
+        return self._getTyped(name, int, noEx)
 
     def getFloat(self, name, noEx=False):
         '''
@@ -272,6 +905,7 @@ class Settings:
         Keyword arguments:
         noEx -- If True, don't raise exceptions.
         '''
+        return self._getTyped(name, float, noEx)
 
     def getV2F(self, name, noEx=False):
         '''
@@ -280,6 +914,7 @@ class Settings:
         Keyword arguments:
         noEx -- If True, don't raise exceptions.
         '''
+        return self._getTyped(name, _parseV2F, noEx)
 
     def getV3F(self, name, noEx=False):
         '''
@@ -288,69 +923,205 @@ class Settings:
         Keyword arguments:
         noEx -- If True, don't raise exceptions.
         '''
+        return self._getTyped(name, _parseV3F, noEx)
 
-    def getFlagStr(self, name, flagdesc, flagmask, noEx=False):
+    def getFlagStr(self, name, flagdesc=None, noEx=False):
         '''
-        Get an integer based on a named FlagDesc and flagmask int.
+        Get an integer based on a named FlagDesc.
 
         Like other getters, but handling each flag individually:
         1) Read default flags (or 0).
         2) Override using user-defined flags.
 
+        (The C++ flagmask out-parameter is not available).
+
         Keyword arguments:
+        flagdesc -- the FlagDesc of the setting (If None, use the one
+                    given to setDefault).
         noEx -- If True, don't raise exceptions.
         '''
+        if flagdesc is None:
+            flagdesc = self.getFlagDescFallback(name)
+            if flagdesc is None:
+                if noEx:
+                    return None
+                raise ValueError("There is no FlagDesc for {}"
+                                 "".format(name))
+        # The flags depend on the entry in each layer, not just the
+        #   merged one.
+        chain = []
+        settings = self
+        while settings is not None:
+            chain.append(settings._m_settings.get(name))
+            settings = settings._getParent()
+        token = tuple(chain)
+        flags = self._getCached(name, flagdesc, token)
+        if flags is not _MISSING:
+            return flags
+        flags = None
+        for entry in reversed(token):
+            if entry is None:
+                continue
+            if entry.is_group:
+                flags = None
+                break
+            value = entry.value
+            if value[:1].isdigit():
+                user_flags, user_mask = atoi(value), U32_MAX
+            else:
+                user_flags, user_mask = flagdesc.readFlagString(value)
+            flags = ((flags or 0) & ~user_mask) | user_flags
+        if flags is None:
+            return self.get(name, noEx=noEx)  # raise or return None
+        self._setCached(name, flagdesc, token, flags)
+        return flags
 
     def getFlag(self, name):
         '''
+        Get a named boolean setting, or False if it doesn't exist or
+        isn't valid.
 
         This method should raise no exceptions (to match C++ version).
         '''
+        return bool(self.getBool(name, noEx=True))
 
-    def getNoiseParams(self, name, np):
+    def getNoiseParams(self, name, np=None):
         '''
-        Get a named boolean based on the given NoiseParams np.
+        Get a named NoiseParams from a group or a string value (See
+        getNoiseParamsFromGroup and getNoiseParamsFromValue).
         '''
+        entry = self._getEntry(name)
+        if entry is None:
+            return None
+        if entry.is_group:
+            return self.getNoiseParamsFromGroup(name, np)
+        return self.getNoiseParamsFromValue(name, np)
 
-    def getNoiseParamsFromValue(self, name, np):
-        '''
-        Get a named boolean based on the given NoiseParams np.
+    def getNoiseParamsFromValue(self, name, np=None):
         '''
+        Get a named NoiseParams from a string in the format
+        "offset, scale, (x, y, z), seed, octaves, persistence" with
+        an optional ", lacunarity" (flags are not set).
 
-    def getNoiseParamsFromGroup(self, name, np):
+        The value is only parsed the first time (until it changes).
+
+        Keyword arguments:
+        np -- a NoiseParams to change (If None, change a new one). The
+              attributes not in the value are not changed.
+
+        Returns:
+        np, or None if the setting doesn't exist or is a group (and np
+        is not changed).
         '''
-        Get a named boolean based on the given NoiseParams np.
+        entry = self._getEntry(name)
+        if (entry is None) or entry.is_group:
+            return None
+        fields = self._getCached(name, _parseNoiseParamsValue, entry)
+        if fields is _MISSING:
+            fields = _parseNoiseParamsValue(entry.value)
+            self._setCached(name, _parseNoiseParamsValue, entry, fields)
+        if np is None:
+            np = NoiseParams()
+        return np.update(fields)
+
+    def getNoiseParamsFromGroup(self, name, np=None):
         '''
+        Get a named NoiseParams from a group with the settings offset,
+        scale, spread, seed, octaves, persistence, lacunarity and flags.
+
+        The group is only read the first time (until it changes).
+
+        Keyword arguments:
+        np -- a NoiseParams to change (If None, change a new one). The
+              attributes not in the group are not changed, except that
+              flags are NOISE_FLAG_DEFAULTS if missing.
+
+        Returns:
+        np, or None if the setting doesn't exist or isn't a group (and
+        np is not changed).
+        '''
+        entry = self._getEntry(name)
+        if (entry is None) or not entry.is_group:
+            return None
+        token = self._getToken(entry)
+        fields = self._getCached(name, NoiseParams, token)
+        if fields is _MISSING:
+            group = entry.group
+            fields = []
+            for attribute, key, getter in (
+                    ('offset', "offset", group.getFloat),
+                    ('scale', "scale", group.getFloat),
+                    ('spread', "spread", group.getV3F),
+                    ('seed', "seed", group.getInt),
+                    ('octaves', "octaves", group.getInt),
+                    ('persist', "persistence", group.getFloat),
+                    ('lacunarity', "lacunarity", group.getFloat)):
+                value = getter(key, noEx=True)
+                if value is not None:
+                    fields.append((attribute, value))
+            flags = group.getFlagStr("flags", flagdesc_noiseparams,
+                                     noEx=True)
+            fields.append(('flags', NOISE_FLAG_DEFAULTS if flags is None
+                           else flags))
+            fields = tuple(fields)
+            self._setCached(name, NoiseParams, token, fields)
+        if np is None:
+            np = NoiseParams()
+        return np.update(fields)
 
     def getNames(self):
         '''
-        Get a list of names of the settings.
+        Get a list of names of the settings (only those in this layer).
         '''
+        return list(self._m_settings)
 
     def exists(self, name):
         '''
-        Check if the setting exists.
+        Check if the setting exists (in this layer or a lower one).
         '''
+        return self._getEntry(name) is not None
 
     def setEntry(self, name, entry, set_group):
         '''
         Sequential arguments:
         name -- name of the setting
-        entry -- any type of entry
+        entry -- a string, or a Settings object if set_group
         set_group -- True or False to set the group.
+
+        Returns:
+        False if the name or value isn't valid, otherwise True.
         '''
         if not isinstance(set_group, bool):
             raise ValueError("set_group must be a boolean.")
-        ok = False
-        return ok
+        if not Settings._checkNameValid(name):
+            return False
+        if set_group:
+            entry._m_end_tag = "}"
+            new_entry = SettingsEntry(group=entry)
+        else:
+            if not Settings._checkValueValid(entry):
+                return False
+            new_entry = SettingsEntry(entry)
+        with self._m_mutex:
+            settings = self._m_settings
+            if name in settings:
+                settings[name] = new_entry
+            else:
+                settings = settings.copy()
+                settings[name] = new_entry
+                self._m_settings = settings
+            self._onChanged((name,))
+        return True
 
     def set(self, name, value):
         if not isinstance(name, str):
             raise TypeError("name must be a string.")
         if not isinstance(value, str):
             raise TypeError("value must be a string.")
-        ok = False
-        return ok
+        if not self.setEntry(name, value, False):
+            return False
+        self.doCallbacks((name,))
+        return True
 
     def setDefault(self, name, value, flags=None):
         '''
@@ -358,19 +1129,47 @@ class Settings:
 
         (This replaces both the regular string value and overloaded
         FlagDesc value versions of the C++ method).
+
+        Sequential arguments:
+        name -- the setting name
+        value -- a string, or a FlagDesc (then flags is the value and
+                 is required, and getFlagStr and setFlagStr use the
+                 FlagDesc by default)
+
+        The value is set in the SL_DEFAULTS layer of this object's
+        hierarchy (or the global one if it isn't in one).
         '''
         if not isinstance(name, str):
             raise TypeError("name must be a string.")
         if not isinstance(value, str):
             if not isinstance(value, FlagDesc):
                 raise TypeError("value must be a string or FlagDesc.")
+            if not isinstance(flags, int):
+                raise TypeError("flags must be an int when value is a"
+                                " FlagDesc, but it was {}"
+                                "".format(repr(flags)))
+            Settings._s_flags[name] = value
+            value = value.writeFlagString(flags, U32_MAX)
+        h = self._m_hierarchy
+        if h is None:
+            h = g_hierarchy
+        defaults = h.getLayer(SettingsLayer.SL_DEFAULTS.value)
+        if defaults is None:
+            raise RuntimeError("There is no SL_DEFAULTS layer.")
+        return defaults.set(name, value)
 
     def setGroup(self, name, group):
-        pass
+        '''
+        Set a named group to a copy of the Settings object group.
+        '''
+        copy = Settings()
+        copy.updateNoLock(group)
+        return self.setEntry(name, copy, True)
 
     def setBool(self, name, value):
         if not isinstance(value, bool):
             raise ValueError("value must be a boolean.")
+        return self.set(name, "true" if value else "false")
 
     def setInt(self, name, value):
         '''
@@ -379,9 +1178,10 @@ class Settings:
         '''
         if not isinstance(value, int):
             raise ValueError("value must be an int.")
+        return self.set(name, str(value))
 
     def setFloat(self, name, value):
-        pass
+        return self.set(name, str(float(value)))
 
     def setV2F(self, name, value):
         '''
@@ -391,15 +1191,17 @@ class Settings:
             raise ValueError("setV2F requires a vector of length 2"
                              " but len({}) is {}"
                              "".format(name, len(value)))
+        return self.set(name, "({},{})".format(*value))
 
     def setV3F(self, name, value):
         '''
         Set a named tuple of length 3.
         '''
         if len(value) != 3:
-            raise ValueError("setV2F requires a vector of length 2"
+            raise ValueError("setV3F requires a vector of length 3"
                              " but len({}) is {}"
                              "".format(name, len(value)))
+        return self.set(name, "({},{},{})".format(*value))
 
     def setFlagStr(self, name, flags, flagdesc=None, flagmask=U32_MAX):
         '''
@@ -410,62 +1212,238 @@ class Settings:
         flags -- the bitmask as an integer
 
         Keyword arguments:
-        flagdesc -- a FlagDesc object
-        flagmask -- an override for the default bitmask
+        flagdesc -- a FlagDesc object (If None, use the one given to
+                    setDefault)
+        flagmask -- the flags to write (others are left unchanged by
+                    getFlagStr)
+
+        Returns:
+        False if there is no flagdesc or the name isn't valid,
+        otherwise True.
         '''
+        if flagdesc is None:
+            flagdesc = self.getFlagDescFallback(name)
+            if flagdesc is None:
+                return False
+        return self.set(name, flagdesc.writeFlagString(flags, flagmask))
 
     def setNoiseParams(self, name, np):
         '''
-        Set a named NoiseParams object.
+        Set a named NoiseParams object (as a group).
         '''
+        group = Settings()
+        group.setFloat("offset", np.offset)
+        group.setFloat("scale", np.scale)
+        group.setV3F("spread", np.spread)
+        group.setInt("seed", np.seed)
+        group.setInt("octaves", np.octaves)
+        group.setFloat("persistence", np.persist)
+        group.setFloat("lacunarity", np.lacunarity)
+        group.setFlagStr("flags", np.flags, flagdesc_noiseparams, np.flags)
+        return self.setEntry(name, group, True)
 
     def remove(self, name):
         '''
-        Remove a setting.
+        Remove a setting (from this layer only).
+
+        Returns:
+        True if the setting was in this layer.
         '''
+        with self._m_mutex:
+            if name not in self._m_settings:
+                return False
+            settings = self._m_settings.copy()
+            del settings[name]
+            self._m_settings = settings
+            self._onChanged((name,))
+        self.doCallbacks((name,))
+        return True
 
     def getFlagDescFallback(self, name):
         '''
-        Get a named FlagDesc callback object.
+        Get the FlagDesc given to setDefault for the name (or None).
         '''
+        return Settings._s_flags.get(name)
 
     def registerChangedCallback(self, name, cbf, userdata=None):
         '''
         Register SettingsChangedCallback cbf.
+
+        Unlike the C++ version, cbf is called as cbf(names, userdata)
+        where names is a frozenset of the names that changed, since a
+        change of many settings at once (such as by updateNoLock or
+        readConfigFile) calls each registered cbf and userdata pair
+        only once (even if registered for several of the names).
+
+        Sequential arguments:
+        name -- the setting to watch
+        cbf -- the function to call
+
+        Keyword arguments:
+        userdata -- the second argument for cbf
         '''
+        with self._m_callback_mutex:
+            self._m_callbacks.setdefault(name, []).append((cbf, userdata))
 
     def deregisterChangedCallback(self, name, cbf, userdata=None):
         '''
         Deregister (unregister) SettingsChangedCallback cbf.
         '''
+        with self._m_callback_mutex:
+            callbacks = self._m_callbacks.get(name)
+            if callbacks is None:
+                return
+            callbacks[:] = [
+                callback for callback in callbacks
+                if not ((callback[0] == cbf) and (callback[1] is userdata))
+            ]
+            if not callbacks:
+                del self._m_callbacks[name]
+
+    def setCallbackExecutor(self, executor):
+        '''
+        Run callbacks using a concurrent.futures.Executor, so they
+        don't delay the code that changes settings (or None to run them
+        before the change returns, which is the default).
+        '''
+        self._m_callback_executor = executor
 
     def removeSecureSettings(self):
         pass
 
-    def getLayer(self):
-        return self.m_settingslayer
+    def getSettingsLayer(self):
+        '''
+        Get the layer number of this object in its hierarchy (-1 if it
+        isn't in one).
+        '''
+        return self._m_settingslayer
 
     def _parseConfigObject(self, line):
         '''
-        return a name, value tuple from a line
-        (formerly returned values via reference)
-        '''
+        Parse one line of a config file.
+
+        Returns:
+        a (SettingsParseEvent, name, value) tuple (name and value are
+        None unless the event is SPE_KVPAIR, SPE_GROUP or SPE_MULTILINE)
+        '''
+        trimmed = line.strip()
+        if not trimmed:
+            return SettingsParseEvent.SPE_NONE, None, None
+        if trimmed[0] == "#":
+            return SettingsParseEvent.SPE_COMMENT, None, None
+        if trimmed == self._m_end_tag:
+            return SettingsParseEvent.SPE_END, None, None
+        name, sep, value = trimmed.partition("=")
+        if not sep:
+            return SettingsParseEvent.SPE_INVALID, None, None
+        name = name.rstrip()
+        value = value.lstrip()
+        if value == "{":
+            return SettingsParseEvent.SPE_GROUP, name, value
+        if value == '"""':
+            return SettingsParseEvent.SPE_MULTILINE, name, value
+        return SettingsParseEvent.SPE_KVPAIR, name, value
 
     def _updateConfigObject(self, ins, outs, tab_depth=0):
-        ok = False
-        return ok
+        '''
+        Copy the lines of ins to outs, replacing each setting that
+        differs from this object and skipping each one that isn't in
+        this object, then write those that weren't in ins (See
+        updateConfigFile).
+
+        Sequential arguments:
+        ins -- input stream (iterator) positioned after the start of
+               this object's group (if it is a group)
+        outs -- an output stream
+
+        Returns:
+        True if outs differs from ins (other than line endings).
+        '''
+        ins = iter(ins)
+        settings = self._m_settings
+        present = set()
+        was_modified = False
+        end_found = False
+        for line in ins:
+            event, name, value = self._parseConfigObject(line)
+            if event is SettingsParseEvent.SPE_END:
+                # Skip the end tag (It is written after new entries).
+                end_found = True
+                break
+            elif event is SettingsParseEvent.SPE_GROUP:
+                entry = settings.get(name)
+                if (entry is not None) and entry.is_group:
+                    outs.write(line.rstrip("\n") + "\n")
+                    if entry.group._updateConfigObject(ins, outs,
+                                                       tab_depth + 1):
+                        was_modified = True
+                    present.add(name)
+                    continue
+                # Skip the old group.
+                Settings("}")._updateConfigObject(ins, io.StringIO(),
+                                                  tab_depth + 1)
+                was_modified = True
+                if entry is not None:
+                    self._printEntry(outs, name, entry, tab_depth)
+                    present.add(name)
+            elif event in (SettingsParseEvent.SPE_KVPAIR,
+                           SettingsParseEvent.SPE_MULTILINE):
+                multiline = event is SettingsParseEvent.SPE_MULTILINE
+                if multiline:
+                    value = self._getMultiline(ins)
+                entry = settings.get(name)
+                if entry is None:
+                    was_modified = True  # Remove it by skipping it.
+                    continue
+                if entry.is_group or (entry.value != value):
+                    self._printEntry(outs, name, entry, tab_depth)
+                    was_modified = True
+                elif multiline:
+                    outs.write(line.rstrip("\n") + "\n" + value
+                               + '\n"""\n')
+                else:
+                    outs.write(line.rstrip("\n") + "\n")
+                present.add(name)
+            else:
+                outs.write(line.rstrip("\n") + "\n")
+        for name, entry in settings.items():
+            if name not in present:
+                self._printEntry(outs, name, entry, tab_depth)
+                was_modified = True
+        if self._m_end_tag:
+            outs.write("\t" * tab_depth + self._m_end_tag + "\n")
+            if not end_found:
+                was_modified = True
+        return was_modified
 
     @staticmethod
     def _checkNameValid(name):
-        return False
+        if _invalid_name_re.search(name) is not None:
+            _log.error("Settings: Invalid name '{}'", name)
+            return False
+        return True
 
     @staticmethod
     def _checkValueValid(value):
-        return False
+        if value.startswith('"""') or ('\n"""' in value):
+            _log.error('Settings: Invalid value (contains """): {!r}',
+                       value)
+            return False
+        return True
 
     @staticmethod
-    def _getMultiline(ins, num_lines=None):
-        return ""
+    def _getMultiline(ins):
+        '''
+        Get the lines of ins up to (not including) a line that is
+        exactly three double quotes, joined by newlines.
+        '''
+        lines = []
+        for line in ins:
+            line = line.rstrip("\n")
+            if line == '"""':
+                break
+            lines.append(line)
+        return "\n".join(lines)
 
     def _printEntry(self, outs, name, entry, tab_depth=0):
         '''
@@ -473,30 +1451,222 @@ class Settings:
         outs -- an output stream
         entry -- a SettingsEntry object
         '''
+        outs.write("\t" * tab_depth)
+        if entry.is_group:
+            outs.write(name + " = {\n")
+            entry.group.writeLines(outs, tab_depth + 1)
+            # Closing bracket handled by writeLines
+        elif "\n" in entry.value:
+            outs.write(name + ' = """\n' + entry.value + '\n"""\n')
+        else:
+            outs.write(name + " = " + entry.value + "\n")
+
+    def _isDirty(self):
+        '''
+        Check if entries of this object or of its groups changed since
+        the last updateConfigFile.
+        '''
+        if self._m_dirty:
+            return True
+        for entry in self._m_settings.values():
+            if entry.is_group and entry.group._isDirty():
+                return True
+        return False
+
+    def _clearDirty(self):
+        self._m_dirty = False
+        for entry in self._m_settings.values():
+            if entry.is_group:
+                entry.group._clearDirty()
 
     def _getParent(self):
         '''
         Get the parent Settings object.
         '''
+        if self._m_hierarchy is None:
+            return None
+        return self._m_hierarchy._getParent(self._m_settingslayer)
 
     def _getEntry(self, name):
         '''
-        Get a named entry.
+        Get a named entry (or None) from this layer or a lower one.
+        '''
+        return self._m_merged.get(name)
+
+    def _getMerged(self):
+        '''
+        Get the merged view (do not change it).
+        '''
+        return self._m_merged
+
+    def _findEntry(self, name):
+        '''
+        Get a named entry (or None) by walking down the layers (as the
+        C++ getEntry does) instead of using the merged view.
+        '''
+        settings = self
+        while settings is not None:
+            entry = settings._m_settings.get(name)
+            if entry is not None:
+                return entry
+            settings = settings._getParent()
+        return None
+
+    def _updateMerged(self, names):
+        '''
+        Update the merged view and discard cached typed values after
+        entries of this layer or a lower one changed (See
+        SettingsHierarchy._onLayerChanged).
+
+        Sequential arguments:
+        names -- the names that changed, or None to rebuild the view
+        '''
+        if names is None:
+            self._m_typed = {}
+        else:
+            typed = self._m_typed
+            for name in names:
+                typed.pop(name, None)
+        parent = self._getParent()
+        if parent is None:
+            self._m_merged = self._m_settings
+        elif names is None:
+            merged = parent._m_merged.copy()
+            merged.update(self._m_settings)
+            self._m_merged = merged
+        elif len(names) == 1:
+            merged = self._m_merged
+            name = next(iter(names))
+            entry = self._findEntry(name)
+            if (entry is not None) and (name in merged):
+                # Replacing the value of an existing key doesn't resize
+                #   the dict, so it can be done in place.
+                merged[name] = entry
+            elif (entry is not None) or (name in merged):
+                merged = merged.copy()
+                self._mergeEntries(merged, names)
+                self._m_merged = merged
+        else:
+            merged = self._m_merged.copy()
+            self._mergeEntries(merged, names)
+            self._m_merged = merged
+
+    def _mergeEntries(self, merged, names):
+        for name in names:
+            entry = self._findEntry(name)
+            if entry is None:
+                merged.pop(name, None)
+            else:
+                merged[name] = entry
+
+    def _onChanged(self, names):
         '''
+        Update the merged views and typed value caches after entries of
+        this object changed (the caller must hold _m_mutex).
+
+        Sequential arguments:
+        names -- the names that changed, or None if many may have
+        '''
+        self._m_dirty = True
+        self._m_version += 1
+        if self._m_hierarchy is not None:
+            self._m_hierarchy._onLayerChanged(self._m_settingslayer, names)
+        else:
+            self._updateMerged(names)
 
     def updateNoLock(self, other):
         '''
-        Update using another Settings object.
+        Update using another Settings object (each entry of other
+        replaces the entry of the same name).
+
+        (Unlike the C++ version, this takes _m_mutex, since Python
+        code that calls it doesn't hold the lock).
         '''
+        entries = other._m_settings
+        with self._m_mutex:
+            settings = self._m_settings.copy()
+            settings.update(entries)
+            self._m_settings = settings
+            self._onChanged(list(entries))
+        self.doCallbacks(entries)
 
     def clearNoLock(self):
-        pass
+        '''
+        Remove every setting of this layer.
+
+        (Unlike the C++ version, this takes _m_mutex).
+        '''
+        with self._m_mutex:
+            names = self._m_settings
+            self._m_settings = {}
+            self._onChanged(None)
+        self.doCallbacks(names)
 
     def clearDefaultsNoLock(self):
-        pass
+        '''
+        Clear the defaults layer of this object's hierarchy.
+        '''
+        if self._m_hierarchy is None:
+            return
+        defaults = self._m_hierarchy.getLayer(
+            SettingsLayer.SL_DEFAULTS.value
+        )
+        if defaults is not None:
+            defaults.clearNoLock()
+
+    def doCallbacks(self, names):
+        '''
+        Call each registered callback of the names once (with the
+        changed names that it was registered for).
+
+        Sequential arguments:
+        names -- a collection of names that changed (or one name)
+        '''
+        callbacks = self._m_callbacks
+        if not callbacks:
+            return
+        if isinstance(names, str):
+            names = (names,)
+        batches = {}
+        with self._m_callback_mutex:
+            if len(names) > len(callbacks):
+                # Only look up names that have callbacks.
+                if not isinstance(names, (set, frozenset, dict)):
+                    names = set(names)
+                names = [name for name in callbacks if name in names]
+            for name in names:
+                for cbf, userdata in callbacks.get(name, ()):
+                    key = (cbf, id(userdata))
+                    batch = batches.get(key)
+                    if batch is None:
+                        batch = batches[key] = (cbf, userdata, set())
+                    batch[2].add(name)
+        executor = self._m_callback_executor
+        for cbf, userdata, changed in batches.values():
+            if executor is None:
+                cbf(frozenset(changed), userdata)
+            else:
+                executor.submit(cbf, frozenset(changed), userdata)
+
+
+def _statSignature(path):
+    '''
+    Get a tuple that changes whenever the file is replaced or modified,
+    or None if the file doesn't exist.
+    '''
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+def _parseV2F(value):
+    return parse_floats(value, 2)
 
-    def doCallbacks(name):
-        pass
 
+def _parseV3F(value):
+    return parse_floats(value, 3)
 
 
+g_hierarchy = SettingsHierarchy()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+from __future__ import print_function
+from __future__ import division
+import os
+import subprocess
+import sys
+
+from unittest import TestCase
+
+TESTS_DIR = os.path.dirname(os.path.realpath(__file__))
+REPO_DIR = os.path.dirname(os.path.dirname(TESTS_DIR))
+
+# Modules that importing voxboxor may import (other than those already
+#   imported by the interpreter at startup).
+ALLOWED_MODULES = {"__future__", "voxboxor"}
+
+# Modules that importing voxboxor used to import (they must only be
+#   imported when an attribute that needs them is used).
+LAZY_MODULES = ("voxboxor.settings", "enum", "platform", "logging")
+
+
+def _import_times(code):
+    '''
+    Run code in a new interpreter with -X importtime.
+
+    Returns:
+    a dict of each module imported to its (self, cumulative) time in
+    microseconds, and a dict of each module to the module that
+    imported it (or None if imported at the top level).
+    '''
+    env = dict(os.environ)
+    env['PYTHONPATH'] = REPO_DIR
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        env=env, cwd=REPO_DIR, stderr=subprocess.PIPE,
+        universal_newlines=True, check=True,
+    )
+    times = {}
+    parents = {}
+    stack = []  # (depth, name) of modules that may be parents
+    # Each module is listed after the modules it imports, indented by
+    #   two more spaces.
+    for line in reversed(result.stderr.splitlines()):
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if not fields[0].strip().isdigit():
+            continue  # the header
+        depth = len(fields[2]) - len(fields[2].lstrip()) - 1
+        name = fields[2].strip()
+        while stack and stack[-1][0] >= depth:
+            stack.pop()
+        parents[name] = stack[-1][1] if stack else None
+        stack.append((depth, name))
+        times[name] = (int(fields[0]), int(fields[1]))
+    return times, parents
+
+
+def _top_level(parents, name):
+    while parents.get(name) is not None:
+        name = parents[name]
+    return name
+
+
+class TestImport(TestCase):
+    def test_import_is_lazy(self):
+        times, parents = _import_times("import voxboxor")
+        imported = {name for name in times
+                    if _top_level(parents, name) == "voxboxor"}
+        self.assertEqual(imported - ALLOWED_MODULES, set(),
+                         "import voxboxor imports more than {}"
+                         "".format(sorted(ALLOWED_MODULES)))
+        for name in LAZY_MODULES:
+            self.assertNotIn(name, imported,
+                             "import voxboxor imports {}".format(name))
+
+        times, parents = _import_times(
+            "import voxboxor; voxboxor.mydirs; voxboxor.Settings"
+        )
+        self.assertIn("voxboxor.settings", times)
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+from __future__ import print_function
+from __future__ import division
+from array import array
+from unittest import (
+    TestCase,
+    skipIf,
+)
+from unittest.mock import patch
+
+from voxboxor import irrcompat
+from voxboxor.irrcompat import (
+    irr_to_mt,
+    mt_to_irr,
+)
+
+POSITIONS = ((10, -20, 35), (0.5, 1e6, -7.25), (123456, 0, 3))
+
+
+class TestIrrCompat(TestCase):
+    def test_scalars_and_tuples(self):
+        self.assertEqual(irr_to_mt(5), 0.5)
+        self.assertEqual(mt_to_irr(0.5), 5.0)
+        self.assertEqual(irr_to_mt((10, 20, 30)), (1.0, 2.0, 3.0))
+        self.assertEqual(irr_to_mt([10, 20]), (1.0, 2.0))
+        self.assertEqual(mt_to_irr((1,)), (10.0,))
+        with self.assertRaises(ValueError):
+            mt_to_irr((1, 2, 3, 4))
+
+    def _check_arrays(self):
+        for typecode in "fd":
+            flat = array(typecode, [v for pos in POSITIONS for v in pos])
+            # Each value must be the same as converting it alone (then
+            #   rounding to the array's type).
+            expected = array(typecode, [irr_to_mt(v) for v in flat])
+            result = irr_to_mt(flat)
+            self.assertEqual(result, expected)
+            self.assertIsNot(result, flat)
+            self.assertEqual(mt_to_irr(result),
+                             array(typecode, [mt_to_irr(v) for v in result]))
+            self.assertIs(irr_to_mt(flat, out=flat), flat)
+            self.assertEqual(flat, expected)
+        self.assertEqual(irr_to_mt(array('i', [5, -15])),
+                         array('d', [0.5, -1.5]))
+        with self.assertRaises(TypeError):
+            irr_to_mt(array('i', [5]), out=array('i', [0]))
+        with self.assertRaises(ValueError):
+            irr_to_mt(array('f', [5]), out=array('f'))
+
+    def test_arrays(self):
+        self._check_arrays()
+
+    def test_arrays_without_numpy(self):
+        with patch.object(irrcompat, "numpy", None):
+            self._check_arrays()
+
+    @skipIf(irrcompat.numpy is None, "NumPy is not installed.")
+    def test_numpy(self):
+        numpy = irrcompat.numpy
+        positions = numpy.array(POSITIONS, dtype=numpy.float64)
+        result = irr_to_mt(positions)
+        self.assertEqual(result.shape, (3, 3))
+        self.assertEqual([tuple(row) for row in result.tolist()],
+                         [irr_to_mt(pos) for pos in POSITIONS])
+        self.assertEqual(positions.tolist()[0], [10.0, -20.0, 35.0])
+        self.assertIs(mt_to_irr(result, out=result), result)
+        self.assertEqual([tuple(row) for row in result.tolist()],
+                         [mt_to_irr(irr_to_mt(pos)) for pos in POSITIONS])
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+from __future__ import print_function
+from __future__ import division
+import io
+import logging
+import threading
+
+from contextlib import redirect_stderr
+from unittest import TestCase
+from unittest.mock import patch
+
+import voxboxor.log
+
+from voxboxor import (
+    echo0,
+    echo1,
+    echo2,
+    set_verbosity,
+)
+
+from voxboxor.log import (
+    SUBSYSTEMS,
+    get_log,
+    set_level,
+    start_queue,
+    stop_queue,
+)
+
+
+class Formatted:
+    '''
+    An argument that counts how many times it is formatted.
+    '''
+    def __init__(self):
+        self.count = 0
+
+    def __format__(self, spec):
+        self.count += 1
+        return "formatted"
+
+
+class TestLog(TestCase):
+    def tearDown(self):
+        stop_queue()
+        for subsystem in SUBSYSTEMS:
+            set_level(subsystem, None)
+        set_verbosity(0)
+
+    def test_lazy_arguments(self):
+        log = get_log("network")
+        arg = Formatted()
+        stderr = io.StringIO()
+        with redirect_stderr(stderr):
+            log.debug("Ignored {}", arg)
+            log.info("Ignored {}", arg)
+            self.assertEqual(arg.count, 0)
+            log.warning("Shown {}", arg)
+            log.error("No arguments {}")
+        self.assertEqual(arg.count, 1)
+        self.assertEqual(stderr.getvalue(),
+                         "Shown formatted\nNo arguments {}\n")
+
+    def test_levels(self):
+        network = get_log("network")
+        settings = get_log("settings")
+        set_level("network", logging.DEBUG)
+        self.assertTrue(network.isEnabledFor(logging.DEBUG))
+        self.assertFalse(settings.isEnabledFor(logging.INFO))
+        set_verbosity(1)
+        self.assertTrue(network.isEnabledFor(logging.DEBUG))  # its own
+        self.assertTrue(settings.isEnabledFor(logging.INFO))
+        self.assertFalse(settings.isEnabledFor(logging.DEBUG))
+        set_level("network", None)
+        self.assertFalse(network.isEnabledFor(logging.DEBUG))
+        self.assertEqual(network.logger.getEffectiveLevel(), logging.INFO)
+
+    def test_echo(self):
+        stderr = io.StringIO()
+        with redirect_stderr(stderr):
+            echo0("a", 1)
+            echo1("hidden")
+            set_verbosity(2)
+            echo1("b", "c", sep="-")
+            echo2("d", end="!\n")
+        self.assertEqual(stderr.getvalue(), "a 1\nb-c\nd!\n")
+
+    def test_queue(self):
+        log = get_log("mainmenu")
+        stderr = io.StringIO()
+        with redirect_stderr(stderr):
+            start_queue()
+            start_queue()  # already started
+            for i in range(100):
+                log.warning("Message {}", i)
+            stop_queue()
+            log.warning("Direct")
+        self.assertEqual(
+            stderr.getvalue().splitlines(),
+            ["Message {}".format(i) for i in range(100)] + ["Direct"],
+        )
+
+    def test_stop_queue_while_logging(self):
+        log = get_log("mainmenu")
+        stderr = io.StringIO()
+        stopped = threading.Event()
+
+        def run():
+            i = 0
+            while not stopped.is_set() or (i < 1000):
+                log.warning("Message {}", i)
+                i += 1
+
+        with redirect_stderr(stderr):
+            start_queue()
+            thread = threading.Thread(target=run)
+            thread.start()
+            while stderr.tell() == 0:
+                pass
+            stop_queue()
+            stopped.set()
+            thread.join()
+        lines = stderr.getvalue().splitlines()
+        # Each message is written once and in order (the queued ones
+        #   before the direct ones).
+        self.assertEqual(lines,
+                         ["Message {}".format(i) for i in range(len(lines))])
+        self.assertGreaterEqual(len(lines), 1000)
+
+    def test_message_queued_while_stopping(self):
+        log = get_log("mainmenu")
+        stderr = io.StringIO()
+        with redirect_stderr(stderr):
+            start_queue()
+            listener = voxboxor.log._listener
+            enqueue_sentinel = listener.enqueue_sentinel
+
+            def enqueue_late():
+                enqueue_sentinel()
+                log.warning("After the sentinel")
+
+            with patch.object(listener, "enqueue_sentinel", enqueue_late):
+                log.warning("Queued")
+                stop_queue()
+            log.warning("Direct")
+        self.assertEqual(stderr.getvalue().splitlines(),
+                         ["Queued", "After the sentinel", "Direct"])
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+from __future__ import print_function
+from __future__ import division
+import asyncio
+import os
+import tempfile
+
+from unittest import TestCase
+from unittest.mock import patch
+
+from voxboxor.network import capture
+
+from voxboxor.network.connection import (
+    get_packet_bytes,
+)
+
+from voxboxor.network.capture import (
+    DIRECTION_IN,
+    DIRECTION_OUT,
+    CaptureReader,
+    CaptureWriter,
+    recording_protocol,
+    replay,
+    summarize,
+)
+
+from voxboxor.network.transport import (
+    ServerProtocol,
+    create_server,
+    open_connection,
+)
+
+from test_network_transport import (
+    _wait_for,
+)
+
+
+class TestCapture(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "test.vxbxcap")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_append_index_and_decode(self):
+        connect = get_packet_bytes("client", "connect", {})
+        connected = get_packet_bytes("server", "connected",
+                                     {'peer_id_new': 7})
+        client = ("127.0.0.1", 40000)
+        with CaptureWriter(self.path) as writer:
+            writer.write(DIRECTION_IN, client, connect, timestamp=10.0)
+            writer.write(DIRECTION_OUT, client, connected, timestamp=10.5)
+        # A crash while writing leaves part of a record.
+        with open(self.path, 'ab') as stream:
+            stream.write(b"\0\1\2")
+        with CaptureReader(self.path) as reader:
+            self.assertEqual(len(reader), 2)
+            self.assertTrue(reader.truncated)
+        with CaptureWriter(self.path) as writer:
+            writer.write(DIRECTION_IN, ("127.0.0.1", 40001), b"junk",
+                         timestamp=11.0)
+        with CaptureReader(self.path) as reader:
+            self.assertEqual(len(reader), 3)
+            self.assertFalse(reader.truncated)
+            first, second, third = reader[0], reader[1], reader[2]
+            self.assertEqual(bytes(reader.data_of(first)), connect)
+            self.assertEqual((second.direction, second.peer_id,
+                              second.timestamp),
+                             (DIRECTION_OUT, 0, 10.5))
+            self.assertEqual(reader.decode(second).peer_id_new, 7)
+            self.assertEqual(third.stream, 1)
+            with self.assertRaises(ValueError):
+                reader.decode(third)
+            stats = summarize(reader)
+            self.assertEqual(stats['records'], 3)
+            self.assertEqual(stats['purposes'][("in", "unknown")], 1)
+            self.assertEqual(stats['purposes'][("out", "server connected")],
+                             1)
+
+    def test_record_and_replay(self):
+        async def run():
+            writer = CaptureWriter(self.path)
+            server_transport, server = await create_server(
+                "127.0.0.1", 0,
+                protocol_factory=recording_protocol(ServerProtocol, writer),
+            )
+            host, port = server_transport.get_extra_info('sockname')[:2]
+            try:
+                clients = [await open_connection(host, port)
+                           for _ in range(5)]
+                for _, client in clients:
+                    client.disconnect()
+                await asyncio.sleep(0.05)
+            finally:
+                server_transport.close()
+                writer.close()
+            self.assertGreaterEqual(writer.count, 15)
+
+            class CountingServer(ServerProtocol):
+                connect_count = 0
+
+                def on_connect(self, address):
+                    CountingServer.connect_count += 1
+                    ServerProtocol.on_connect(self, address)
+
+            server_transport, server = await create_server(
+                "127.0.0.1", 0, protocol_factory=CountingServer,
+            )
+            host, port = server_transport.get_extra_info('sockname')[:2]
+            try:
+                with CaptureReader(self.path) as reader:
+                    stats = await replay(reader, host, port, speed=None)
+                self.assertEqual(stats['streams'], 5)
+                for _ in range(100):
+                    if CountingServer.connect_count >= 5:
+                        break
+                    await asyncio.sleep(0.01)
+                self.assertEqual(CountingServer.connect_count, 5)
+            finally:
+                server_transport.close()
+        asyncio.run(run())
+
+    def test_reopen_reads_trailer(self):
+        connect = get_packet_bytes("client", "connect", {})
+        with CaptureWriter(self.path) as writer:
+            writer.write(DIRECTION_IN, ("127.0.0.1", 40000), connect)
+            writer.write(DIRECTION_IN, ("127.0.0.1", 40001), connect)
+        # Reopening a closed capture must not read its records.
+        with patch.object(capture, "CaptureReader", None):
+            with CaptureWriter(self.path) as writer:
+                writer.write(DIRECTION_IN, ("127.0.0.1", 40002), connect)
+        with CaptureWriter(self.path) as writer:
+            pass
+        with CaptureReader(self.path) as reader:
+            self.assertEqual([record.stream for record in reader],
+                             [0, 1, 2])
+            self.assertFalse(reader.truncated)
+            self.assertEqual(summarize(reader)['records'], 3)
+
+    def test_replay_rewrites_peer_ids(self):
+        async def run():
+            writer = CaptureWriter(self.path)
+            server_transport, server = await create_server(
+                "127.0.0.1", 0,
+                protocol_factory=recording_protocol(ServerProtocol, writer),
+            )
+            host, port = server_transport.get_extra_info('sockname')[:2]
+            try:
+                _, client = await open_connection(host, port)
+                client.send_reliable(0, b"recorded")
+                await _wait_for(client.connection.idle)
+                recorded_peer_id = client.peer_id
+            finally:
+                server_transport.close()
+                writer.close()
+
+            class PayloadServer(ServerProtocol):
+                payloads = []
+
+                def on_payload(self, peer_id, channel, payload):
+                    PayloadServer.payloads.append((peer_id, channel,
+                                                   bytes(payload)))
+
+            server_transport, server = await create_server(
+                "127.0.0.1", 0, protocol_factory=PayloadServer,
+            )
+            host, port = server_transport.get_extra_info('sockname')[:2]
+            try:
+                # Take a peer ID so the replayed stream gets another one.
+                _, other = await open_connection(host, port)
+                self.assertEqual(other.peer_id, recorded_peer_id)
+                with CaptureReader(self.path) as reader:
+                    await replay(reader, host, port, speed=None)
+                await _wait_for(lambda: PayloadServer.payloads)
+                peer_id, channel, payload = PayloadServer.payloads[0]
+                self.assertNotEqual(peer_id, recorded_peer_id)
+                self.assertEqual((channel, payload), (0, b"recorded"))
+            finally:
+                server_transport.close()
+        asyncio.run(run())
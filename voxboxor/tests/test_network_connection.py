@@ -9,6 +9,24 @@ from unittest import TestCase
 from voxboxor.network.connection import (
     get_packet_bytes,
     bytes_to_packet,
+    get_packet_codec,
+    get_packet_format,
+    c_like_index,
+    control_p_values_for,
+    register_packet_def,
+    to_c_like,
+    to_c_like_values,
+    buffer_to_packet,
+    PacketBufferRing,
+    MinetestPacket,
+    classify_packet,
+    decode_packet,
+    get_packets_bytes,
+    bytes_to_columns,
+)
+
+from voxboxor.network.peers import (
+    PeerIdAllocator,
 )
 
 from voxboxor import (
@@ -29,23 +47,17 @@ if not os.path.isdir(testDataPath):
 
 
 class DummyServer():
-    PEER_ID_FIRST = 2
-    # 0 and 1 are not allowed (0 is PEER_ID_INEXISTENT)
+    # 0 and 1 are not allowed (0 is PEER_ID_INEXISTENT), which
+    #   PeerIdAllocator takes care of.
 
     def __init__(self):
-        self.server_client_ids = []
-        self.new_client_id = DummyServer.PEER_ID_FIRST
+        self.server_client_ids = PeerIdAllocator()
 
     def _peek_client_id(self):
-        new_client_id = self.new_client_id
-        while new_client_id in self.server_client_ids:
-            new_client_id += 1
-        return new_client_id
+        return self.server_client_ids.peek()
 
     def generate_client_id(self):
-        while self.new_client_id in self.server_client_ids:
-            self.new_client_id += 1
-        return self.new_client_id
+        return self.server_client_ids.allocate()
 
     def client_connect_packet(self, values):
         client_connect_bytes = get_packet_bytes("client", "connect",
@@ -73,7 +85,6 @@ class DummyServer():
                 "".format(server_connected_len,
                           len(server_connected_bytes))
             )
-        self.server_client_ids.append(values['peer_id_new'])
         return server_connected_bytes
 
     def client_disconnect_packet(self, values):
@@ -95,7 +106,7 @@ class DummyServer():
                 "".format(client_disconnect_len,
                           len(client_disconnect_bytes))
             )
-        self.server_client_ids.remove(sender_peer_id)
+        self.server_client_ids.release(sender_peer_id)
         return client_disconnect_bytes
 
 
@@ -114,8 +125,8 @@ class TestConnection(TestCase):
                                    server_connected_bytes)
         values = {}
         echo0("connected to offline {}".format(type(server).__name__))
-        echo0("server.server_client_ids={}"
-              "".format(server.server_client_ids))
+        echo0("server.server_client_ids.count={}"
+              "".format(server.server_client_ids.count))
         ex_good = False
         try:
             client_disconnect_bytes = \
@@ -160,8 +171,8 @@ class TestConnection(TestCase):
         values['sender_peer_id'] = s_packet.get('peer_id_new')
         echo0("values['sender_peer_id']={}"
               "".format(values['sender_peer_id']))
-        echo0("server.server_client_ids={}"
-              "".format(server.server_client_ids))
+        echo0("server.server_client_ids.count={}"
+              "".format(server.server_client_ids.count))
         client_disconnect_bytes = server.client_disconnect_packet(values)
 
         ex_good = False
@@ -180,3 +191,144 @@ class TestConnection(TestCase):
                 "Disconnect shouldn't work with peer_id {}"
                 " already disconnected".format(values['sender_peer_id'])
             )
+
+
+class TestPacketCodec(TestCase):
+    def test_codec_is_compiled_once(self):
+        codec = get_packet_codec("server", "connected")
+        self.assertIs(codec, get_packet_codec("server", "connected"))
+        pack, pack_names, defaults, fieldsdef = get_packet_format(
+            "server",
+            "connected",
+        )
+        self.assertEqual(codec.pack, pack)
+        self.assertEqual(codec.names, tuple(pack_names))
+        self.assertEqual(codec.size, 4+2+1+1+2+1+1+2)
+        self.assertEqual(codec.offsets[('reliable', 'seqnum')], 8)
+        self.assertEqual(codec.offsets[('control', 'peer_id_new')], 12)
+
+    def test_codec_round_trip(self):
+        packet_bytes = get_packet_bytes("server", "connected",
+                                        {'peer_id_new': 7})
+        packet = bytes_to_packet("server", "connected", packet_bytes)
+        self.assertEqual(packet.get('peer_id_new'), 7)
+        self.assertEqual(packet.get('type', 'reliable'), b'\x03')
+
+    def test_to_c_like_uses_index(self):
+        self.assertEqual(c_like_index['peer_id_new'][1], 'H')
+        self.assertEqual(to_c_like('channel', 1), b'\x01')
+        self.assertEqual(
+            to_c_like_values({'peer_id_new': "3", 'channel': 0}),
+            {'peer_id_new': 3, 'channel': b'\x00'},
+        )
+        self.assertRaises(ValueError, to_c_like, 'no_such_field', 0)
+
+    def test_register_recompiles(self):
+        codec = get_packet_codec("client", "disconnect")
+        register_packet_def(
+            'control',
+            'c_disconnect',
+            control_p_values_for['c_disconnect'],
+            types="cc",
+            names=('type', 'controltype'),
+        )
+        self.assertIsNot(codec, get_packet_codec("client", "disconnect"))
+        self.assertIn('controltype', c_like_index)
+
+    def test_buffer_to_packet_without_copy(self):
+        packet_bytes = get_packet_bytes("client", "connect", {})
+        ring = PacketBufferRing(count=2, size=64)
+        view = ring.next()
+        end = 3 + len(packet_bytes) + 5
+        view[3:end] = packet_bytes + b"hello"
+        packet = buffer_to_packet("client", "connect", view, 3, end)
+        self.assertEqual(packet.get('type', 'original'), b'\x01')
+        self.assertEqual(bytes(packet.payload), b"hello")
+        self.assertIs(packet.payload.obj, ring.data)
+        self.assertIsNot(ring.next(), view)
+        self.assertIs(ring.next(), view)
+
+    def test_truncated_packet_in_dirty_buffer(self):
+        ring = PacketBufferRing(count=1, size=64)
+        view = ring.next()
+        connected = get_packet_bytes("server", "connected",
+                                     {'peer_id_new': 9})
+        view[:len(connected)] = connected
+        # A shorter datagram received into the same buffer leaves the
+        #   end of the previous one after it.
+        view = ring.next()
+        with self.assertRaises(ValueError):
+            decode_packet(view, 0, len(connected) - 2)
+        with self.assertRaises(ValueError):
+            buffer_to_packet("server", "connected", view, 0,
+                             len(connected) - 1)
+        packet = decode_packet(view, 0, len(connected))
+        self.assertEqual(packet.peer_id_new, 9)
+
+    def test_packet_attributes(self):
+        packet_bytes = get_packet_bytes("server", "connected",
+                                        {'peer_id_new': 9})
+        packet = bytes_to_packet("server", "connected", packet_bytes)
+        self.assertIsInstance(packet, MinetestPacket)
+        self.assertFalse(hasattr(packet, '__dict__'))
+        self.assertEqual(packet.peer_id_new, 9)
+        self.assertEqual(packet.seqnum, 65500)
+        self.assertEqual(packet.sender_peer_id, 0)
+        self.assertRaises(KeyError, packet.get, 'peer_id_new', 'basic')
+        c_packet = bytes_to_packet(
+            "client",
+            "connect",
+            get_packet_bytes("client", "connect", {}),
+        )
+        self.assertFalse(hasattr(c_packet, 'peer_id_new'))
+        self.assertIs(type(MinetestPacket(packet.names, packet.values,
+                                          packet.fieldsdef)),
+                      type(packet))
+
+    def test_classify_packet(self):
+        cases = (
+            ("client", "connect", {}),
+            ("server", "connected", {'peer_id_new': 5}),
+            ("client", "disconnect", {'sender_peer_id': 5}),
+        )
+        for origin, purpose, values in cases:
+            packet_bytes = get_packet_bytes(origin, purpose, values)
+            codec = classify_packet(bytearray(packet_bytes))
+            self.assertEqual((codec.origin, codec.purpose),
+                             (origin, purpose))
+        packet = decode_packet(memoryview(packet_bytes + b"xy"))
+        self.assertEqual(packet.sender_peer_id, 5)
+        self.assertEqual(bytes(packet.payload), b"xy")
+        self.assertRaises(ValueError, classify_packet, packet_bytes[:7])
+        self.assertRaises(ValueError, classify_packet,
+                          packet_bytes[:7] + b"\x00\x7f")
+        self.assertRaises(ValueError, classify_packet,
+                          b"\x00" + packet_bytes[1:])
+
+    def test_batch_round_trip(self):
+        peer_ids = [2, 3, 4]
+        buffer, offsets = get_packets_bytes(
+            "server",
+            "connected",
+            [{'peer_id_new': peer_id} for peer_id in peer_ids],
+        )
+        self.assertEqual(len(offsets), 3)
+        self.assertEqual(
+            bytes(buffer[offsets[1]:offsets[2]]),
+            get_packet_bytes("server", "connected", {'peer_id_new': 3}),
+        )
+        column_buffer, _ = get_packets_bytes(
+            "server",
+            "connected",
+            {'peer_id_new': peer_ids},
+        )
+        self.assertEqual(column_buffer, buffer)
+        columns = bytes_to_columns("server", "connected", buffer)
+        self.assertEqual(columns[('control', 'peer_id_new')],
+                         tuple(peer_ids))
+        self.assertEqual(columns[('reliable', 'type')], (b'\x03',) * 3)
+        buffer, offsets = get_packets_bytes("client", "connect", {},
+                                            count=2)
+        self.assertEqual(len(buffer), 2 * 11)
+        self.assertRaises(ValueError, bytes_to_columns, "client",
+                          "connect", buffer[:-1])
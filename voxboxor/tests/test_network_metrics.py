@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+from __future__ import print_function
+from __future__ import division
+import asyncio
+import json
+import os
+import tempfile
+
+from unittest import TestCase
+
+from voxboxor.network.metrics import (
+    Counter,
+    Histogram,
+    metrics,
+)
+
+from voxboxor.network.transport import (
+    create_server,
+    open_connection,
+)
+
+from test_network_transport import (
+    EchoServer,
+    RecordingClient,
+    _wait_for,
+)
+
+
+class TestMetrics(TestCase):
+    def tearDown(self):
+        metrics.disable()
+        metrics.reset()
+
+    def test_prometheus_text(self):
+        counter = Counter("x_total", "Xs.", label="kind")
+        counter.inc(label_value="a")
+        counter.inc(2, label_value="b")
+        histogram = Histogram("y", "Ys.", (1, 10))
+        for value in (0.5, 1, 5, 50):
+            histogram.observe(value)
+        self.assertEqual(counter.total(), 3)
+        self.assertEqual(histogram.counts, [2, 1, 1])
+        self.assertEqual(
+            list(counter.prometheus_lines())[2:],
+            ['x_total{kind="a"} 1', 'x_total{kind="b"} 2'],
+        )
+        self.assertEqual(
+            list(histogram.prometheus_lines())[2:],
+            ['y_bucket{le="1"} 2', 'y_bucket{le="10"} 3',
+             'y_bucket{le="+Inf"} 4', 'y_sum 56.5', 'y_count 4'],
+        )
+
+    def test_disabled_records_nothing(self):
+        async def run():
+            server_transport, server = await create_server("127.0.0.1", 0)
+            host, port = server_transport.get_extra_info('sockname')[:2]
+            try:
+                _, client = await open_connection(host, port)
+                client.disconnect()
+            finally:
+                server_transport.close()
+        asyncio.run(run())
+        self.assertEqual(metrics.packets_in.total(), 0)
+        self.assertEqual(metrics.bytes_out.total(), 0)
+
+    def test_reliable_echo_is_counted(self):
+        metrics.enable()
+
+        async def run():
+            server_transport, server = await create_server(
+                "127.0.0.1", 0, protocol_factory=EchoServer,
+            )
+            host, port = server_transport.get_extra_info('sockname')[:2]
+            try:
+                _, client = await open_connection(
+                    host, port, protocol_factory=RecordingClient,
+                )
+                for i in range(20):
+                    client.send_reliable(i % 3, str(i).encode())
+                await _wait_for(lambda: len(client.received) == 20)
+                await _wait_for(client.connection.idle)
+                client.disconnect()
+                await _wait_for(lambda: not server.peers)
+            finally:
+                server_transport.close()
+        asyncio.run(run())
+        received = metrics.packets_in.snapshot()
+        sent = metrics.packets_out.snapshot()
+        # Both sides are in this process, so each datagram is counted
+        #   once sent and once received (none are lost on loopback).
+        self.assertEqual(received, sent)
+        self.assertEqual(received['connect'], 1)
+        self.assertEqual(received['connected'], 1)
+        self.assertEqual(received['disconnect'], 1)
+        self.assertEqual(received['reliable'], 40)
+        self.assertEqual(received['ack'], 40)
+        self.assertEqual(metrics.bytes_in.total(), metrics.bytes_out.total())
+        self.assertEqual(metrics.rtt.count, 40)
+        self.assertEqual(metrics.queue_depth.count, 40)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "metrics.json")
+            metrics.dump(path)
+            with open(path, 'r') as stream:
+                data = json.load(stream)
+            self.assertEqual(
+                data['voxboxor_packets_received_total']['reliable'], 40,
+            )
+            path = os.path.join(tmp, "metrics.prom")
+            metrics.dump(path, format="prometheus")
+            with open(path, 'r') as stream:
+                text = stream.read()
+            self.assertIn('voxboxor_packets_sent_total{purpose="ack"} 40',
+                          text)
+            self.assertEqual(sorted(os.listdir(tmp)),
+                             ["metrics.json", "metrics.prom"])
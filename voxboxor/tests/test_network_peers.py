@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+from __future__ import print_function
+from __future__ import division
+
+from unittest import TestCase
+
+from voxboxor.network.connection import (
+    PEER_ID_INEXISTENT,
+    PEER_ID_SERVER,
+)
+
+from voxboxor.network.peers import (
+    PEER_ID_FIRST,
+    PEER_ID_LAST,
+    PeerIdAllocator,
+    PeerTable,
+)
+
+
+class TestPeerIdAllocator(TestCase):
+    def test_allocate_every_id_once(self):
+        allocator = PeerIdAllocator(reserved=(10, 20))
+        peer_ids = []
+        while True:
+            peer_id = allocator.allocate()
+            if peer_id is None:
+                break
+            peer_ids.append(peer_id)
+        self.assertEqual(len(peer_ids), allocator.capacity)
+        self.assertEqual(len(set(peer_ids)), len(peer_ids))
+        self.assertEqual(allocator.capacity,
+                         PEER_ID_LAST - PEER_ID_FIRST + 1 - 2)
+        for peer_id in (PEER_ID_INEXISTENT, PEER_ID_SERVER, 10, 20):
+            self.assertNotIn(peer_id, peer_ids)
+            self.assertNotIn(peer_id, allocator)
+        self.assertIsNone(allocator.peek())
+
+    def test_released_ids_are_reused_last(self):
+        allocator = PeerIdAllocator(first=2, last=5)
+        self.assertEqual([allocator.allocate() for _ in range(3)],
+                         [2, 3, 4])
+        allocator.release(3)
+        allocator.release(2)
+        self.assertEqual(allocator.peek(), 5)
+        self.assertEqual([allocator.allocate() for _ in range(4)],
+                         [5, 3, 2, None])
+        with self.assertRaises(ValueError):
+            allocator.release(PEER_ID_SERVER)
+        allocator.release(4)
+        with self.assertRaises(ValueError):
+            allocator.release(4)
+        self.assertEqual(allocator.count, 3)
+
+
+class TestPeerTable(TestCase):
+    def test_addresses_map_both_ways(self):
+        table = PeerTable()
+        a = table.add(("127.0.0.1", 40000), 0.0)
+        b = table.add(("127.0.0.1", 40001), 0.0, data="b")
+        self.assertIs(table.get(a.peer_id), a)
+        self.assertIs(table.get_by_address(("127.0.0.1", 40001)), b)
+        self.assertEqual(b.data, "b")
+        with self.assertRaises(ValueError):
+            table.add(("127.0.0.1", 40000), 0.0)
+        table.remove(a.peer_id)
+        self.assertIsNone(table.get_by_address(("127.0.0.1", 40000)))
+        self.assertNotIn(a.peer_id, table)
+        stats = table.stats()
+        self.assertEqual(stats['peers'], 1)
+        self.assertEqual(stats['added'], 2)
+        self.assertEqual(stats['removed'], 1)
+
+    def test_reap_idle_peers(self):
+        table = PeerTable(timeout=30.0, slot_count=8)
+        peers = [table.add(("10.0.0.1", port), 0.0)
+                 for port in range(1000)]
+        now = 0.0
+        while now < 100.0:
+            now += 0.5
+            # Keep the even ports active.
+            for peer in peers[::2]:
+                table.touch(peer.peer_id, now)
+            reaped = table.reap(now)
+            if now < 30.0:
+                self.assertEqual(reaped, [])
+            elif reaped:
+                self.assertTrue(30.0 <= now <= 32.0)
+                self.assertEqual(len(reaped), 500)
+                self.assertTrue(all(peer.address[1] % 2 for peer in reaped))
+        self.assertEqual(len(table), 500)
+        self.assertEqual(table.stats()['reaped'], 500)
+        self.assertEqual(table.reap(now + 29.0), [])
+        # A gap longer than the whole wheel must not skip anyone.
+        self.assertEqual(len(table.reap(now + 1000.0)), 500)
+        self.assertEqual(len(table), 0)
+        self.assertEqual(table.allocator.count, 0)
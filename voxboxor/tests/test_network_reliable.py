@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+from __future__ import print_function
+from __future__ import division
+import heapq
+import random
+
+from unittest import TestCase
+
+from voxboxor.network.connection import (
+    clear_packet_codecs,
+    decode_packet,
+    packet_templates,
+)
+
+from voxboxor.network.reliable import (
+    ReliableConnection,
+    ReliableReceiver,
+    datagram_purpose,
+    seqnum_add,
+    seqnum_diff,
+)
+
+
+class LossyLink:
+    '''
+    Carry datagrams between two ReliableConnection objects in simulated
+    time, dropping, delaying, reordering and duplicating some of them.
+    '''
+    def __init__(self, a, b, loss=0.0, delay=0.02, jitter=0.0,
+                 duplicate=0.0, seed=0):
+        self.connections = (a, b)
+        self.loss = loss
+        self.delay = delay
+        self.jitter = jitter
+        self.duplicate = duplicate
+        self.random = random.Random(seed)
+        self.now = 0.0
+        self.sent_count = 0
+        self._events = []  # a heap of (time, counter, destination, data)
+        self._counter = 0
+        self.received = ([], [])
+
+    def _transmit(self, destination, datagrams):
+        for data in datagrams:
+            self.sent_count += 1
+            copies = 1
+            if self.random.random() < self.duplicate:
+                copies = 2
+            for _ in range(copies):
+                if self.random.random() < self.loss:
+                    continue
+                when = (self.now + self.delay
+                        + self.random.uniform(0, self.jitter))
+                self._counter += 1
+                heapq.heappush(self._events,
+                               (when, self._counter, destination, data))
+
+    def run(self, max_time=60.0):
+        '''
+        Run until both connections are idle and nothing is in transit.
+
+        Returns:
+        the simulated time in seconds.
+        '''
+        a, b = self.connections
+        while True:
+            self._transmit(1, a.datagrams(self.now))
+            self._transmit(0, b.datagrams(self.now))
+            deadlines = [deadline for deadline in
+                         (a.next_deadline(), b.next_deadline())
+                         if deadline is not None]
+            if self._events:
+                deadlines.append(self._events[0][0])
+            elif a.idle() and b.idle():
+                return self.now
+            self.now = max(self.now, min(deadlines))
+            if self.now > max_time:
+                raise RuntimeError("The transfer didn't finish in {}s"
+                                   "".format(max_time))
+            while self._events and self._events[0][0] <= self.now:
+                _, _, destination, data = heapq.heappop(self._events)
+                connection = self.connections[destination]
+                for channel, payload in connection.receive(
+                        decode_packet(data), self.now):
+                    self.received[destination].append((channel,
+                                                       bytes(payload)))
+
+
+class TestReliable(TestCase):
+    def test_seqnum_wraparound_math(self):
+        self.assertEqual(seqnum_add(65535, 1), 0)
+        self.assertEqual(seqnum_add(65500, 100), 64)
+        self.assertEqual(seqnum_diff(3, 65534), 5)
+        self.assertEqual(seqnum_diff(65534, 3), -5)
+
+    def test_lossy_reordering_link(self):
+        client = ReliableConnection("client", 7)
+        server = ReliableConnection("server", 1)
+        payloads = [str(i).encode() for i in range(2000)]
+        for payload in payloads:
+            client.send(1, payload)
+        server.send(0, b"hi")
+        link = LossyLink(client, server, loss=0.2, delay=0.02,
+                         jitter=0.03, duplicate=0.05, seed=1)
+        seconds = link.run()
+        self.assertEqual(link.received[1], [(1, p) for p in payloads])
+        self.assertEqual(link.received[0], [(0, b"hi")])
+        self.assertGreater(client.senders[1].resent_count, 0)
+        # Stop-and-wait would need at least 2000 round trips (80s).
+        self.assertLess(seconds, 10.0)
+
+    def test_wraparound_on_link(self):
+        client = ReliableConnection("client", 7, seqnum=65530)
+        server = ReliableConnection("server", 1, seqnum=65530)
+        payloads = [bytes((i,)) for i in range(100)]
+        for payload in payloads:
+            client.send(2, payload)
+        link = LossyLink(client, server, loss=0.1, jitter=0.02, seed=2)
+        link.run()
+        self.assertEqual(link.received[1], [(2, p) for p in payloads])
+        self.assertEqual(server.receivers[2].next_seqnum, 94)
+
+    def test_templates_are_cleared_with_codecs(self):
+        ReliableConnection("client", 7)
+        key = ("client", "reliable", 7, 3)
+        self.assertIn(key, packet_templates)
+        clear_packet_codecs()
+        self.assertEqual(packet_templates, {})
+        client = ReliableConnection("client", 7)
+        server = ReliableConnection("server", 1)
+        client.send(0, b"after")
+        link = LossyLink(client, server)
+        link.run()
+        self.assertEqual(link.received[1], [(0, b"after")])
+
+    def test_datagram_purpose(self):
+        client = ReliableConnection("client", 7)
+        server = ReliableConnection("server", 1)
+        client.send(0, b"small")
+        client.send(1, bytes(3000))
+        datagrams = client.datagrams(0.0)
+        self.assertEqual([datagram_purpose(data) for data in datagrams],
+                         ["reliable", "split", "split", "split"])
+        server.receive(decode_packet(datagrams[0]), 0.0)
+        self.assertEqual([datagram_purpose(data)
+                          for data in server.datagrams(0.0)], ["ack"])
+
+    def test_acks_are_coalesced(self):
+        receiver = ReliableReceiver(seqnum=10)
+        self.assertEqual(receiver.receive(11, b"b"), [])
+        self.assertEqual(receiver.receive(11, b"b"), [])
+        self.assertEqual(receiver.receive(10, b"a"), [b"a", b"b"])
+        self.assertEqual(receiver.receive(10, b"a"), [])
+        self.assertEqual(receiver.take_acks(), [11, 10])
+        self.assertEqual(receiver.take_acks(), [])
+
+    def test_split_payloads_on_link(self):
+        client = ReliableConnection("client", 7)
+        server = ReliableConnection("server", 1, max_packet_size=512)
+        rng = random.Random(4)
+        large = bytes(rng.getrandbits(8) for _ in range(300000))
+        client.send(0, b"small")
+        client.send(0, large)
+        server.send(1, large[:5000])
+        link = LossyLink(client, server, loss=0.1, jitter=0.02, seed=5)
+        link.run()
+        self.assertEqual(link.received[1], [(0, b"small"), (0, large)])
+        self.assertEqual(link.received[0], [(1, large[:5000])])
+        self.assertEqual(len(server.reassembler), 0)
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+from __future__ import print_function
+from __future__ import division
+
+from unittest import TestCase
+
+from voxboxor.network.connection import (
+    decode_packet,
+)
+
+from voxboxor.network.reliable import (
+    ReliableConnection,
+)
+
+from voxboxor.network.scheduler import (
+    CongestionWindow,
+    PeerScheduler,
+    SendScheduler,
+    TokenBucket,
+)
+
+from test_network_reliable import (
+    LossyLink,
+)
+
+
+class ScheduledConnection:
+    '''
+    Let LossyLink drive a PeerScheduler as if it were a
+    ReliableConnection.
+    '''
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self.connection = scheduler.connection
+
+    def datagrams(self, now):
+        return self.scheduler.datagrams(now)
+
+    def next_deadline(self):
+        return self.scheduler.deadline
+
+    def receive(self, packet, now):
+        return self.connection.receive(packet, now)
+
+    def idle(self):
+        return self.connection.idle()
+
+
+class TestScheduler(TestCase):
+    def test_token_bucket(self):
+        bucket = TokenBucket(1000, 500)
+        self.assertEqual(bucket.refill(0.0), 500)
+        bucket.consume(700)
+        self.assertEqual(bucket.ready_time(), 0.2 + 0.001)
+        self.assertEqual(bucket.refill(0.5), 300)
+        self.assertEqual(bucket.refill(10.0), 500)
+
+    def test_congestion_window(self):
+        window = CongestionWindow(size=8, min_size=4, max_size=100)
+        window.on_ack(8)
+        self.assertEqual(window.size, 16)
+        window.on_loss(1.0, 0.1)
+        self.assertEqual(window.size, 8)
+        window.on_loss(1.05, 0.1)  # the same round trip
+        self.assertEqual(window.size, 8)
+        window.on_ack(8)
+        # Congestion avoidance adds about one packet per window.
+        self.assertAlmostEqual(window.size, 9, delta=0.1)
+        self.assertEqual(window.available(5), 3)
+        self.assertEqual(window.available(20), 0)
+
+    def test_channel_weights_and_drops(self):
+        connection = ReliableConnection("server", 1)
+        peer = PeerScheduler(connection, rate=None, weights=(2, 1),
+                             window=CongestionWindow(size=6),
+                             max_queue_depth=10)
+        for channel in range(3):
+            for i in range(10):
+                self.assertTrue(peer.send(channel, bytes((channel, i))))
+        self.assertFalse(peer.send(0, b"full"))
+        self.assertFalse(peer.send(1, b"x" * 20000))  # 15 packets
+        self.assertEqual(peer.dropped_count, 2)
+        channels = [decode_packet(data).channel[0]
+                    for data in peer.datagrams(0.0)]
+        self.assertEqual(channels, [0, 0, 1, 2, 0, 0])
+        self.assertEqual(peer.queue_depths(), (6, 9, 9))
+        # Waiting for acks, not spinning.
+        self.assertEqual(peer.deadline,
+                         connection.next_resend_deadline())
+
+    def test_rate_limit_on_lossy_link(self):
+        client = ReliableConnection("client", 7)
+        server = ReliableConnection("server", 1)
+        peer = PeerScheduler(client, rate=1024 * 1024, burst=64 * 1024)
+        payload = bytes(range(256)) * 4096  # 1 MiB
+        peer.send(1, payload)
+        for i in range(100):
+            peer.send(0, str(i).encode())
+        link = LossyLink(ScheduledConnection(peer), server, loss=0.05,
+                         jitter=0.01, seed=4)
+        seconds = link.run()
+        self.assertEqual(link.received[1][-1], (1, payload))
+        self.assertEqual(len(link.received[1]), 101)
+        self.assertGreater(seconds, 0.9)
+        self.assertGreater(peer.window.loss_count, 0)
+        self.assertEqual(peer.stats()['dropped'], 0)
+
+    def test_flush_batches_peers(self):
+        scheduler = SendScheduler(rate=None)
+        connections = [ReliableConnection("server", 1) for _ in range(3)]
+        for key, connection in enumerate(connections):
+            scheduler.add(key, connection, ("127.0.0.1", 40000 + key))
+        for key in range(3):
+            scheduler.send(key, 0, b"hello")
+        sent = []
+        deadline = scheduler.flush(0.0, lambda data, address:
+                                   sent.append(address))
+        self.assertEqual(sorted(sent),
+                         [("127.0.0.1", 40000 + key) for key in range(3)])
+        self.assertGreater(deadline, 0.0)
+        sent.clear()
+        scheduler.flush(0.0, lambda data, address: sent.append(address))
+        self.assertEqual(sent, [])
+        scheduler.flush(deadline, lambda data, address:
+                        sent.append(address))
+        self.assertEqual(len(sent), 3)  # resent since nothing was acked
+        scheduler.remove(0)
+        stats = scheduler.stats()
+        self.assertEqual(stats['peers'], 2)
+        self.assertEqual(stats['sent'], 6)
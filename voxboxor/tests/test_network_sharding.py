@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+from __future__ import print_function
+from __future__ import division
+import asyncio
+import multiprocessing
+import socket
+import time
+
+from unittest import (
+    TestCase,
+    skipUnless,
+)
+
+from voxboxor.network.connection import (
+    PEER_ID_INEXISTENT,
+    PEER_ID_SERVER,
+)
+
+from voxboxor.network.peers import (
+    PEER_ID_FIRST,
+    PEER_ID_LAST,
+)
+
+from voxboxor.network.sharding import (
+    ShardedServer,
+    SharedPeerIdAllocator,
+    create_shared_peer_ids,
+    release_worker_peer_ids,
+)
+
+from voxboxor.network.transport import (
+    open_connection,
+)
+
+
+class TestSharedPeerIdAllocator(TestCase):
+    def setUp(self):
+        self.shm = create_shared_peer_ids(reserved=(100,))
+        self.lock = multiprocessing.Lock()
+
+    def tearDown(self):
+        self.shm.close()
+        self.shm.unlink()
+
+    def test_workers_never_collide(self):
+        workers = [SharedPeerIdAllocator(self.shm.name, self.lock, i)
+                   for i in range(3)]
+        try:
+            self.assertEqual(workers[0].capacity,
+                             PEER_ID_LAST - PEER_ID_FIRST + 1 - 1)
+            peer_ids = [[], [], []]
+            for _ in range(500):
+                for i, worker in enumerate(workers):
+                    peer_ids[i].append(worker.allocate())
+            flat = [peer_id for ids in peer_ids for peer_id in ids]
+            self.assertEqual(len(set(flat)), len(flat))
+            for peer_id in (PEER_ID_INEXISTENT, PEER_ID_SERVER, 100):
+                self.assertNotIn(peer_id, flat)
+            self.assertIn(peer_ids[1][0], workers[1])
+            self.assertNotIn(peer_ids[1][0], workers[0])
+            with self.assertRaises(ValueError):
+                workers[0].release(peer_ids[1][0])
+            workers[0].release(peer_ids[0][0])
+            self.assertEqual(workers[0].count, 499)
+            self.assertEqual(workers[0].total(), 1499)
+            # Freed IDs aren't reused until the others are used up.
+            self.assertNotEqual(workers[2].allocate(), peer_ids[0][0])
+            self.assertEqual(
+                release_worker_peer_ids(self.shm, self.lock, 1), 500,
+            )
+            self.assertEqual(workers[0].total(), 1000)
+        finally:
+            for worker in workers:
+                worker.close()
+
+
+@skipUnless(hasattr(socket, "SO_REUSEPORT"), "SO_REUSEPORT is required.")
+class TestShardedServer(TestCase):
+    def test_clients_across_workers(self):
+        with ShardedServer("127.0.0.1", 0, worker_count=2) as server:
+            async def run():
+                clients = await asyncio.gather(*(
+                    open_connection(server.host, server.port)
+                    for _ in range(40)
+                ))
+                peer_ids = [client.peer_id for _, client in clients]
+                self.assertEqual(len(set(peer_ids)), len(peer_ids))
+                self.assertEqual(server.peer_count(), 40)
+                for _, client in clients:
+                    client.disconnect()
+            asyncio.run(run())
+            deadline = time.monotonic() + 5.0
+            while server.peer_count() and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(server.peer_count(), 0)
+            self.assertEqual(server.check_workers(), [])
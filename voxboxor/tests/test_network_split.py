@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+from __future__ import print_function
+from __future__ import division
+import random
+
+from unittest import TestCase
+
+from voxboxor.network.split import (
+    SplitReassembler,
+    split_payload,
+)
+
+
+class TestSplit(TestCase):
+    def test_split_payload_is_zero_copy(self):
+        payload = bytes(range(256)) * 10
+        chunks = split_payload(payload, 1000)
+        self.assertEqual([len(chunk) for chunk in chunks],
+                         [1000, 1000, 560])
+        self.assertIs(chunks[0].obj, payload)
+        self.assertEqual(b"".join(chunks), payload)
+
+    def test_reassemble_in_any_order(self):
+        rng = random.Random(3)
+        payload = bytes(rng.getrandbits(8) for _ in range(10000))
+        chunks = list(enumerate(split_payload(payload, 999)))
+        rng.shuffle(chunks)
+        # Put the last chunk first so its offset isn't known yet.
+        chunks.sort(key=lambda pair: pair[0] != len(chunks) - 1)
+        reassembler = SplitReassembler()
+        for chunk_num, chunk in chunks[:-1]:
+            self.assertIsNone(reassembler.add(("peer", 0, 5), len(chunks),
+                                              chunk_num, chunk, 0.0))
+        chunk_num, chunk = chunks[-1]
+        result = reassembler.add(("peer", 0, 5), len(chunks), chunk_num,
+                                 chunk, 0.0)
+        self.assertEqual(bytes(result), payload)
+        self.assertEqual(len(reassembler), 0)
+        self.assertEqual(reassembler.memory_used, 0)
+
+    def test_budget_and_timeout(self):
+        reassembler = SplitReassembler(timeout=10.0, memory_budget=5000)
+        self.assertIsNone(reassembler.add(1, 3, 0, b"x" * 1000, 0.0))
+        self.assertIsNone(reassembler.add(2, 2, 0, b"y" * 1000, 1.0))
+        self.assertEqual(reassembler.memory_used, 5000)
+        # The oldest set is evicted to make room.
+        self.assertIsNone(reassembler.add(3, 2, 0, b"z" * 1000, 2.0))
+        self.assertEqual(reassembler.memory_used, 4000)
+        self.assertEqual(reassembler.evicted_count, 1)
+        self.assertEqual(len(reassembler), 2)
+        self.assertEqual(reassembler.expire(11.5), 1)
+        self.assertEqual(len(reassembler), 1)
+        self.assertEqual(reassembler.next_deadline(), 12.0)
+        # A set that could never fit is dropped.
+        self.assertIsNone(reassembler.add(4, 9, 0, b"w" * 1000, 3.0))
+        self.assertEqual(reassembler.dropped_count, 1)
+        self.assertEqual(bytes(reassembler.add(3, 2, 1, b"z", 4.0)),
+                         b"z" * 1001)
+        self.assertEqual(reassembler.memory_used, 0)
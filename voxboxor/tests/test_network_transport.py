@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+from __future__ import print_function
+from __future__ import division
+import asyncio
+
+from unittest import TestCase
+
+from voxboxor.network.peers import (
+    PeerTable,
+)
+
+from voxboxor.network.transport import (
+    ClientProtocol,
+    ServerProtocol,
+    create_server,
+    open_connection,
+)
+
+
+class EchoServer(ServerProtocol):
+    def on_payload(self, peer_id, channel, payload):
+        self.send_reliable(peer_id, channel, bytes(payload))
+
+
+class RecordingClient(ClientProtocol):
+    def __init__(self):
+        ClientProtocol.__init__(self)
+        self.received = []
+
+    def on_payload(self, channel, payload):
+        self.received.append((channel, bytes(payload)))
+
+
+async def _wait_for(condition, timeout=5.0):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not condition():
+        if loop.time() > deadline:
+            raise asyncio.TimeoutError("The condition never became true.")
+        await asyncio.sleep(0.01)
+
+
+class TestTransport(TestCase):
+    def test_loopback_handshake(self):
+        async def run():
+            server_transport, server = await create_server("127.0.0.1", 0)
+            host, port = server_transport.get_extra_info('sockname')[:2]
+            try:
+                clients = await asyncio.gather(*(
+                    open_connection(host, port) for _ in range(200)
+                ))
+                peer_ids = [client.peer_id for _, client in clients]
+                self.assertEqual(len(set(peer_ids)), len(peer_ids))
+                self.assertNotIn(0, peer_ids)
+                self.assertNotIn(1, peer_ids)
+                self.assertEqual(len(server.peers), len(peer_ids))
+                for _, client in clients:
+                    client.disconnect()
+                await _wait_for(lambda: not server.peers)
+                self.assertEqual(server.peer_ids, {})
+            finally:
+                server_transport.close()
+        asyncio.run(run())
+
+    def test_connect_timeout(self):
+        async def run():
+            server_transport, server = await create_server("127.0.0.1", 0)
+            host, port = server_transport.get_extra_info('sockname')[:2]
+            server_transport.close()
+            with self.assertRaises(asyncio.TimeoutError):
+                await open_connection(host, port, timeout=0.2)
+        asyncio.run(run())
+
+    def test_reliable_echo(self):
+        async def run():
+            server_transport, server = await create_server(
+                "127.0.0.1", 0, protocol_factory=EchoServer,
+            )
+            host, port = server_transport.get_extra_info('sockname')[:2]
+            try:
+                _, client = await open_connection(
+                    host, port, protocol_factory=RecordingClient,
+                )
+                payloads = [(i % 3, str(i).encode()) for i in range(300)]
+                payloads.append((1, bytes(range(256)) * 1000))
+                for channel, payload in payloads:
+                    client.send_reliable(channel, payload)
+                await _wait_for(
+                    lambda: len(client.received) == len(payloads)
+                )
+                for channel in range(3):
+                    self.assertEqual(
+                        [p for c, p in client.received if c == channel],
+                        [p for c, p in payloads if c == channel],
+                    )
+                await _wait_for(client.connection.idle)
+                client.disconnect()
+                await _wait_for(lambda: not server.peers)
+            finally:
+                server_transport.close()
+        asyncio.run(run())
+
+    def test_idle_peer_times_out(self):
+        async def run():
+            server_transport, server = await create_server(
+                "127.0.0.1", 0,
+                protocol_factory=lambda: ServerProtocol(
+                    peer_table=PeerTable(timeout=0.2, resolution=0.05),
+                    reap_interval=0.05,
+                ),
+            )
+            host, port = server_transport.get_extra_info('sockname')[:2]
+            try:
+                client_transport, client = await open_connection(host, port)
+                self.assertEqual(len(server.peers), 1)
+                await _wait_for(lambda: not server.peers, timeout=2.0)
+                self.assertEqual(server.peer_table.stats()['reaped'], 1)
+                client_transport.close()
+            finally:
+                server_transport.close()
+        asyncio.run(run())
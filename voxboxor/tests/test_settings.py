@@ -0,0 +1,488 @@
+#!/usr/bin/env python3
+from __future__ import print_function
+from __future__ import division
+import io
+import os
+import sys
+import tempfile
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+from unittest import TestCase
+
+from voxboxor.settings import (
+    NOISE_FLAG_ABSVALUE,
+    NOISE_FLAG_DEFAULTS,
+    NOISE_FLAG_EASED,
+    FlagDesc,
+    NoiseParams,
+    SettingNotFoundException,
+    Settings,
+    SettingsHierarchy,
+    SettingsLayer,
+    ValueSpec,
+    ValueType,
+)
+
+CONFIG = '''# A comment
+name = value
+  spaced  =  two words
+not a setting
+noise = {
+	offset = 0
+	spread = (600, 600, 600)
+	inner = {
+		x = 1
+		}
+	}
+text = """
+first line
+  indented line
+"""
+'''
+
+
+def _hierarchy():
+    h = SettingsHierarchy()
+    defaults = Settings(h=h, settings_layer=SettingsLayer.SL_DEFAULTS)
+    settings = Settings(h=h, settings_layer=SettingsLayer.SL_GLOBAL)
+    return h, defaults, settings
+
+
+class TestSettings(TestCase):
+    def test_parse_config_lines(self):
+        settings = Settings()
+        self.assertTrue(settings.parseConfigLines(io.StringIO(CONFIG)))
+        self.assertEqual(settings.getNames(),
+                         ["name", "spaced", "noise", "text"])
+        self.assertEqual(settings.get("spaced"), "two words")
+        self.assertEqual(settings.get("text"),
+                         "first line\n  indented line")
+        noise = settings.getGroup("noise")
+        self.assertEqual(noise.getV3F("spread"), (600.0, 600.0, 600.0))
+        self.assertEqual(noise.getGroup("inner").getInt("x"), 1)
+        self.assertRaises(SettingNotFoundException, settings.get, "noise")
+        self.assertIsNone(settings.get("missing", noEx=True))
+
+        out = io.StringIO()
+        settings.writeLines(out)
+        copy = Settings()
+        self.assertTrue(copy.parseConfigLines(out.getvalue().splitlines()))
+        again = io.StringIO()
+        copy.writeLines(again)
+        self.assertEqual(again.getvalue(), out.getvalue())
+
+    def test_missing_group_end(self):
+        settings = Settings()
+        self.assertFalse(settings.parseConfigLines(["a = 1", "g = {",
+                                                    "b = 2"]))
+
+    def test_typed_values(self):
+        settings = Settings()
+        self.assertTrue(settings.setBool("b", True))
+        self.assertTrue(settings.setInt("i", -3))
+        self.assertTrue(settings.setFloat("f", 0.5))
+        self.assertTrue(settings.setV2F("v", (1, 2.5)))
+        self.assertTrue(settings.set("yes", " Yes "))
+        self.assertTrue(settings.set("number", "12 nodes"))
+        self.assertTrue(settings.getBool("b"))
+        self.assertTrue(settings.getBool("yes"))
+        self.assertTrue(settings.getBool("number"))
+        self.assertEqual(settings.getInt("i"), -3)
+        self.assertEqual(settings.getFloat("f"), 0.5)
+        self.assertEqual(settings.getV2F("v"), (1.0, 2.5))
+        self.assertRaises(ValueError, settings.getInt, "number")
+        self.assertIsNone(settings.getInt("number", noEx=True))
+        self.assertFalse(settings.set("bad name", "x"))
+        self.assertFalse(settings.set("x", '"""'))
+        self.assertFalse(settings.exists("bad name"))
+
+    def test_layers(self):
+        h, defaults, settings = _hierarchy()
+        defaults.set("a", "default")
+        defaults.set("b", "default")
+        settings.set("b", "global")
+        self.assertEqual(settings.get("a"), "default")
+        self.assertEqual(settings.get("b"), "global")
+        self.assertRaises(SettingNotFoundException, defaults.get, "c")
+
+        # Changes to a lower layer reach the merged view of the upper one.
+        defaults.set("a", "changed")
+        defaults.set("c", "new")
+        self.assertEqual(settings.get("a"), "changed")
+        self.assertEqual(settings.get("c"), "new")
+        self.assertTrue(settings.remove("b"))
+        self.assertFalse(settings.remove("b"))
+        self.assertEqual(settings.get("b"), "default")
+        defaults.remove("c")
+        self.assertFalse(settings.exists("c"))
+
+        # A layer created between them takes effect.
+        game = Settings(h=h, settings_layer=SettingsLayer.SL_GAME)
+        self.assertIs(settings._getParent(), game)
+        self.assertTrue(game.parseConfigLines(["a = game", "g = {",
+                                               "x = 1", "}"]))
+        self.assertEqual(settings.get("a"), "game")
+        self.assertEqual(settings.getGroup("g").get("x"), "1")
+        self.assertEqual(defaults.get("a"), "changed")
+        settings.set("a", "global")
+        game.clearNoLock()
+        self.assertEqual(settings.get("a"), "global")
+        self.assertFalse(settings.exists("g"))
+        settings.clearDefaultsNoLock()
+        self.assertEqual(defaults.getNames(), [])
+        self.assertRaises(ValueError, Settings, h=h,
+                          settings_layer=SettingsLayer.SL_GAME)
+
+        other = Settings()
+        other.set("a", "other")
+        other.set("d", "other")
+        game.updateNoLock(other)
+        settings.remove("a")
+        self.assertEqual(settings.get("a"), "other")
+        self.assertEqual(settings.get("d"), "other")
+
+    def test_merged_view_matches_walk(self):
+        h, defaults, settings = _hierarchy()
+        game = Settings(h=h, settings_layer=SettingsLayer.SL_GAME)
+        layers = (defaults, game, settings)
+        names = ["s{}".format(i) for i in range(20)]
+        for i in range(300):
+            layer = layers[i % 3]
+            name = names[(i * 7) % len(names)]
+            if i % 5 == 0:
+                layer.remove(name)
+            else:
+                layer.set(name, str(i))
+            for check in names:
+                self.assertIs(settings._getEntry(check),
+                              settings._findEntry(check))
+
+    def test_one_name_update_copies_merged_view(self):
+        h, defaults, settings = _hierarchy()
+        defaults.set("a", "1")
+        defaults.set("b", "2")
+        # A reader may be iterating the view without the lock.
+        view = settings._getMerged()
+        names = iter(view)
+        next(names)
+        defaults.remove("a")
+        defaults.set("new", "3")
+        self.assertEqual(list(names), list(view)[1:])
+        self.assertEqual(view["a"].value, "1")
+        self.assertNotIn("new", view)
+        self.assertFalse(settings.exists("a"))
+        self.assertEqual(settings.get("new"), "3")
+        defaults.set("b", "4")
+        self.assertEqual(settings.get("b"), "4")
+
+    def test_typed_cache(self):
+        h, defaults, settings = _hierarchy()
+        defaults.set("i", "1")
+        defaults.set("v", "(1, 2, 3)")
+        for _ in range(3):
+            self.assertEqual(settings.getInt("i"), 1)
+            self.assertEqual(settings.getV3F("v"), (1.0, 2.0, 3.0))
+        self.assertEqual(settings.getFloat("i"), 1.0)  # another type
+        self.assertEqual(settings.getCacheStats(),
+                         {'hits': 4, 'misses': 3, 'names': 2})
+
+        # Each change only discards the cached values of its name.
+        defaults.set("i", "2")
+        self.assertEqual(settings.getInt("i"), 2)
+        self.assertEqual(settings.getV3F("v"), (1.0, 2.0, 3.0))
+        self.assertEqual(settings.getCacheStats()['misses'], 4)
+        settings.set("i", "3")
+        self.assertEqual(settings.getInt("i"), 3)
+        self.assertEqual(defaults.getInt("i"), 2)
+        settings.remove("i")
+        self.assertEqual(settings.getInt("i"), 2)
+        other = Settings()
+        other.set("i", "4")
+        settings.updateNoLock(other)
+        self.assertEqual(settings.getInt("i"), 4)
+        game = Settings(h=h, settings_layer=SettingsLayer.SL_GAME)
+        game.set("v", "(4, 5, 6)")
+        self.assertEqual(settings.getV3F("v"), (4.0, 5.0, 6.0))
+        settings.clearNoLock()
+        self.assertEqual(settings.getInt("i"), 2)
+
+        # Values that can't be parsed aren't cached.
+        defaults.set("bad", "x")
+        self.assertIsNone(settings.getInt("bad", noEx=True))
+        self.assertIsNone(settings.getInt("bad", noEx=True))
+        self.assertIsNone(settings.getInt("missing", noEx=True))
+        self.assertNotIn("bad", settings._m_typed)
+
+    def test_flags(self):
+        h, defaults, settings = _hierarchy()
+        desc = FlagDesc((("a", 0x1), ("b", 0x2), ("c", 0x4)))
+        self.assertEqual(desc.readFlagString("a, noc"), (0x1, 0x5))
+        self.assertEqual(desc.writeFlagString(0x1, 0x5), "a, noc")
+        settings.setDefault("f", desc, 0x3)
+        self.assertEqual(defaults.get("f"), "a, b, noc")
+        self.assertEqual(settings.getFlagStr("f"), 0x3)
+        with self.assertRaisesRegex(TypeError, "flags"):
+            settings.setDefault("g", desc)
+        self.assertFalse(defaults.exists("g"))
+        # Only the flags named in a higher layer override lower ones.
+        settings.set("f", "nob, c")
+        self.assertEqual(settings.getFlagStr("f"), 0x5)
+        self.assertEqual(settings.getFlagStr("f"), 0x5)  # cached
+        defaults.set("f", "noa")
+        self.assertEqual(settings.getFlagStr("f"), 0x4)
+        self.assertTrue(settings.setFlagStr("f", 0x2, flagmask=0x2))
+        self.assertEqual(settings.get("f"), "b")
+        self.assertEqual(settings.getFlagStr("f"), 0x2)
+        settings.set("f", "6")  # a number sets every flag
+        self.assertEqual(settings.getFlagStr("f"), 0x6)
+        self.assertIsNone(settings.getFlagStr("missing", desc, noEx=True))
+        with self.assertRaises(SettingNotFoundException):
+            settings.getFlagStr("missing", desc)
+        self.assertFalse(settings.setFlagStr("missing", 0x1))
+        settings.set("yes", "true")
+        self.assertTrue(settings.getFlag("yes"))
+        self.assertFalse(settings.getFlag("missing"))
+
+    def test_noise_params(self):
+        h, defaults, settings = _hierarchy()
+        defaults.set("np", "1, 2, (3, 4, 5), 6, 7, 0.5")
+        np = settings.getNoiseParams("np")
+        self.assertEqual(
+            (np.offset, np.scale, np.spread, np.seed, np.octaves,
+             np.persist, np.lacunarity, np.flags),
+            (1.0, 2.0, (3.0, 4.0, 5.0), 6, 7, 0.5, 2.0,
+             NOISE_FLAG_DEFAULTS),
+        )
+        self.assertIsNone(settings.getNoiseParams("missing"))
+        self.assertIsNone(settings.getNoiseParamsFromGroup("np"))
+
+        expected = NoiseParams()
+        expected.offset = -3.0
+        expected.spread = (600.0, 600.0, 600.0)
+        expected.flags = NOISE_FLAG_EASED | NOISE_FLAG_ABSVALUE
+        self.assertTrue(settings.setNoiseParams("np", expected))
+        self.assertEqual(settings.getNoiseParams("np"), expected)
+        self.assertEqual(settings.getNoiseParams("np"), expected)  # cached
+        self.assertIsNone(settings.getNoiseParamsFromValue("np"))
+        # Groups are changed in place, which must discard cached values.
+        settings.getGroup("np").set("octaves", "9")
+        self.assertEqual(settings.getNoiseParams("np").octaves, 9)
+        settings.getGroup("np").set("flags", "absvalue")
+        self.assertEqual(settings.getNoiseParams("np").flags,
+                         NOISE_FLAG_ABSVALUE)
+        settings.getGroup("np").remove("flags")
+        self.assertEqual(settings.getNoiseParams("np").flags,
+                         NOISE_FLAG_DEFAULTS)
+
+        settings = Settings()
+        self.assertTrue(settings.parseConfigLines(io.StringIO(CONFIG)))
+        np = settings.getNoiseParams("noise")
+        self.assertEqual((np.offset, np.spread, np.seed),
+                         (0.0, (600.0, 600.0, 600.0), 12345))
+
+    def test_parse_command_line(self):
+        h, defaults, settings = _hierarchy()
+        cmd_args = Settings(h=h, settings_layer=SettingsLayer.SL_COMMANDLINE)
+        options = {
+            'verbose': ValueSpec(ValueType.VALUETYPE_FLAG),
+            'port': ValueSpec(ValueType.VALUETYPE_STRING),
+        }
+        changed = []
+        cmd_args.registerChangedCallback(
+            "port", lambda names, _: changed.append(sorted(names)))
+        settings.set("port", "30000")
+        self.assertTrue(cmd_args.parseCommandLine(
+            ["prog", "--verbose", "world", "--port", "30001", "x"],
+            options,
+        ))
+        self.assertEqual(changed, [["port"]])
+        self.assertEqual(cmd_args.get("nonopt0"), "world")
+        self.assertEqual(cmd_args.get("nonopt1"), "x")
+        self.assertTrue(cmd_args.getFlag("verbose"))
+        # The command line overrides SL_GLOBAL without changing it.
+        self.assertEqual(cmd_args.getInt("port"), 30001)
+        self.assertEqual(settings.get("port"), "30000")
+
+        # Nothing is set unless every argument is valid.
+        for argv in (["--port"], ["--unknown"], ["-v"],
+                     ["--port", '"""']):
+            self.assertFalse(cmd_args.parseCommandLine(
+                ["prog", "--verbose", "other"] + argv, options))
+        self.assertEqual(cmd_args.get("nonopt0"), "world")
+        self.assertEqual(len(changed), 1)
+
+    def test_update_config_file(self):
+        original = ('# Server settings\n'
+                    'name = old\n'
+                    '\n'
+                    '# kept as written\n'
+                    'port  =  30000\n'
+                    'removed = 1\n'
+                    'noise = {\n'
+                    '\t# inner comment\n'
+                    '\toffset = 0\n'
+                    '\tscale = 1\n'
+                    '\t}\n'
+                    'motd = """\n'
+                    'Welcome\n'
+                    '"""\n')
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "minetest.conf")
+            with open(path, 'w') as stream:
+                stream.write(original)
+            os.chmod(path, 0o640)
+            settings = Settings()
+            self.assertTrue(settings.readConfigFile(path))
+
+            # Nothing differs, so the file is left alone.
+            before = os.stat(path)
+            self.assertTrue(settings.updateConfigFile(path))
+            after = os.stat(path)
+            self.assertEqual(after.st_ino, before.st_ino)
+            self.assertEqual(after.st_mtime_ns, before.st_mtime_ns)
+
+            settings.set("name", "new")
+            settings.remove("removed")
+            settings.getGroup("noise").set("scale", "2")
+            settings.set("added", "yes")
+            self.assertTrue(settings.updateConfigFile(path))
+            with open(path, 'r') as stream:
+                text = stream.read()
+            self.assertEqual(text, ('# Server settings\n'
+                                    'name = new\n'
+                                    '\n'
+                                    '# kept as written\n'
+                                    'port  =  30000\n'
+                                    'noise = {\n'
+                                    '\t# inner comment\n'
+                                    '\toffset = 0\n'
+                                    '\tscale = 2\n'
+                                    '\t}\n'
+                                    'motd = """\n'
+                                    'Welcome\n'
+                                    '"""\n'
+                                    'added = yes\n'))
+            self.assertEqual(os.stat(path).st_mode & 0o777, 0o640)
+            self.assertEqual(os.listdir(tmp), ["minetest.conf"])
+
+            # Not dirty and the file is the one written, so it isn't
+            #   even read.
+            settings._updateConfigObject = None
+            self.assertTrue(settings.updateConfigFile(path))
+            del settings._updateConfigObject
+
+            # The file changed since, so it is checked again.
+            with open(path, 'a') as stream:
+                stream.write("other = 1\n")
+            self.assertTrue(settings.updateConfigFile(path))
+            with open(path, 'r') as stream:
+                self.assertNotIn("other", stream.read())
+
+            missing = os.path.join(tmp, "new.conf")
+            self.assertTrue(Settings().updateConfigFile(missing))
+            self.assertFalse(os.path.exists(missing))
+
+    def test_changed_callbacks(self):
+        settings = Settings()
+        calls = []
+
+        def changed(names, userdata):
+            calls.append((names, userdata))
+
+        watched = {}
+        settings.registerChangedCallback("a", changed, watched)
+        settings.registerChangedCallback("b", changed, watched)
+        settings.registerChangedCallback("b", changed, "other")
+        settings.set("a", "1")
+        self.assertEqual(calls, [({"a"}, watched)])
+
+        # A bulk change calls each callback once.
+        del calls[:]
+        other = Settings()
+        for name in ("a", "b", "c"):
+            other.set(name, "2")
+        settings.updateNoLock(other)
+        self.assertEqual(sorted(calls, key=lambda call: str(call[1])),
+                         [({"b"}, "other"), ({"a", "b"}, watched)])
+        del calls[:]
+        settings.parseConfigLines(["a = 3", "c = 3", "b = 3"])
+        self.assertEqual(len(calls), 2)
+        del calls[:]
+        settings.remove("c")
+        self.assertEqual(calls, [])
+
+        settings.deregisterChangedCallback("b", changed, watched)
+        settings.clearNoLock()
+        self.assertEqual(sorted(calls, key=lambda call: str(call[1])),
+                         [({"b"}, "other"), ({"a"}, watched)])
+
+        # Callbacks can run in another thread.
+        del calls[:]
+        executor = ThreadPoolExecutor(1)
+        settings.setCallbackExecutor(executor)
+        settings.set("a", "4")
+        executor.shutdown(wait=True)
+        self.assertEqual(calls, [({"a"}, watched)])
+
+    def test_concurrent_readers(self):
+        h, defaults, settings = _hierarchy()
+        game = Settings(h=h, settings_layer=SettingsLayer.SL_GAME)
+        names = ["k{}".format(i) for i in range(200)]
+        for name in names:
+            defaults.set(name, "0")
+        generations = []
+        for generation in range(1, 21):
+            other = Settings()
+            for name in names:
+                other.set(name, str(generation))
+            generations.append(other)
+        stop = threading.Event()
+        errors = []
+
+        def read():
+            try:
+                while not stop.is_set():
+                    # Each update of the game layer changes every name,
+                    #   so a view must never mix generations.
+                    merged = settings._getMerged()
+                    values = {merged[name].value for name in names}
+                    if len(values) != 1:
+                        errors.append(values)
+                        return
+                    value = settings.getInt(names[0])
+                    if not (0 <= value <= 20):
+                        errors.append(value)
+                        return
+                    settings.get("single", noEx=True)
+                    settings.getNames()
+            except Exception as ex:
+                errors.append(ex)
+
+        def write():
+            for other in generations:
+                game.updateNoLock(other)
+                settings.set("single", "1")
+                settings.remove("single")
+                settings.parseConfigLines(["a = 1", "g = {", "b = 2",
+                                           "}"])
+                settings.clearNoLock()
+            game.clearNoLock()
+
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-5)
+        try:
+            readers = [threading.Thread(target=read) for _ in range(8)]
+            for reader in readers:
+                reader.start()
+            for _ in range(20):
+                write()
+            stop.set()
+            for reader in readers:
+                reader.join()
+        finally:
+            sys.setswitchinterval(interval)
+        self.assertEqual(errors, [])
+        self.assertEqual(settings.getInt(names[0]), 0)
+        self.assertEqual(settings.getNames(), [])